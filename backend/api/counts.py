@@ -4,8 +4,10 @@ Módulo de conteos físicos de inventario
 """
 
 from fastapi import APIRouter, HTTPException, Depends, status, Query
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
-from sqlalchemy import create_engine, and_, func
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy import create_engine, and_
 from pydantic import BaseModel
 from typing import List, Optional
 from decimal import Decimal
@@ -16,14 +18,30 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from backend.models.database import (
-    PhysicalCount, PhysicalCountItem, Product, User, StockMovement, get_db
+    PhysicalCount, PhysicalCountItem, Product, User, get_db
 )
-from backend.models.enums import CountType, CountStatus, StockMovementType
+from backend.models.enums import CountType, CountStatus
 from backend.api.auth import get_current_user, SessionLocal
+from backend.utils.pagination import order_by_keyset, paginate_keyset
+from backend.utils.data_version import bump_tenant_version
+from backend.utils.stock import apply_stock_delta
+from backend.utils.concurrency import VersionConflictError
 
 # Router
 router = APIRouter()
 
+def count_item_state(item: PhysicalCountItem) -> dict:
+    """Current state of a count item (sent back with 409 conflicts)"""
+    return jsonable_encoder({
+        "id": item.id,
+        "product_id": item.product_id,
+        "system_stock": item.system_stock,
+        "physical_count": item.physical_count,
+        "difference": item.difference,
+        "adjustment_made": item.adjustment_made,
+        "version": item.version
+    })
+
 # Pydantic models
 class CountItemCreate(BaseModel):
     product_id: int
@@ -127,6 +145,7 @@ async def start_physical_count(
         })
     
     db.commit()
+    bump_tenant_version(db, current_user.restaurant_id)
     
     return {
         "message": "Physical count started successfully",
@@ -172,7 +191,8 @@ async def get_current_count(
             "physical_count": item.physical_count,
             "difference": item.difference,
             "adjustment_made": item.adjustment_made,
-            "cost_variance": variance
+            "cost_variance": variance,
+            "version": item.version
         })
     
     return {
@@ -192,6 +212,7 @@ async def get_current_count(
 async def update_count_item(
     item_id: int,
     physical_count: Decimal,
+    version: Optional[int] = Query(None, description="Version of the item being edited; a concurrent change returns 409"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -210,17 +231,27 @@ async def update_count_item(
     if count.status != CountStatus.IN_PROGRESS:
         raise HTTPException(status_code=400, detail="Cannot update completed count")
     
-    # Update item
-    item.physical_count = physical_count
-    item.difference = physical_count - item.system_stock
-    
-    db.commit()
+    # Update item (the flush compares and bumps the item version)
+    try:
+        if version is not None and version != item.version:
+            raise VersionConflictError(item.version)
+        item.physical_count = physical_count
+        item.difference = physical_count - item.system_stock
+        db.commit()
+    except (VersionConflictError, StaleDataError):
+        db.rollback()
+        raise HTTPException(status_code=409, detail={
+            "message": "Count item was modified by another request",
+            "current": count_item_state(item)
+        })
+    bump_tenant_version(db, current_user.restaurant_id)
     
     return {
         "message": "Count item updated successfully",
         "item_id": item_id,
         "physical_count": physical_count,
-        "difference": item.difference
+        "difference": item.difference,
+        "version": item.version
     }
 
 @router.post("/save-partial")
@@ -240,6 +271,7 @@ async def save_partial_count(
         raise HTTPException(status_code=400, detail="No ongoing count to save")
     
     updated_count = 0
+    conflicts = []
     for item_data in items:
         item = db.query(PhysicalCountItem).filter(
             PhysicalCountItem.id == item_data['item_id'],
@@ -247,11 +279,25 @@ async def save_partial_count(
         ).first()
         
         if item:
+            # Items sent with a version are only saved if nobody changed them since
+            if item_data.get('version') is not None and item_data['version'] != item.version:
+                conflicts.append(count_item_state(item))
+                continue
             item.physical_count = Decimal(str(item_data['physical_count']))
             item.difference = item.physical_count - item.system_stock
             updated_count += 1
     
-    db.commit()
+    try:
+        if conflicts:
+            raise VersionConflictError()
+        db.commit()
+    except (VersionConflictError, StaleDataError):
+        db.rollback()
+        raise HTTPException(status_code=409, detail={
+            "message": "Some count items were modified by another request; nothing was saved",
+            "conflicts": conflicts
+        })
+    bump_tenant_version(db, current_user.restaurant_id)
     
     return {
         "message": f"Partial count saved. {updated_count} items updated.",
@@ -281,39 +327,44 @@ async def finalize_count(
     total_variance = Decimal('0.0')
     
     if apply_adjustments:
-        for item in items:
-            if item.difference != Decimal('0.0') and not item.adjustment_made:
-                # Get product (with lock)
-                product = db.query(Product).filter(Product.id == item.product_id).with_for_update().first()
-                if product:
-                    # Create stock movement
-                    movement_type = StockMovementType.IN if item.difference > Decimal('0.0') else StockMovementType.OUT
-                    reason = f"Physical count adjustment - {count.count_type}"
-                    
-                    movement = StockMovement(
-                        product_id=product.id,
-                        movement_type=movement_type,
-                        quantity=abs(item.difference),
-                        previous_stock=item.system_stock,
-                        new_stock=item.physical_count,
-                        reason=reason,
-                        reference_id=f"COUNT-{count.id}",
-                        user_id=current_user.id,
-                        restaurant_id=current_user.restaurant_id
-                    )
-                    db.add(movement)
-                    
-                    # Update product stock
-                    product.current_stock = item.physical_count
-                    product.last_count_date = datetime.now().date()
-                    
-                    # Mark adjustment as made
-                    item.adjustment_made = True
-                    adjustments_made += 1
-                    
-                    # Calculate variance
-                    variance = abs(item.difference) * Decimal(str(product.cost_price))
-                    total_variance += variance
+        pending = [item for item in items if item.difference != Decimal('0.0') and not item.adjustment_made]
+        cost_prices = dict(db.query(Product.id, Product.cost_price).filter(
+            Product.id.in_([item.product_id for item in pending])
+        ).all()) if pending else {}
+        
+        # Claim the items first: the flush compares their versions, so a
+        # concurrent finalize or edit makes this one fail before any stock moves
+        for item in pending:
+            item.adjustment_made = True
+        try:
+            db.flush()
+        except StaleDataError:
+            db.rollback()
+            raise HTTPException(status_code=409, detail="Count was modified by another request")
+        
+        for item in pending:
+            # Apply the counted difference as an atomic delta, so movements
+            # recorded while the count was in progress are kept
+            change = apply_stock_delta(
+                db,
+                item.product_id,
+                item.difference,
+                restaurant_id=current_user.restaurant_id,
+                user_id=current_user.id,
+                reason=f"Physical count adjustment - {count.count_type}",
+                reference_id=f"COUNT-{count.id}",
+                last_count_date=datetime.now().date()
+            )
+            if not change:
+                # Product no longer exists: leave the item unadjusted
+                item.adjustment_made = False
+                continue
+            
+            adjustments_made += 1
+            
+            # Calculate variance
+            variance = abs(item.difference) * Decimal(str(cost_prices.get(item.product_id) or 0))
+            total_variance += variance
     
     # Finalize count
     count.status = CountStatus.COMPLETED
@@ -321,6 +372,7 @@ async def finalize_count(
     count.completed_at = datetime.utcnow()
     
     db.commit()
+    bump_tenant_version(db, current_user.restaurant_id)
     
     return {
         "message": f"Physical count finalized. {adjustments_made} adjustments applied.",
@@ -333,12 +385,17 @@ async def finalize_count(
 async def get_count_history(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="Keyset cursor; send an empty value for the first page"),
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get physical count history"""
+    """Get physical count history
+    
+    With `cursor` the list is paginated by (started_at, id) newest first and
+    returned as {items, next_cursor}; skip/limit is kept for older clients.
+    """
     
     query = db.query(PhysicalCount).filter(
         PhysicalCount.restaurant_id == current_user.restaurant_id
@@ -351,7 +408,13 @@ async def get_count_history(
     if date_to:
         query = query.filter(PhysicalCount.started_at <= datetime.strptime(date_to, '%Y-%m-%d'))
     
-    counts = query.order_by(PhysicalCount.started_at.desc()).offset(skip).limit(limit).all()
+    sort_key = (PhysicalCount.started_at, PhysicalCount.id)
+    next_cursor = None
+    
+    if cursor is not None:
+        counts, next_cursor = paginate_keyset(query, sort_key, cursor, limit, descending=True)
+    else:
+        counts = order_by_keyset(query, sort_key, descending=True).offset(skip).limit(limit).all()
     
     result = []
     for count in counts:
@@ -368,6 +431,9 @@ async def get_count_history(
             "item_count": item_count
         })
     
+    if cursor is not None:
+        return {"items": result, "next_cursor": next_cursor}
+    
     return result
 
 @router.get("/{count_id}")
@@ -406,7 +472,8 @@ async def get_count_details(
             "physical_count": item.physical_count,
             "difference": item.difference,
             "adjustment_made": item.adjustment_made,
-            "cost_variance": variance
+            "cost_variance": variance,
+            "version": item.version
         })
     
     return {
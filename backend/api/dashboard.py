@@ -3,7 +3,7 @@ Dashboard module
 Módulo de dashboard ejecutivo
 """
 
-from fastapi import APIRouter, HTTPException, Depends, status, Query
+from fastapi import APIRouter, HTTPException, Depends, status, Query, Request, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import create_engine, func, and_, case
 from pydantic import BaseModel
@@ -17,17 +17,31 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from backend.models.database import (
     Product, StockMovement, Invoice, WasteLog, Alert, 
-    PhysicalCount, User, Category, get_db
+    PhysicalCount, User, get_db
 )
 from backend.models.enums import StockMovementType, InvoiceStatus
 from backend.api.auth import get_current_user, SessionLocal
 from backend.utils.calculations import ReportCalculator
+from backend.utils.product_search import normalize
+from backend.utils import reference_cache
+from backend.utils.data_version import CATEGORIES_SCOPE, check_not_modified, tenant_scope
+from backend.utils.valuation import inventory_totals, valuation_totals
 
 # Router
 router = APIRouter()
 
+def check_dashboard_not_modified(request: Request, response: Response, db: Session, restaurant_id: int):
+    """ETag check shared by the dashboard endpoints.
+    
+    Figures are relative to the current time ("last 7 days"), so the ETag
+    also changes every hour even when no data was written.
+    """
+    check_not_modified(request, response, db, [tenant_scope(restaurant_id), CATEGORIES_SCOPE], hourly=True)
+
 @router.get("/summary")
 async def get_dashboard_summary(
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -36,15 +50,10 @@ async def get_dashboard_summary(
     if current_user.restaurant_id is None:
         raise HTTPException(status_code=403, detail="User not assigned to restaurant")
     
-    # Basic stats
-    total_products = db.query(Product).filter(
-        Product.restaurant_id == current_user.restaurant_id
-    ).count()
+    check_dashboard_not_modified(request, response, db, current_user.restaurant_id)
     
-    # Inventory value
-    inventory_value = db.query(func.sum(Product.current_stock * Product.cost_price)).filter(
-        Product.restaurant_id == current_user.restaurant_id
-    ).scalar() or Decimal('0.0')
+    # Basic stats and inventory value (valuation aggregates)
+    total_products, inventory_value = inventory_totals(db, current_user.restaurant_id)
     
     # Low stock products
     low_stock_count = db.query(Product).filter(
@@ -99,6 +108,8 @@ async def get_dashboard_summary(
 
 @router.get("/alerts")
 async def get_dashboard_alerts(
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -107,6 +118,8 @@ async def get_dashboard_alerts(
     if current_user.restaurant_id is None:
         raise HTTPException(status_code=403, detail="User not assigned to restaurant")
     
+    check_dashboard_not_modified(request, response, db, current_user.restaurant_id)
+    
     # Get active alerts
     alerts = db.query(Alert).filter(
         Alert.restaurant_id == current_user.restaurant_id,
@@ -133,6 +146,8 @@ async def get_dashboard_alerts(
 
 @router.get("/weekly-consumption")
 async def get_weekly_consumption_chart(
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -141,6 +156,8 @@ async def get_weekly_consumption_chart(
     if current_user.restaurant_id is None:
         raise HTTPException(status_code=403, detail="User not assigned to restaurant")
     
+    check_dashboard_not_modified(request, response, db, current_user.restaurant_id)
+    
     # Get last 30 days consumption by day
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=30)
@@ -177,6 +194,8 @@ async def get_weekly_consumption_chart(
 
 @router.get("/category-distribution")
 async def get_category_distribution(
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -185,31 +204,24 @@ async def get_category_distribution(
     if current_user.restaurant_id is None:
         raise HTTPException(status_code=403, detail="User not assigned to restaurant")
     
-    # Get products grouped by category
-    products_by_category = db.query(
-        Category.name,
-        Category.type,
-        func.count(Product.id).label('product_count'),
-        func.sum(Product.current_stock * Product.cost_price).label('total_value')
-    ).join(
-        Product, Category.id == Product.category_id
-    ).filter(
-        Product.restaurant_id == current_user.restaurant_id
-    ).group_by(
-        Category.name, Category.type
-    ).all()
+    check_dashboard_not_modified(request, response, db, current_user.restaurant_id)
     
+    # Valuation aggregates per category (products without a category are left out)
+    categories = reference_cache.categories.rows(db)
     categories_data = []
     total_value = Decimal('0.0')
     
-    for category_name, category_type, product_count, category_value in products_by_category:
-        value = category_value if category_value else Decimal('0.0')
+    for category_id, totals in valuation_totals(db, current_user.restaurant_id, "category").items():
+        category = categories.get(category_id)
+        if category is None or not totals["product_count"]:
+            continue
+        value = totals["total_value"]
         total_value += value
         
         categories_data.append({
-            "name": category_name,
-            "type": category_type,
-            "product_count": product_count,
+            "name": category["name"],
+            "type": category["type"],
+            "product_count": totals["product_count"],
             "value": round(value, 2),
             "percentage": 0  # Will calculate after getting total
         })
@@ -225,6 +237,8 @@ async def get_category_distribution(
 
 @router.get("/top-products")
 async def get_top_products(
+    request: Request,
+    response: Response,
     limit: int = Query(10, ge=1, le=50),
     metric: str = Query("consumption", pattern="^(consumption|value|movement)$"),
     current_user: User = Depends(get_current_user),
@@ -235,6 +249,8 @@ async def get_top_products(
     if current_user.restaurant_id is None:
         raise HTTPException(status_code=403, detail="User not assigned to restaurant")
     
+    check_dashboard_not_modified(request, response, db, current_user.restaurant_id)
+    
     products = db.query(Product).filter(
         Product.restaurant_id == current_user.restaurant_id
     ).all()
@@ -271,7 +287,7 @@ async def get_top_products(
         product_data.append({
             "id": product.id,
             "name": product.name,
-            "category": product.category.name if product.category else "Unknown",
+            "category": reference_cache.categories.name(db, product.category_id),
             "value": round(float(value), 2),
             "unit": unit,
             "current_stock": float(product.current_stock),
@@ -288,29 +304,48 @@ async def get_top_products(
 
 @router.get("/products-by-category")
 async def get_products_by_category(
+    request: Request,
+    response: Response,
     category_name: Optional[str] = Query(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get products filtered by category"""
     
-    query = db.query(Product).join(
-        Category, Product.category_id == Category.id
-    ).filter(
-        Product.restaurant_id == current_user.restaurant_id
-    )
+    if current_user.restaurant_id is None:
+        raise HTTPException(status_code=403, detail="User not assigned to restaurant")
     
-    if category_name:
-        query = query.filter(Category.name.ilike(f"%{category_name}%"))
+    check_dashboard_not_modified(request, response, db, current_user.restaurant_id)
+    
+    # Resolve the category filter against the cached categories table, then
+    # filter products by category_id instead of a wildcard scan over the join
+    categories = reference_cache.categories.names(db)
     
-    products = query.all()
+    if category_name:
+        term = normalize(category_name)
+        category_ids = [cid for cid, name in categories.items() if term in normalize(name)]
+    else:
+        category_ids = list(categories.keys())
+    
+    products = db.query(
+        Product.id,
+        Product.name,
+        Product.category_id,
+        Product.current_stock,
+        Product.min_stock,
+        Product.unit,
+        Product.cost_price
+    ).filter(
+        Product.restaurant_id == current_user.restaurant_id,
+        Product.category_id.in_(category_ids)
+    ).all()
     
     result = []
     for p in products:
         result.append({
             "id": p.id,
             "name": p.name,
-            "category": p.category.name if p.category else "Unknown",
+            "category": categories.get(p.category_id, "Unknown"),
             "current_stock": float(p.current_stock),
             "min_stock": float(p.min_stock),
             "unit": p.unit,
@@ -325,6 +360,8 @@ async def get_products_by_category(
 
 @router.get("/quick-actions")
 async def get_quick_actions(
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -333,6 +370,8 @@ async def get_quick_actions(
     if current_user.restaurant_id is None:
         raise HTTPException(status_code=403, detail="User not assigned to restaurant")
     
+    check_dashboard_not_modified(request, response, db, current_user.restaurant_id)
+    
     actions = []
     
     # Check if count is needed
@@ -401,6 +440,8 @@ async def get_quick_actions(
 
 @router.get("/stats-cards")
 async def get_stats_cards(
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -409,14 +450,10 @@ async def get_stats_cards(
     if current_user.restaurant_id is None:
         raise HTTPException(status_code=403, detail="User not assigned to restaurant")
     
-    # Current stats
-    total_products = db.query(Product).filter(
-        Product.restaurant_id == current_user.restaurant_id
-    ).count()
+    check_dashboard_not_modified(request, response, db, current_user.restaurant_id)
     
-    inventory_value = db.query(func.sum(Product.current_stock * Product.cost_price)).filter(
-        Product.restaurant_id == current_user.restaurant_id
-    ).scalar() or 0.0
+    # Current stats
+    total_products, inventory_value = inventory_totals(db, current_user.restaurant_id)
     
     low_stock_count = db.query(Product).filter(
         Product.restaurant_id == current_user.restaurant_id,
@@ -7,21 +7,31 @@ from fastapi import APIRouter, HTTPException, Depends, status, UploadFile, File,
 from sqlalchemy.orm import Session
 from sqlalchemy import create_engine
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Union
 from decimal import Decimal
 from datetime import datetime
 import os
 import sys
 import json
+import shutil
+import tempfile
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from backend.models.database import (
-    Invoice, InvoiceItem, Product, Provider, User, StockMovement, get_db
+    Invoice, InvoiceItem, OCRBatchFile, OCRBatchJob, User, get_db
 )
 from backend.models.enums import InvoiceStatus, StockMovementType
 from backend.api.auth import get_current_user, SessionLocal
-from backend.utils.ocr_parser import OCRParser
+from backend.utils.ocr_pool import OCRQueueFull, OCRTimeout, run_ocr
+from backend.utils.ocr_cache import get_cached_result, store_result
+from backend.utils.pagination import order_by_keyset, paginate_keyset
+from backend.utils.product_search import normalize
+from backend.utils import line_aliases, ocr_batch, product_matcher
+from backend.utils import reference_cache
+from backend.utils.data_version import alias_scope, bump_tenant_version, bump_version, tenant_scope
+from backend.utils.stock import apply_stock_delta
+from backend.utils.uploads import UploadTooLarge, save_upload
 from backend.config import settings
 
 # Router
@@ -57,6 +67,15 @@ class InvoiceResponse(BaseModel):
     item_count: int
     created_at: str
 
+class InvoicePage(BaseModel):
+    items: List[InvoiceResponse]
+    next_cursor: Optional[str]
+
+class LineMatchRequest(BaseModel):
+    lines: List[str]
+    limit: int = 3
+    provider_id: Optional[int] = None
+
 class OCRResult(BaseModel):
     success: bool
     invoice_number: Optional[str]
@@ -68,15 +87,79 @@ class OCRResult(BaseModel):
     total: Optional[Decimal]
     confidence: float
     raw_text: str
+    source: Optional[str] = None  # "text" (PDF text layer), "ocr" or "mixed"
+    pages: Optional[int] = None
+    # Same file already scanned for this restaurant (result served from cache)
+    duplicate: bool = False
+    first_seen_at: Optional[str] = None
+    upload_count: int = 1
     suggestions: List[dict]
 
+def _build_suggestions(db: Session, restaurant_id: int, result: dict, provider_id: Optional[int] = None) -> List[dict]:
+    """Provider and product suggestions for an OCR result (from the current catalog)"""
+    # Find provider suggestions
+    suggestions = []
+    if result['provider_name']:
+        term = normalize(result['provider_name'][:20])
+        providers = [
+            p for p in reference_cache.providers.rows(db).values()
+            if term in normalize(p["name"])
+        ][:3]
+        
+        for provider in providers:
+            suggestions.append({
+                "type": "provider",
+                "id": provider["id"],
+                "name": provider["name"],
+                "match": result['provider_name']
+            })
+    
+    if provider_id is None and suggestions:
+        provider_id = suggestions[0]["id"]
+    
+    # Find product suggestions: known lines from the aliases, the rest
+    # scored in one pass over the tenant's index
+    matcher = product_matcher.get_matcher(db, restaurant_id)
+    line_texts = list(dict.fromkeys(item['product_name'] for item in result['items']))
+    aliased = line_aliases.resolve_lines(db, restaurant_id, provider_id, line_texts)
+    for line_text, product_id in zip(line_texts, aliased):
+        if product_id is not None:
+            suggestions.append({
+                "type": "product",
+                "id": product_id,
+                "name": matcher.names.get(product_id),
+                "match": line_text,
+                "score": 1.0,
+                "source": "alias"
+            })
+    
+    line_texts = [line for line, product_id in zip(line_texts, aliased) if product_id is None]
+    for line_text, found in zip(line_texts, matcher.match_lines(line_texts, limit=2)):
+        for product_id, score in found:
+            suggestions.append({
+                "type": "product",
+                "id": product_id,
+                "name": matcher.names.get(product_id),
+                "match": line_text,
+                "score": round(score, 4)
+            })
+    
+    return suggestions
+
 @router.post("/ocr/process", response_model=OCRResult)
 async def process_invoice_with_ocr(
     file: UploadFile = File(...),
+    provider_id: Optional[int] = Form(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Process invoice image/PDF with OCR"""
+    """Process invoice image/PDF with OCR
+
+    Lines already mapped for the provider (`provider_id`, or else the best
+    provider suggestion) are suggested from the learned aliases with score 1.
+    """
+    if current_user.restaurant_id is None:
+        raise HTTPException(status_code=403, detail="User not assigned to restaurant")
     
     # Validate file type
     if file.content_type not in settings.ALLOWED_FILE_TYPES:
@@ -85,63 +168,188 @@ async def process_invoice_with_ocr(
             detail=f"Invalid file type. Allowed types: {', '.join(settings.ALLOWED_FILE_TYPES)}"
         )
     
-    # Read file contents
-    contents = await file.read()
-    
-    # Validate file size (prevent DoS attacks)
-    file_size_mb = len(contents) / (1024 * 1024)
-    if file_size_mb > settings.MAX_UPLOAD_SIZE_MB:
+    # Copy the upload to disk in chunks, stopping at the size limit (prevent DoS attacks)
+    fd, upload_path = tempfile.mkstemp(prefix="ocr_upload_")
+    os.close(fd)
+    try:
+        saved = await save_upload(file, upload_path, settings.MAX_UPLOAD_SIZE_MB * 1024 * 1024)
+    except UploadTooLarge:
         raise HTTPException(
             status_code=400,
             detail=f"File too large. Maximum size: {settings.MAX_UPLOAD_SIZE_MB}MB"
         )
+    except Exception:
+        os.remove(upload_path)
+        raise
     
     try:
-        # Initialize OCR parser
-        ocr_parser = OCRParser()
-        
-        # Perform OCR
-        result = ocr_parser.process_invoice(contents, file.content_type)
+        # The declared type is not trusted: the file's own bytes decide
+        if saved.content_type not in settings.ALLOWED_FILE_TYPES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"File content is not an allowed type. Allowed types: {', '.join(settings.ALLOWED_FILE_TYPES)}"
+            )
         
-        if not result['success']:
-            raise HTTPException(status_code=400, detail="OCR processing failed")
+        # A repeated upload of the same bytes is answered from the cache
+        result = get_cached_result(db, current_user.restaurant_id, saved.digest)
         
-        # Find provider suggestions
-        suggestions = []
-        if result['provider_name']:
-            providers = db.query(Provider).filter(
-                Provider.name.ilike(f"%{result['provider_name'][:20]}%")
-            ).limit(3).all()
+        if result is None:
+            # Perform OCR in the worker pool (the event loop stays free
+            # meanwhile); the worker reads the file from disk
+            result = await run_ocr(saved.path, saved.content_type)
             
-            for provider in providers:
-                suggestions.append({
-                    "type": "provider",
-                    "id": provider.id,
-                    "name": provider.name,
-                    "match": result['provider_name']
-                })
-        
-        # Find product suggestions
-        for item in result['items']:
-            products = db.query(Product).filter(
-                Product.restaurant_id == current_user.restaurant_id,
-                Product.name.ilike(f"%{item['product_name'][:15]}%")
-            ).limit(2).all()
+            if not result['success']:
+                raise HTTPException(status_code=400, detail="OCR processing failed")
             
-            for product in products:
-                suggestions.append({
-                    "type": "product",
-                    "id": product.id,
-                    "name": product.name,
-                    "match": item['product_name']
-                })
+            store_result(db, current_user.restaurant_id, saved.digest, saved.content_type, saved.size, result)
         
-        result['suggestions'] = suggestions
+        result['suggestions'] = _build_suggestions(db, current_user.restaurant_id, result, provider_id)
         
         return result
         
+    except HTTPException:
+        raise
+    except OCRQueueFull:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many invoices being scanned, retry shortly",
+            headers={"Retry-After": "5"}
+        )
+    except OCRTimeout:
+        raise HTTPException(status_code=504, detail="OCR processing timed out")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OCR processing error: {str(e)}")
+    finally:
+        os.remove(upload_path)
+
+@router.post("/ocr/batch", status_code=202)
+async def process_invoice_batch(
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Queue many invoice files (images, PDFs or ZIPs of them) for OCR
+
+    The files are scanned in the background; progress is read from
+    GET /ocr/batch/{job_id} and each result from its file endpoint.
+    """
+    if current_user.restaurant_id is None:
+        raise HTTPException(status_code=403, detail="User not assigned to restaurant")
+    
+    directory = tempfile.mkdtemp(prefix="ocr_batch_")
+    try:
+        staged = await ocr_batch.stage_uploads(files, directory)
+        job = ocr_batch.create_job(db, current_user.restaurant_id, current_user.id, staged)
+    except ocr_batch.BatchUploadError as e:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    
+    ocr_batch.start_job(db.get_bind(), job.id, current_user.restaurant_id, staged, directory)
+    
+    return _batch_status(job)
+
+def _batch_status(job: OCRBatchJob) -> dict:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "file_count": job.file_count,
+        "done_count": job.done_count,
+        "failed_count": job.failed_count,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "files": [{
+            "id": f.id,
+            "filename": f.filename,
+            "status": f.status,
+            "duplicate": f.duplicate,
+            "error": f.error
+        } for f in job.files]
+    }
+
+def _get_batch_job(db: Session, job_id: int, current_user: User) -> OCRBatchJob:
+    job = db.query(OCRBatchJob).filter(OCRBatchJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    
+    if job.restaurant_id != current_user.restaurant_id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this batch")
+    
+    return job
+
+@router.get("/ocr/batch/{job_id}")
+async def get_invoice_batch(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Progress of an OCR batch, per file"""
+    return _batch_status(_get_batch_job(db, job_id, current_user))
+
+@router.get("/ocr/batch/{job_id}/files/{file_id}", response_model=OCRResult)
+async def get_invoice_batch_file(
+    job_id: int,
+    file_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """OCR result of one file of a batch, with suggestions from the current catalog"""
+    job = _get_batch_job(db, job_id, current_user)
+    
+    batch_file = db.query(OCRBatchFile).filter(
+        OCRBatchFile.id == file_id,
+        OCRBatchFile.job_id == job.id
+    ).first()
+    if not batch_file:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    if batch_file.status != "done":
+        raise HTTPException(
+            status_code=409,
+            detail=f"File not processed ({batch_file.status})" + (f": {batch_file.error}" if batch_file.error else "")
+        )
+    
+    result = json.loads(batch_file.result)
+    result.update(success=True, duplicate=bool(batch_file.duplicate))
+    result['suggestions'] = _build_suggestions(db, job.restaurant_id, result)
+    
+    return result
+
+@router.post("/match")
+async def match_invoice_lines(
+    request: LineMatchRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Ranked product candidates (with scores) for invoice line descriptions"""
+    if current_user.restaurant_id is None:
+        raise HTTPException(status_code=403, detail="User not assigned to restaurant")
+    
+    if len(request.lines) > 500:
+        raise HTTPException(status_code=400, detail="Too many lines (max 500)")
+    
+    matcher = product_matcher.get_matcher(db, current_user.restaurant_id)
+    limit = min(max(request.limit, 1), 20)
+    
+    # Lines learned for the provider need no fuzzy matching
+    aliased = line_aliases.resolve_lines(db, current_user.restaurant_id, request.provider_id, request.lines)
+    pending = [line for line, product_id in zip(request.lines, aliased) if product_id is None]
+    fuzzy = iter(matcher.match_lines(pending, limit=limit))
+    
+    matches = []
+    for line, product_id in zip(request.lines, aliased):
+        if product_id is not None:
+            candidates = [{"product_id": product_id, "name": matcher.names.get(product_id), "score": 1.0, "source": "alias"}]
+        else:
+            candidates = [
+                {"product_id": pid, "name": matcher.names.get(pid), "score": round(score, 4)}
+                for pid, score in next(fuzzy)
+            ]
+        matches.append({"line": line, "candidates": candidates})
+    
+    return {"matches": matches}
 
 @router.post("/", response_model=dict)
 async def create_invoice(
@@ -149,7 +357,11 @@ async def create_invoice(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Create invoice from OCR results"""
+    """Create invoice from OCR results
+
+    Items without `product_id` are mapped through the provider's learned line
+    aliases; product_ids chosen by the user are learned as aliases.
+    """
     
     try:
         # Parse JSON data
@@ -175,37 +387,41 @@ async def create_invoice(
         db.add(invoice)
         db.flush()
         
+        # Lines this provider's invoices have already mapped
+        aliased = line_aliases.resolve_lines(
+            db, current_user.restaurant_id, invoice.provider_id,
+            [item_data['product_name'] for item_data in data['items']]
+        )
+        
         # Create invoice items and update stock
         discrepancies = []
-        for item_data in data['items']:
-            # Try to find existing product (with lock)
-            product = db.query(Product).filter(
-                Product.restaurant_id == current_user.restaurant_id,
-                Product.id == item_data.get('product_id')
-            ).with_for_update().first()
+        confirmed = []
+        mapped_by_alias = 0
+        for item_data, alias_product_id in zip(data['items'], aliased):
+            user_mapped = bool(item_data.get('product_id'))
+            if not user_mapped and alias_product_id is not None:
+                item_data['product_id'] = alias_product_id
             
-            if product:
-                # Update stock
-                old_stock = product.current_stock
-                product.current_stock += Decimal(str(item_data['quantity']))
-                
-                # Create stock movement
-                movement = StockMovement(
-                    product_id=product.id,
-                    movement_type=StockMovementType.IN,
-                    quantity=item_data['quantity'],
-                    previous_stock=old_stock,
-                    new_stock=product.current_stock,
+            # Add to stock atomically (None if the product is not ours / unknown)
+            change = None
+            if item_data.get('product_id'):
+                change = apply_stock_delta(
+                    db,
+                    item_data['product_id'],
+                    Decimal(str(item_data['quantity'])),
+                    restaurant_id=current_user.restaurant_id,
+                    user_id=current_user.id,
                     reason=f"Invoice {invoice.invoice_number}",
                     reference_id=str(invoice.id),
-                    user_id=current_user.id,
-                    restaurant_id=current_user.restaurant_id
+                    movement_type=StockMovementType.IN
                 )
-                db.add(movement)
-                
-                stock_updated = True
-            else:
-                stock_updated = False
+            
+            stock_updated = change is not None
+            if stock_updated and user_mapped:
+                confirmed.append((item_data['product_name'], item_data['product_id']))
+            elif stock_updated:
+                mapped_by_alias += 1
+            if not stock_updated:
                 discrepancies.append({
                     'product_name': item_data['product_name'],
                     'quantity': item_data['quantity'],
@@ -225,31 +441,44 @@ async def create_invoice(
             )
             db.add(invoice_item)
         
+        # Only mappings whose product is ours (stock was updated) are learned
+        learned = line_aliases.learn_aliases(db, current_user.restaurant_id, invoice.provider_id, confirmed)
+        
         db.commit()
+        if learned:
+            bump_version(db, tenant_scope(current_user.restaurant_id), alias_scope(current_user.restaurant_id))
+        else:
+            bump_tenant_version(db, current_user.restaurant_id)
         
         return {
             "message": "Invoice processed successfully",
             "invoice_id": invoice.id,
             "discrepancies": discrepancies,
             "items_processed": len(data['items']),
-            "stock_updated": len(data['items']) - len(discrepancies)
+            "stock_updated": len(data['items']) - len(discrepancies),
+            "mapped_by_alias": mapped_by_alias
         }
         
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error creating invoice: {str(e)}")
 
-@router.get("/", response_model=List[InvoiceResponse])
+@router.get("/", response_model=Union[InvoicePage, List[InvoiceResponse]])
 async def get_invoices(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="Keyset cursor; send an empty value for the first page"),
     status_filter: Optional[InvoiceStatus] = None,
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get all invoices for current restaurant"""
+    """Get all invoices for current restaurant
+    
+    With `cursor` the list is paginated by (created_at, id) newest first and
+    returned as {items, next_cursor}; skip/limit is kept for older clients.
+    """
     
     query = db.query(Invoice).filter(Invoice.restaurant_id == current_user.restaurant_id)
     
@@ -263,18 +492,23 @@ async def get_invoices(
     if date_to:
         query = query.filter(Invoice.invoice_date <= datetime.strptime(date_to, '%Y-%m-%d').date())
     
-    invoices = query.order_by(Invoice.created_at.desc()).offset(skip).limit(limit).all()
+    sort_key = (Invoice.created_at, Invoice.id)
+    next_cursor = None
+    
+    if cursor is not None:
+        invoices, next_cursor = paginate_keyset(query, sort_key, cursor, limit, descending=True)
+    else:
+        invoices = order_by_keyset(query, sort_key, descending=True).offset(skip).limit(limit).all()
     
     result = []
     for invoice in invoices:
-        provider = db.query(Provider).filter(Provider.id == invoice.provider_id).first()
         item_count = db.query(InvoiceItem).filter(InvoiceItem.invoice_id == invoice.id).count()
         
         result.append(InvoiceResponse(
             id=invoice.id,
             invoice_number=invoice.invoice_number,
             invoice_date=invoice.invoice_date.isoformat(),
-            provider_name=provider.name if provider else "Unknown",
+            provider_name=reference_cache.providers.name(db, invoice.provider_id),
             subtotal=invoice.subtotal,
             tax=invoice.tax,
             total=invoice.total,
@@ -283,6 +517,9 @@ async def get_invoices(
             created_at=invoice.created_at.isoformat() if invoice.created_at else None
         ))
     
+    if cursor is not None:
+        return InvoicePage(items=result, next_cursor=next_cursor)
+    
     return result
 
 @router.get("/{invoice_id}")
@@ -300,7 +537,7 @@ async def get_invoice(
     if invoice.restaurant_id != current_user.restaurant_id:
         raise HTTPException(status_code=403, detail="Not authorized to access this invoice")
     
-    provider = db.query(Provider).filter(Provider.id == invoice.provider_id).first()
+    provider = reference_cache.providers.rows(db).get(invoice.provider_id)
     items = db.query(InvoiceItem).filter(InvoiceItem.invoice_id == invoice.id).all()
     
     return {
@@ -308,8 +545,8 @@ async def get_invoice(
         "invoice_number": invoice.invoice_number,
         "invoice_date": invoice.invoice_date.isoformat(),
         "provider": {
-            "id": provider.id if provider else None,
-            "name": provider.name if provider else "Unknown"
+            "id": provider["id"] if provider else None,
+            "name": provider["name"] if provider else "Unknown"
         },
         "subtotal": invoice.subtotal,
         "tax": invoice.tax,
@@ -348,47 +585,60 @@ async def update_stock_from_invoice(
         InvoiceItem.stock_updated == False
     ).all()
     
+    # Learned aliases first, then every remaining line at once; only
+    # confident matches update stock
+    aliased = line_aliases.resolve_lines(
+        db, current_user.restaurant_id, invoice.provider_id, [item.product_name for item in items]
+    )
+    matcher = product_matcher.get_matcher(db, current_user.restaurant_id)
+    fuzzy = iter(matcher.match_lines(
+        [item.product_name for item, product_id in zip(items, aliased) if product_id is None], limit=3
+    ))
+    
     updated_count = 0
-    for item in items:
-        # Try to find product by name
-        product = db.query(Product).filter(
-            Product.restaurant_id == current_user.restaurant_id,
-            func.lower(Product.name) == func.lower(item.product_name)
-        ).with_for_update().first()
+    unmatched = []
+    for item, product_id in zip(items, aliased):
+        found = []
+        if product_id is None:
+            found = next(fuzzy)
+            if found and found[0][1] >= product_matcher.AUTO_MATCH_SCORE:
+                product_id = found[0][0]
         
-        if not product:
-            # Try fuzzy match
-            product = db.query(Product).filter(
-                Product.restaurant_id == current_user.restaurant_id,
-                Product.name.ilike(f"%{item.product_name[:10]}%")
-            ).with_for_update().first()
-        
-        if product:
-            # Update stock
-            old_stock = product.current_stock
-            product.current_stock += item.quantity
-            
-            # Create stock movement
-            movement = StockMovement(
-                product_id=product.id,
-                movement_type=StockMovementType.IN,
-                quantity=item.quantity,
-                previous_stock=old_stock,
-                new_stock=product.current_stock,
+        # Add to stock atomically and record the movement (None if the
+        # product is no longer ours: the index may predate its deletion)
+        change = None
+        if product_id:
+            change = apply_stock_delta(
+                db,
+                product_id,
+                item.quantity,
+                restaurant_id=current_user.restaurant_id,
+                user_id=current_user.id,
                 reason=f"Invoice update {invoice.invoice_number}",
                 reference_id=str(invoice.id),
-                user_id=current_user.id,
-                restaurant_id=current_user.restaurant_id
+                movement_type=StockMovementType.IN
             )
-            db.add(movement)
-            
+        
+        if change is not None:
             # Mark item as processed
+            item.product_id = product_id
             item.stock_updated = True
             updated_count += 1
+        else:
+            unmatched.append({
+                "item_id": item.id,
+                "product_name": item.product_name,
+                "candidates": [
+                    {"product_id": pid, "name": matcher.names.get(pid), "score": round(score, 4)}
+                    for pid, score in found if pid != product_id
+                ]
+            })
     
     db.commit()
+    bump_tenant_version(db, current_user.restaurant_id)
     
     return {
         "message": f"Stock updated for {updated_count} items",
-        "updated_count": updated_count
+        "updated_count": updated_count,
+        "unmatched": unmatched
     }
\ No newline at end of file
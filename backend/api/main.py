@@ -25,7 +25,15 @@ from backend.api.reports import router as reports_router
 from backend.api.wastes import router as wastes_router
 from backend.api.dashboard import router as dashboard_router
 from backend.api.admin import router as admin_router
+from backend.api.sync import router as sync_router
+from backend.api.sales import router as sales_router
+from backend.api.recipes import router as recipes_router
 from backend.config import settings
+from backend.middleware.upload_limit import UploadLimitMiddleware
+from backend.utils.product_search import setup_product_search
+from backend.utils.partitions import ensure_partitions
+from backend.utils.ocr_batch import shutdown_batch_jobs
+from backend.utils.ocr_pool import shutdown_ocr_pool
 
 # Lifespan manager
 @asynccontextmanager
@@ -36,6 +44,8 @@ async def lifespan(app: FastAPI):
     yield
     # Shutdown
     print("Cerrando sistema...")
+    await shutdown_batch_jobs()
+    shutdown_ocr_pool()
 
 # Create FastAPI app
 app = FastAPI(
@@ -45,6 +55,10 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Oversized OCR uploads are refused before their body is read (inside CORS,
+# so browsers can read the 413)
+app.add_middleware(UploadLimitMiddleware)
+
 # CORS configuration - Secure
 app.add_middleware(
     CORSMiddleware,
@@ -57,6 +71,12 @@ app.add_middleware(
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+# Trigram search index (PostgreSQL) / in-memory fallback
+setup_product_search(engine)
+
+# Upcoming monthly partitions for stock_movements / waste_logs (PostgreSQL)
+ensure_partitions(engine)
+
 # Include routers
 app.include_router(auth_router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(products_router, prefix="/api/products", tags=["Products"])
@@ -66,6 +86,9 @@ app.include_router(reports_router, prefix="/api/reports", tags=["Reports"])
 app.include_router(wastes_router, prefix="/api/wastes", tags=["Waste Management"])
 app.include_router(dashboard_router, prefix="/api/dashboard", tags=["Dashboard"])
 app.include_router(admin_router, prefix="/api/admin", tags=["Super Admin"])
+app.include_router(sync_router, prefix="/api/sync", tags=["Sync"])
+app.include_router(sales_router, prefix="/api/sales", tags=["Sales"])
+app.include_router(recipes_router, prefix="/api/recipes", tags=["Recipes"])
 
 # Mount static files
 # En ejecución local (sin Docker), main.py está en backend/api/
@@ -3,22 +3,38 @@ Products management module
 Módulo de gestión de productos
 """
 
-from fastapi import APIRouter, HTTPException, Depends, status, Query
+from fastapi import APIRouter, HTTPException, Depends, status, Query, UploadFile, File, Request, Response
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
-from sqlalchemy import create_engine, and_, func
-from pydantic import BaseModel
-from typing import List, Optional
+from sqlalchemy import create_engine, and_, func, insert, update
+from pydantic import BaseModel, Field
+from openpyxl.utils.exceptions import InvalidFileException
+from typing import Dict, List, Optional, Union
 from decimal import Decimal
 import os
 import sys
+import zipfile
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from backend.models.database import (
-    Product, Category, Provider, Restaurant, StockMovement, User, get_db
+    Product, Provider, Recipe, RecipeComponent, Restaurant, StockMovement, User, get_db
 )
 from backend.models.enums import StockMovementType
 from backend.api.auth import get_current_user, SessionLocal
+from backend.utils.pagination import order_by_keyset, paginate_keyset
+from backend.utils import barcode_lookup, line_aliases, product_search, reference_cache
+from backend.utils.product_import import ProductImporter, iter_rows
+from backend.utils.sync import purge_tombstones, record_deletion
+from backend.utils.stock import set_stock_level
+from backend.utils.concurrency import MAX_CAS_ATTEMPTS, VersionConflictError, compare_and_swap
+from backend.utils.valuation import (
+    PRODUCT_VALUE_COLUMNS, product_value, record_product_change, record_product_changes
+)
+from backend.utils.data_version import (
+    CATEGORIES_SCOPE, PROVIDERS_SCOPE, alias_scope, bump_tenant_version, bump_version, check_not_modified,
+    tenant_scope
+)
 
 # Router
 router = APIRouter()
@@ -65,6 +81,19 @@ class ProductUpdate(BaseModel):
     presentation: Optional[str] = None
     origin: Optional[str] = None
     notes: Optional[str] = None
+    
+    # Version the client edited (optimistic concurrency, optional)
+    version: Optional[int] = None
+
+class StockAdjustmentItem(BaseModel):
+    product_id: int
+    delta: Optional[Decimal] = None      # Signed change (+ in / - out)
+    new_stock: Optional[Decimal] = None  # Or the counted stock level
+    reason: Optional[str] = None
+
+class StockAdjustmentBatch(BaseModel):
+    items: List[StockAdjustmentItem]
+    all_or_nothing: bool = False
 
 class ProviderCreate(BaseModel):
     name: str
@@ -95,6 +124,21 @@ class ProductResponse(BaseModel):
     stock_status: str
     created_at: str
     updated_at: Optional[str]
+    version: int
+
+class ProductSearchResult(ProductResponse):
+    score: float
+
+class ProductPage(BaseModel):
+    items: List[ProductResponse]
+    next_cursor: Optional[str]
+
+class BarcodeBatchRequest(BaseModel):
+    codes: List[str] = Field(..., max_length=500)
+
+class BarcodeBatchResult(BaseModel):
+    found: Dict[str, ProductResponse]
+    missing: List[str]
 
 @router.post("/providers", response_model=dict)
 async def create_provider(
@@ -120,6 +164,8 @@ async def create_provider(
     )
     db.add(db_provider)
     db.commit()
+    bump_version(db, PROVIDERS_SCOPE)
+    reference_cache.providers.invalidate()
     db.refresh(db_provider)
     
     return {
@@ -151,8 +197,10 @@ async def create_product(
         restaurant_id=current_user.restaurant_id
     )
     db.add(db_product)
+    record_product_change(db, None, product_value(db_product))
     db.commit()
     db.refresh(db_product)
+    product_search.invalidate(db_product.restaurant_id)
     
     # Create initial stock movement
     if product.current_stock > 0:
@@ -169,30 +217,79 @@ async def create_product(
         db.add(movement)
         db.commit()
     
+    bump_tenant_version(db, current_user.restaurant_id)
     return get_product_response(db_product, db)
 
-@router.get("/", response_model=List[ProductResponse])
+@router.post("/import")
+async def import_products(
+    file: UploadFile = File(...),
+    dry_run: bool = Query(False, description="Validate only, do not insert"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Bulk import products from a CSV or XLSX file.
+    
+    Rows are streamed from the upload, validated in chunks and inserted with
+    batched INSERTs (products plus their initial stock movements), one
+    transaction per chunk. Invalid rows are reported and skipped.
+    """
+    if current_user.restaurant_id is None:
+        raise HTTPException(status_code=403, detail="User not assigned to restaurant")
+    
+    filename = file.filename or ""
+    if not filename.lower().endswith((".csv", ".txt", ".xlsx", ".xlsm")):
+        raise HTTPException(status_code=400, detail="Invalid file type. Allowed: .csv, .xlsx")
+    
+    importer = ProductImporter(db, current_user.restaurant_id, current_user.id, dry_run=dry_run)
+    try:
+        result = importer.run(iter_rows(file.file, filename))
+    except (zipfile.BadZipFile, InvalidFileException):
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Invalid spreadsheet file")
+    except (ValueError, UnicodeDecodeError, KeyError) as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Could not read file: {str(e)}")
+    
+    if result["imported"] and not dry_run:
+        product_search.invalidate(current_user.restaurant_id)
+        bump_tenant_version(db, current_user.restaurant_id)
+    
+    return result
+
+@router.get("/", response_model=Union[ProductPage, List[ProductResponse]])
 async def get_products(
+    request: Request,
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="Keyset cursor; send an empty value for the first page"),
     category_id: Optional[int] = None,
     search: Optional[str] = None,
     stock_status: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get all products for current user's restaurant"""
+    """Get all products for current user's restaurant
+    
+    With `cursor` the list is paginated by (name, id) and returned as
+    {items, next_cursor}; skip/limit is kept for older clients.
+    """
     if current_user.restaurant_id is None:
         raise HTTPException(status_code=403, detail="User not assigned to restaurant")
     
-    query = db.query(Product).filter(Product.restaurant_id == current_user.restaurant_id)
+    # Category and provider names are part of each item
+    check_not_modified(request, response, db, [
+        tenant_scope(current_user.restaurant_id), CATEGORIES_SCOPE, PROVIDERS_SCOPE
+    ])
+    
+    query = product_list_query(db).filter(Product.restaurant_id == current_user.restaurant_id)
     
     # Filters
     if category_id:
         query = query.filter(Product.category_id == category_id)
     
     if search:
-        query = query.filter(Product.name.ilike(f"%{search}%"))
+        query = query.filter(product_search.search_filter(db, current_user.restaurant_id, search))
     
     if stock_status:
         if stock_status == "low":
@@ -200,27 +297,43 @@ async def get_products(
         elif stock_status == "ok":
             query = query.filter(Product.current_stock > Product.min_stock)
     
-    products = query.offset(skip).limit(limit).all()
+    sort_key = (Product.name, Product.id)
+    
+    if cursor is not None:
+        rows, next_cursor = paginate_keyset(query, sort_key, cursor, limit)
+        return ProductPage.model_construct(items=build_product_responses(rows, db), next_cursor=next_cursor)
     
-    return [get_product_response(p, db) for p in products]
+    rows = order_by_keyset(query, sort_key).offset(skip).limit(limit).all()
+    
+    return build_product_responses(rows, db)
 
 @router.get("/categories/list")
 async def get_categories(
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get all categories"""
-    categories = db.query(Category).filter(Category.is_active == True).all()
-    return [{"id": c.id, "name": c.name, "type": c.type, "icon": c.icon} for c in categories]
+    check_not_modified(request, response, db, [CATEGORIES_SCOPE])
+    return [
+        {"id": c["id"], "name": c["name"], "type": c["type"], "icon": c["icon"]}
+        for c in reference_cache.categories.active(db)
+    ]
 
 @router.get("/providers/list")
 async def get_providers(
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get all providers"""
-    providers = db.query(Provider).filter(Provider.is_active == True).all()
-    return [{"id": p.id, "name": p.name, "contact_person": p.contact_person} for p in providers]
+    check_not_modified(request, response, db, [PROVIDERS_SCOPE])
+    return [
+        {"id": p["id"], "name": p["name"], "contact_person": p["contact_person"]}
+        for p in reference_cache.providers.active(db)
+    ]
 
 @router.get("/stats")
 async def get_product_stats(
@@ -255,6 +368,183 @@ async def get_product_stats(
         }
     }
 
+@router.get("/search", response_model=List[ProductSearchResult])
+async def search_products(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Ranked, typo-tolerant product search over name, brand, barcode and variant fields"""
+    if current_user.restaurant_id is None:
+        raise HTTPException(status_code=403, detail="User not assigned to restaurant")
+    
+    matches = product_search.search_products(db, current_user.restaurant_id, q, limit)
+    if not matches:
+        return []
+    
+    scores = dict(matches)
+    rows = product_list_query(db).filter(
+        Product.restaurant_id == current_user.restaurant_id,
+        Product.id.in_(scores.keys())
+    ).all()
+    
+    results = [
+        ProductSearchResult.model_construct(**response.model_dump(), score=round(scores[response.id], 4))
+        for response in build_product_responses(rows, db)
+    ]
+    return sorted(results, key=lambda r: r.score, reverse=True)
+
+def resolve_barcodes(db: Session, restaurant_id: int, codes: List[str]) -> Dict[str, ProductResponse]:
+    """Resolve barcodes within a restaurant through the per-tenant scan cache"""
+    def load(missing: List[str]) -> Dict[str, ProductResponse]:
+        # Served by the unique index on products.barcode
+        rows = product_list_query(db).filter(
+            Product.barcode.in_(missing),
+            Product.restaurant_id == restaurant_id
+        ).all()
+        return {response.barcode: response for response in build_product_responses(rows, db)}
+    
+    return barcode_lookup.lookup_barcodes(db, restaurant_id, codes, load)
+
+@router.get("/by-barcode/{code}", response_model=ProductResponse)
+async def get_product_by_barcode(
+    code: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Resolve a scanned barcode to a product"""
+    if current_user.restaurant_id is None:
+        raise HTTPException(status_code=403, detail="User not assigned to restaurant")
+    
+    code = code.strip()
+    product = resolve_barcodes(db, current_user.restaurant_id, [code]).get(code)
+    if product is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    return product
+
+@router.post("/by-barcode", response_model=BarcodeBatchResult)
+async def get_products_by_barcodes(
+    batch: BarcodeBatchRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Resolve many scanned barcodes at once (e.g. a scanner's offline queue)"""
+    if current_user.restaurant_id is None:
+        raise HTTPException(status_code=403, detail="User not assigned to restaurant")
+    
+    codes = list(dict.fromkeys(code.strip() for code in batch.codes if code.strip()))
+    found = resolve_barcodes(db, current_user.restaurant_id, codes)
+    
+    return BarcodeBatchResult.model_construct(
+        found=found,
+        missing=[code for code in codes if code not in found]
+    )
+
+@router.post("/adjustments/batch")
+async def batch_adjust_stock(
+    batch: StockAdjustmentBatch,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Apply many stock adjustments in a single transaction.
+    
+    All affected products are locked with one SELECT ... FOR UPDATE ordered
+    by id (so concurrent batches cannot deadlock), stock is written with one
+    bulk UPDATE and the movements with one bulk INSERT.
+    """
+    if current_user.restaurant_id is None:
+        raise HTTPException(status_code=403, detail="User not assigned to restaurant")
+    
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="No adjustments provided")
+    
+    if len(batch.items) > 1000:
+        raise HTTPException(status_code=400, detail="Too many adjustments (max 1000)")
+    
+    product_ids = {item.product_id for item in batch.items}
+    products = {
+        p.id: p for p in db.query(Product).filter(
+            Product.id.in_(product_ids),
+            Product.restaurant_id == current_user.restaurant_id
+        ).order_by(Product.id).with_for_update().all()
+    }
+    
+    # Running stock per product, so repeated ids apply in order
+    stock = {pid: p.current_stock for pid, p in products.items()}
+    results = []
+    movements = []
+    failed = 0
+    
+    for item in batch.items:
+        result = {"product_id": item.product_id}
+        results.append(result)
+        
+        if (item.delta is None) == (item.new_stock is None):
+            result.update(status="error", detail="Provide exactly one of delta or new_stock")
+            failed += 1
+            continue
+        
+        if item.product_id not in products:
+            result.update(status="error", detail="Product not found")
+            failed += 1
+            continue
+        
+        previous = stock[item.product_id]
+        new = previous + item.delta if item.delta is not None else item.new_stock
+        
+        if new < 0:
+            result.update(status="error", detail="Stock cannot be negative", current_stock=previous)
+            failed += 1
+            continue
+        
+        result.update(status="applied" if new != previous else "unchanged", previous_stock=previous, new_stock=new)
+        if new == previous:
+            continue
+        
+        stock[item.product_id] = new
+        movements.append({
+            "product_id": item.product_id,
+            "movement_type": StockMovementType.IN if new > previous else StockMovementType.OUT,
+            "quantity": abs(new - previous),
+            "previous_stock": previous,
+            "new_stock": new,
+            "reason": item.reason or "Batch adjustment",
+            "user_id": current_user.id,
+            "restaurant_id": current_user.restaurant_id
+        })
+    
+    if failed and batch.all_or_nothing:
+        db.rollback()
+        raise HTTPException(status_code=409, detail={"message": "Batch rejected", "results": jsonable_encoder(results)})
+    
+    changed = [
+        {"id": pid, "current_stock": value, "version": products[pid].version}
+        for pid, value in stock.items() if value != products[pid].current_stock
+    ]
+    if changed:
+        # Bulk UPDATE by primary key (checks and bumps each row's version)
+        # + bulk INSERT of the movements
+        # Valuation pairs are taken before the UPDATE, which may refresh the loaded products
+        value_changes = [
+            (product_value(products[row["id"]]), product_value(products[row["id"]], current_stock=row["current_stock"]))
+            for row in changed
+        ]
+        db.execute(update(Product), changed)
+        db.execute(insert(StockMovement), movements)
+        record_product_changes(db, value_changes)
+    db.commit()
+    if changed:
+        bump_tenant_version(db, current_user.restaurant_id)
+    
+    return {
+        "message": f"{len(movements)} adjustments applied",
+        "applied": len(movements),
+        "failed": failed,
+        "results": results
+    }
+
 @router.get("/{product_id}", response_model=ProductResponse)
 async def get_product(
     product_id: int,
@@ -279,9 +569,13 @@ async def update_product(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Update a product"""
-    # Use with_for_update to lock the row during update
-    product = db.query(Product).filter(Product.id == product_id).with_for_update().first()
+    """Update a product
+    
+    Send the `version` of the product you edited to have a concurrent change
+    rejected with 409 (the response carries the current product); without it
+    the update is applied on top of the latest state.
+    """
+    product = db.query(Product).filter(Product.id == product_id).first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
@@ -289,36 +583,51 @@ async def update_product(
     if product.restaurant_id != current_user.restaurant_id:
         raise HTTPException(status_code=403, detail="Not authorized to update this product")
     
-    # Track stock changes
-    old_stock = product.current_stock
-    
-    # Update fields
-    for field, value in product_update.dict(exclude_unset=True).items():
-        setattr(product, field, value)
+    changes = product_update.dict(exclude_unset=True)
+    expected_version = changes.pop("version", None)
+    new_stock = changes.pop("current_stock", None)
+    if new_stock is not None and new_stock < 0:
+        raise HTTPException(status_code=400, detail="Stock cannot be negative")
+    
+    # Compare-and-swap on the version instead of locking the row
+    try:
+        if new_stock is not None:
+            # Stock goes through the stock service (fields + movement in the same write)
+            set_stock_level(
+                db,
+                product.id,
+                new_stock,
+                restaurant_id=current_user.restaurant_id,
+                user_id=current_user.id,
+                reason="Manual adjustment",
+                expected_version=expected_version,
+                **changes
+            )
+        elif changes:
+            for _ in range(MAX_CAS_ATTEMPTS):
+                row = db.query(Product.version, *PRODUCT_VALUE_COLUMNS).filter(Product.id == product.id).first()
+                if expected_version is not None and row.version != expected_version:
+                    raise VersionConflictError()
+                if compare_and_swap(db, Product, product.id, row.version, changes):
+                    # Cost, category or provider changes move value between aggregates
+                    record_product_change(db, product_value(row), product_value(row, **changes))
+                    break
+                if expected_version is not None:
+                    raise VersionConflictError()
+            else:
+                raise VersionConflictError()
+    except VersionConflictError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail={
+            "message": "Product was modified by another request",
+            "current": jsonable_encoder(get_product_response(product, db))
+        })
     
     db.commit()
     db.refresh(product)
+    product_search.invalidate(product.restaurant_id)
     
-    # Create stock movement if stock changed
-    if product_update.current_stock is not None:
-        if product_update.current_stock < 0:
-            raise HTTPException(status_code=400, detail="Stock cannot be negative")
-            
-        if old_stock != product.current_stock:
-            movement_type = StockMovementType.IN if product.current_stock > old_stock else StockMovementType.OUT
-            movement = StockMovement(
-                product_id=product.id,
-                movement_type=movement_type,
-            quantity=abs(product.current_stock - old_stock),
-            previous_stock=old_stock,
-            new_stock=product.current_stock,
-            reason="Manual adjustment",
-            user_id=current_user.id,
-            restaurant_id=current_user.restaurant_id
-        )
-        db.add(movement)
-        db.commit()
-    
+    bump_tenant_version(db, product.restaurant_id)
     return get_product_response(product, db)
 
 @router.delete("/{product_id}")
@@ -327,7 +636,7 @@ async def delete_product(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Delete a product"""
+    """Delete a product that no recipe uses"""
     product = db.query(Product).filter(Product.id == product_id).first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
@@ -339,26 +648,94 @@ async def delete_product(
     if current_user.role not in ["admin", "manager"]:
         raise HTTPException(status_code=403, detail="Only admins or managers can delete products")
     
+    recipes = [
+        name for (name,) in db.query(Recipe.name).join(
+            RecipeComponent, RecipeComponent.recipe_id == Recipe.id
+        ).filter(RecipeComponent.product_id == product.id).distinct().all()
+    ]
+    if recipes:
+        raise HTTPException(status_code=409, detail={"message": "Product is used in recipes", "used_in": recipes})
+    
+    record_deletion(db, product.restaurant_id, "product", product.id)
+    purge_tombstones(db, product.restaurant_id)
+    record_product_change(db, product_value(product), None)
+    line_aliases.forget_product(db, product.id)
     db.delete(product)
     db.commit()
+    product_search.invalidate(current_user.restaurant_id)
+    bump_version(db, tenant_scope(current_user.restaurant_id), alias_scope(current_user.restaurant_id))
     
     return {"message": "Product deleted successfully"}
 
 
 
-# Helper function
+# Helper functions
+def get_stock_status(current_stock: Decimal, min_stock: Decimal, max_stock: Decimal) -> str:
+    """Classify stock level as low / ok / high"""
+    if current_stock <= min_stock:
+        return "low"
+    elif current_stock >= max_stock:
+        return "high"
+    return "ok"
+
+def product_list_query(db: Session):
+    """Query the columns ProductResponse needs (names come from the reference cache)"""
+    return db.query(
+        Product.id,
+        Product.name,
+        Product.description,
+        Product.barcode,
+        Product.unit,
+        Product.current_stock,
+        Product.min_stock,
+        Product.max_stock,
+        Product.cost_price,
+        Product.selling_price,
+        Product.category_id,
+        Product.provider_id,
+        Product.restaurant_id,
+        Product.created_at,
+        Product.updated_at,
+        Product.version
+    )
+
+def build_product_responses(rows, db: Session) -> List[ProductResponse]:
+    """Build response objects from product_list_query rows.
+    
+    Rows come straight from typed columns, so validation is skipped (model_construct).
+    """
+    construct = ProductResponse.model_construct
+    category_names = reference_cache.categories.names(db)
+    provider_names = reference_cache.providers.names(db)
+    return [
+        construct(
+            id=row.id,
+            name=row.name,
+            description=row.description,
+            barcode=row.barcode,
+            unit=row.unit,
+            current_stock=row.current_stock,
+            min_stock=row.min_stock,
+            max_stock=row.max_stock,
+            cost_price=row.cost_price,
+            selling_price=row.selling_price,
+            category_id=row.category_id,
+            provider_id=row.provider_id,
+            restaurant_id=row.restaurant_id,
+            category_name=category_names.get(row.category_id, "Unknown"),
+            provider_name=provider_names.get(row.provider_id, "Unknown"),
+            stock_status=get_stock_status(row.current_stock, row.min_stock, row.max_stock),
+            created_at=row.created_at.isoformat() if row.created_at else None,
+            updated_at=row.updated_at.isoformat() if row.updated_at else None,
+            version=row.version
+        )
+        for row in rows
+    ]
+
 def get_product_response(product: Product, db: Session) -> ProductResponse:
     """Convert product to response model with additional info"""
-    category = db.query(Category).filter(Category.id == product.category_id).first()
-    provider = db.query(Provider).filter(Provider.id == product.provider_id).first()
-    
     # Determine stock status
-    if product.current_stock <= product.min_stock:
-        stock_status = "low"
-    elif product.current_stock >= product.max_stock:
-        stock_status = "high"
-    else:
-        stock_status = "ok"
+    stock_status = get_stock_status(product.current_stock, product.min_stock, product.max_stock)
     
     return ProductResponse(
         id=product.id,
@@ -374,9 +751,10 @@ def get_product_response(product: Product, db: Session) -> ProductResponse:
         category_id=product.category_id,
         provider_id=product.provider_id,
         restaurant_id=product.restaurant_id,
-        category_name=category.name if category else "Unknown",
-        provider_name=provider.name if provider else "Unknown",
+        category_name=reference_cache.categories.name(db, product.category_id),
+        provider_name=reference_cache.providers.name(db, product.provider_id),
         stock_status=stock_status,
         created_at=product.created_at.isoformat() if product.created_at else None,
-        updated_at=product.updated_at.isoformat() if product.updated_at else None
+        updated_at=product.updated_at.isoformat() if product.updated_at else None,
+        version=product.version
     )
\ No newline at end of file
@@ -0,0 +1,274 @@
+"""
+Recipes (BOM) management module
+Módulo de gestión de recetas y sub-recetas
+"""
+
+from fastapi import APIRouter, HTTPException, Depends
+from sqlalchemy.orm import Session
+from pydantic import BaseModel
+from typing import List, Optional
+from decimal import Decimal
+
+from backend.models.database import Product, Recipe, RecipeComponent, User, get_db
+from backend.api.auth import get_current_user
+from backend.utils import recipes as recipe_engine
+from backend.utils.data_version import bump_version, recipe_scope
+
+# Router
+router = APIRouter()
+
+# Pydantic models
+class RecipeComponentIn(BaseModel):
+    product_id: Optional[int] = None
+    sub_recipe_id: Optional[int] = None
+    quantity: Decimal  # Per batch of yield_quantity portions
+
+class RecipeCreate(BaseModel):
+    name: str
+    code: Optional[str] = None
+    yield_quantity: Decimal = Decimal("1")
+    components: List[RecipeComponentIn]
+
+class ExplodeItem(BaseModel):
+    recipe_id: Optional[int] = None
+    code: Optional[str] = None
+    quantity: Decimal
+
+class ExplodeRequest(BaseModel):
+    items: List[ExplodeItem]
+
+def _product_lines(db: Session, restaurant_id: int, quantities: dict) -> List[dict]:
+    """[{product_id, product_name, unit, quantity}] for a {product_id: quantity} vector"""
+    if not quantities:
+        return []
+    products = {
+        p.id: p for p in db.query(Product.id, Product.name, Product.unit).filter(
+            Product.restaurant_id == restaurant_id,
+            Product.id.in_(list(quantities))
+        ).all()
+    }
+    return [
+        {
+            "product_id": product_id,
+            "product_name": products[product_id].name if product_id in products else "Unknown",
+            "unit": products[product_id].unit if product_id in products else None,
+            "quantity": quantity
+        }
+        for product_id, quantity in sorted(quantities.items())
+    ]
+
+def recipe_to_dict(db: Session, recipe: Recipe) -> dict:
+    matrix = recipe_engine.get_matrix(db, recipe.restaurant_id)
+    ingredients = matrix.row(recipe.id) if recipe.id in matrix else {}
+    return {
+        "id": recipe.id,
+        "name": recipe.name,
+        "code": recipe.code,
+        "yield_quantity": recipe.yield_quantity,
+        "components": [
+            {
+                "product_id": c.product_id,
+                "sub_recipe_id": c.sub_recipe_id,
+                "quantity": c.quantity
+            }
+            for c in recipe.components
+        ],
+        # Flattened vector: products consumed per portion sold
+        "ingredients": _product_lines(db, recipe.restaurant_id, ingredients)
+    }
+
+def validate_recipe(db: Session, restaurant_id: int, data: RecipeCreate, recipe_id: Optional[int] = None) -> None:
+    """Check components, code and yield; reject recipes that would contain themselves"""
+    if not data.name.strip():
+        raise HTTPException(status_code=400, detail="Recipe name is required")
+    if data.yield_quantity <= 0:
+        raise HTTPException(status_code=400, detail="Yield must be greater than 0")
+    if not data.components:
+        raise HTTPException(status_code=400, detail="A recipe needs at least one component")
+
+    for component in data.components:
+        if (component.product_id is None) == (component.sub_recipe_id is None):
+            raise HTTPException(status_code=400, detail="Each component needs exactly one of product_id or sub_recipe_id")
+        if component.quantity <= 0:
+            raise HTTPException(status_code=400, detail="Component quantity must be greater than 0")
+
+    product_ids = {c.product_id for c in data.components if c.product_id is not None}
+    if product_ids:
+        found = {pid for (pid,) in db.query(Product.id).filter(
+            Product.restaurant_id == restaurant_id,
+            Product.id.in_(product_ids)
+        ).all()}
+        if found != product_ids:
+            raise HTTPException(status_code=404, detail=f"Product not found: {min(product_ids - found)}")
+
+    if data.code:
+        duplicate = db.query(Recipe.id).filter(
+            Recipe.restaurant_id == restaurant_id,
+            Recipe.code == data.code,
+            Recipe.id != recipe_id
+        ).first()
+        if duplicate:
+            raise HTTPException(status_code=400, detail="Recipe code already exists")
+
+    # Compile the restaurant's recipes with this one as submitted
+    yields, components, _ = recipe_engine.load_recipes(db, restaurant_id)
+    sub_recipe_ids = {c.sub_recipe_id for c in data.components if c.sub_recipe_id is not None}
+    missing = sub_recipe_ids - set(yields)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Sub-recipe not found: {min(missing)}")
+
+    key = recipe_id if recipe_id is not None else 0  # New recipes cannot be referenced yet
+    yields[key] = data.yield_quantity
+    components[key] = [(c.product_id, c.sub_recipe_id, c.quantity) for c in data.components]
+    try:
+        recipe_engine.flatten_recipes(yields, components)
+    except recipe_engine.RecipeCycleError:
+        raise HTTPException(status_code=400, detail="A recipe cannot contain itself through its sub-recipes")
+
+@router.get("/")
+async def get_recipes(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """List recipes of the current restaurant"""
+    if current_user.restaurant_id is None:
+        raise HTTPException(status_code=403, detail="User not assigned to restaurant")
+
+    matrix = recipe_engine.get_matrix(db, current_user.restaurant_id)
+    recipes = db.query(Recipe).filter(
+        Recipe.restaurant_id == current_user.restaurant_id
+    ).order_by(Recipe.name).all()
+
+    return [
+        {
+            "id": r.id,
+            "name": r.name,
+            "code": r.code,
+            "yield_quantity": r.yield_quantity,
+            "ingredient_count": len(matrix.row(r.id)) if r.id in matrix else 0
+        }
+        for r in recipes
+    ]
+
+@router.post("/")
+async def create_recipe(
+    recipe: RecipeCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Create a recipe (dish or sub-recipe)"""
+    if current_user.restaurant_id is None:
+        raise HTTPException(status_code=403, detail="User not assigned to restaurant")
+
+    validate_recipe(db, current_user.restaurant_id, recipe)
+
+    db_recipe = Recipe(
+        restaurant_id=current_user.restaurant_id,
+        name=recipe.name.strip(),
+        code=recipe.code or None,
+        yield_quantity=recipe.yield_quantity,
+        components=[
+            RecipeComponent(product_id=c.product_id, sub_recipe_id=c.sub_recipe_id, quantity=c.quantity)
+            for c in recipe.components
+        ]
+    )
+    db.add(db_recipe)
+    db.commit()
+    db.refresh(db_recipe)
+
+    bump_version(db, recipe_scope(current_user.restaurant_id))
+    return recipe_to_dict(db, db_recipe)
+
+@router.post("/explode")
+async def explode_recipes(
+    request: ExplodeRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Products consumed by a batch of sold dishes (preview, nothing is written)"""
+    if current_user.restaurant_id is None:
+        raise HTTPException(status_code=403, detail="User not assigned to restaurant")
+
+    matrix = recipe_engine.get_matrix(db, current_user.restaurant_id)
+    sold = {}
+    for item in request.items:
+        recipe_id = item.recipe_id if item.recipe_id is not None else matrix.codes.get(item.code)
+        if recipe_id not in matrix:
+            raise HTTPException(status_code=404, detail=f"Recipe not found: {item.recipe_id or item.code}")
+        sold[recipe_id] = sold.get(recipe_id, Decimal("0")) + item.quantity
+
+    return {"depletion": _product_lines(db, current_user.restaurant_id, matrix.multiply(sold))}
+
+@router.get("/{recipe_id}")
+async def get_recipe(
+    recipe_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get a recipe with its components and flattened ingredients"""
+    recipe = db.query(Recipe).filter(
+        Recipe.id == recipe_id,
+        Recipe.restaurant_id == current_user.restaurant_id
+    ).first()
+    if not recipe:
+        raise HTTPException(status_code=404, detail="Recipe not found")
+
+    return recipe_to_dict(db, recipe)
+
+@router.put("/{recipe_id}")
+async def update_recipe(
+    recipe_id: int,
+    recipe_update: RecipeCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Replace a recipe's fields and components"""
+    recipe = db.query(Recipe).filter(
+        Recipe.id == recipe_id,
+        Recipe.restaurant_id == current_user.restaurant_id
+    ).first()
+    if not recipe:
+        raise HTTPException(status_code=404, detail="Recipe not found")
+
+    validate_recipe(db, current_user.restaurant_id, recipe_update, recipe_id=recipe.id)
+
+    recipe.name = recipe_update.name.strip()
+    recipe.code = recipe_update.code or None
+    recipe.yield_quantity = recipe_update.yield_quantity
+    recipe.components = [
+        RecipeComponent(product_id=c.product_id, sub_recipe_id=c.sub_recipe_id, quantity=c.quantity)
+        for c in recipe_update.components
+    ]
+    db.commit()
+    db.refresh(recipe)
+
+    bump_version(db, recipe_scope(current_user.restaurant_id))
+    return recipe_to_dict(db, recipe)
+
+@router.delete("/{recipe_id}")
+async def delete_recipe(
+    recipe_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Delete a recipe that is not used as a sub-recipe"""
+    recipe = db.query(Recipe).filter(
+        Recipe.id == recipe_id,
+        Recipe.restaurant_id == current_user.restaurant_id
+    ).first()
+    if not recipe:
+        raise HTTPException(status_code=404, detail="Recipe not found")
+
+    parents = [
+        name for (name,) in db.query(Recipe.name).join(
+            RecipeComponent, RecipeComponent.recipe_id == Recipe.id
+        ).filter(RecipeComponent.sub_recipe_id == recipe.id).distinct().all()
+    ]
+    if parents:
+        raise HTTPException(status_code=409, detail={"message": "Recipe is used as a sub-recipe", "used_in": parents})
+
+    db.delete(recipe)
+    db.commit()
+
+    bump_version(db, recipe_scope(current_user.restaurant_id))
+    return {"message": "Recipe deleted successfully"}
@@ -18,14 +18,34 @@ from backend.models.database import (
     Product, StockMovement, Invoice, InvoiceItem, WasteLog, 
     PhysicalCount, User, Category, Provider, get_db
 )
+from backend.models.enums import StockMovementType
 from backend.api.auth import get_current_user, SessionLocal
 from backend.utils.calculations import ReportCalculator
 from backend.utils.report_generator import ReportGenerator
+from backend.utils import reference_cache
+from backend.utils.archive import archived_rows
+from backend.utils.valuation import UNASSIGNED, inventory_totals, valuation_totals
 from fastapi.responses import StreamingResponse
 
 # Router
 router = APIRouter()
 
+def valuation_breakdown(db: Session, restaurant_id: int, group_by: str) -> List[dict]:
+    """Inventory value per category or provider (a read of the valuation aggregates)"""
+    table = reference_cache.categories if group_by == "category" else reference_cache.providers
+    names = table.names(db)
+    breakdown = [
+        {
+            "id": key if key != UNASSIGNED else None,
+            "name": names.get(key, "Unknown") if key != UNASSIGNED else "Unassigned",
+            "product_count": totals["product_count"],
+            "total_value": round(totals["total_value"], 2)
+        }
+        for key, totals in valuation_totals(db, restaurant_id, group_by).items()
+        if totals["product_count"]
+    ]
+    return sorted(breakdown, key=lambda x: x["total_value"], reverse=True)
+
 @router.get("/inventory-valuation")
 async def get_inventory_valuation_report(
     format: str = Query("json", pattern="^(json|excel|pdf)$"),
@@ -37,22 +57,26 @@ async def get_inventory_valuation_report(
     if current_user.restaurant_id is None:
         raise HTTPException(status_code=403, detail="User not assigned to restaurant")
     
-    # Calculate inventory value
-    products = db.query(Product).filter(
+    # Totals come from the valuation aggregates; only the item list reads products
+    _, total_value = inventory_totals(db, current_user.restaurant_id)
+    
+    products = db.query(
+        Product.id, Product.name, Product.category_id, Product.unit,
+        Product.current_stock, Product.cost_price, Product.min_stock
+    ).filter(
         Product.restaurant_id == current_user.restaurant_id
     ).all()
     
+    categories = reference_cache.categories.names(db)
     report_data = []
-    total_value = 0.0
     
     for product in products:
         item_value = product.current_stock * product.cost_price
-        total_value += item_value
         
         report_data.append({
             "product_id": product.id,
             "product_name": product.name,
-            "category": product.category.name if product.category else "Unknown",
+            "category": categories.get(product.category_id, "Unknown"),
             "unit": product.unit,
             "current_stock": product.current_stock,
             "cost_price": product.cost_price,
@@ -67,6 +91,8 @@ async def get_inventory_valuation_report(
             "restaurant_id": current_user.restaurant_id,
             "total_products": len(report_data),
             "total_inventory_value": round(total_value, 2),
+            "by_category": valuation_breakdown(db, current_user.restaurant_id, "category"),
+            "by_provider": valuation_breakdown(db, current_user.restaurant_id, "provider"),
             "items": sorted(report_data, key=lambda x: x["total_value"], reverse=True)
         }
         return report
@@ -134,6 +160,10 @@ async def get_consumption_report(
         StockMovement.created_at >= start_date,
         StockMovement.created_at <= end_date
     ).all()
+    movements += [
+        m for m in archived_rows(db, "stock_movements", current_user.restaurant_id, start_date, end_date)
+        if m.movement_type == StockMovementType.OUT
+    ]
     
     consumption_data = {}
     total_consumption = 0.0
@@ -147,7 +177,7 @@ async def get_consumption_report(
         total_consumption += consumption_value
         
         if group_by == "category":
-            key = product.category.name if product.category else "Unknown"
+            key = reference_cache.categories.name(db, product.category_id)
         else:
             key = product.name
         
@@ -265,6 +295,7 @@ async def get_waste_analysis_report(
         WasteLog.created_at >= start_date,
         WasteLog.created_at <= end_date
     ).all()
+    waste_logs += archived_rows(db, "waste_logs", current_user.restaurant_id, start_date, end_date)
     
     waste_data = {}
     total_waste_value = 0.0
@@ -419,39 +450,51 @@ async def get_theoretical_vs_actual_report(
             "variance": round(analysis["variance"], 2),
             "variance_percentage": round(analysis["variance_percentage"], 2),
             "is_abnormal": analysis["is_abnormal"],
-            "interpretation": "Actual consumption exceeds theoretical" if analysis["variance"] > 0 else "Actual consumption is below theoretical"
+            "interpretation": "Actual consumption exceeds theoretical" if analysis["variance"] > 0 else "Actual consumption is below theoretical",
+            "products_analyzed": analysis["product_count"],
+            "products": analysis["products"]
         }
 
     # Prepare data for export
-    # Since this is a specialized report, we create a summary-like table
+    # One row per product (ranked by variance value) plus a totals row
     flat_data = [{
-        "metric": "Consumo Teórico",
-        "value": round(analysis["theoretical"], 2),
-        "unit": "$"
-    }, {
-        "metric": "Consumo Real",
-        "value": round(analysis["actual"], 2),
-        "unit": "$"
-    }, {
-        "metric": "Variación",
-        "value": round(analysis["variance"], 2),
-        "unit": "$"
-    }, {
-        "metric": "% Variación",
-        "value": round(analysis["variance_percentage"], 2),
-        "unit": "%"
-    }]
+        "product_name": item["product_name"],
+        "unit": item["unit"],
+        "opening_stock": item["opening_stock"],
+        "purchases": item["purchases"],
+        "closing_stock": item["closing_stock"],
+        "theoretical": item["theoretical"],
+        "actual": item["actual"],
+        "variance": item["variance"],
+        "variance_value": item["variance_value"]
+    } for item in analysis["products"]]
+    flat_data.append({
+        "product_name": "TOTAL",
+        "unit": "$",
+        "theoretical": round(analysis["theoretical"], 2),
+        "actual": round(analysis["actual"], 2),
+        "variance_value": round(analysis["variance"], 2)
+    })
             
     columns = [
-        {"key": "metric", "header": "Métrica"},
-        {"key": "value", "header": "Valor"},
-        {"key": "unit", "header": "Unidad"}
+        {"key": "product_name", "header": "Producto"},
+        {"key": "unit", "header": "Unidad"},
+        {"key": "opening_stock", "header": "Stock Inicial"},
+        {"key": "purchases", "header": "Compras"},
+        {"key": "closing_stock", "header": "Stock Final"},
+        {"key": "theoretical", "header": "Teórico"},
+        {"key": "actual", "header": "Real"},
+        {"key": "variance", "header": "Variación"},
+        {"key": "variance_value", "header": "Variación $"}
     ]
     
     filename = f"teorico_vs_real_{date_from}_{date_to}"
     title = f"Teórico vs Real ({date_from} a {date_to})"
     
     summary = {
+        "Consumo Teórico": f"${analysis['theoretical']:,.2f}",
+        "Consumo Real": f"${analysis['actual']:,.2f}",
+        "% Variación": f"{analysis['variance_percentage']:.2f}%",
         "Estado": "ANORMAL (Posible Robo)" if analysis["is_abnormal"] else "Normal",
         "Conclusión": "Consumo Real > Teórico" if analysis["variance"] > 0 else "Ahorro vs Teórico"
     }
@@ -509,7 +552,6 @@ async def get_purchases_report(
     total_purchases = 0.0
     
     for invoice in invoices:
-        provider = db.query(Provider).filter(Provider.id == invoice.provider_id).first()
         item_count = db.query(InvoiceItem).filter(InvoiceItem.invoice_id == invoice.id).count()
         
         total_purchases += invoice.total
@@ -518,7 +560,7 @@ async def get_purchases_report(
             "invoice_id": invoice.id,
             "invoice_number": invoice.invoice_number,
             "invoice_date": invoice.invoice_date.isoformat(),
-            "provider_name": provider.name if provider else "Unknown",
+            "provider_name": reference_cache.providers.name(db, invoice.provider_id),
             "subtotal": invoice.subtotal,
             "tax": invoice.tax,
             "total": invoice.total,
@@ -614,7 +656,7 @@ async def get_rotation_analysis_report(
         rotation_data.append({
             "product_id": product.id,
             "product_name": product.name,
-            "category": product.category.name if product.category else "Unknown",
+            "category": reference_cache.categories.name(db, product.category_id),
             "current_stock": product.current_stock,
             "total_out": total_out,
             "total_in": total_in,
@@ -696,7 +738,7 @@ async def get_obsolete_products_report(
         obsolete_products.append({
             "product_id": product.id,
             "product_name": product.name,
-            "category": product.category.name if product.category else "Unknown",
+            "category": reference_cache.categories.name(db, product.category_id),
             "current_stock": product.current_stock,
             "unit": product.unit,
             "cost_price": product.cost_price,
@@ -0,0 +1,54 @@
+"""
+POS sales ingestion API
+API de ingesta de ventas del POS
+"""
+
+from fastapi import APIRouter, HTTPException, Depends, Request
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+
+from backend.models.database import User, get_db
+from backend.api.auth import get_current_user
+from backend.utils.data_version import bump_tenant_version
+from backend.utils.sales_ingest import SalesIngestor, parse_sale_lines
+
+router = APIRouter()
+
+@router.post("/ingest")
+async def ingest_sales(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Apply a batch of POS sale lines as consumption.
+
+    Body: a JSON array of lines (or {"lines": [...]}), or NDJSON with
+    Content-Type application/x-ndjson. Each line has ticket_id, the item
+    sold (product_id or barcode for products, recipe_id or item_code for
+    dishes, which deplete their ingredients), quantity (negative for
+    returns) and optionally sold_at.
+    Tickets already ingested are skipped, so a batch can be resent safely.
+    """
+    if current_user.restaurant_id is None:
+        raise HTTPException(status_code=403, detail="User not assigned to restaurant")
+
+    try:
+        lines = parse_sale_lines(await request.body(), request.headers.get("content-type"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Could not read sale lines: {str(e)}")
+
+    if not lines:
+        raise HTTPException(status_code=400, detail="No sale lines provided")
+
+    ingestor = SalesIngestor(db, current_user.restaurant_id, current_user.id)
+    try:
+        result = ingestor.run(lines)
+    except IntegrityError:
+        # Only without ON CONFLICT support: another batch claimed one of these tickets first
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Some tickets are being ingested by another request; retry the batch")
+
+    if result["products_updated"]:
+        bump_tenant_version(db, current_user.restaurant_id)
+
+    return result
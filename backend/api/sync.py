@@ -0,0 +1,105 @@
+"""
+Delta sync API for offline-capable clients
+API de sincronización incremental para clientes con réplica local
+"""
+
+from fastapi import APIRouter, HTTPException, Depends, Query
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, or_
+from datetime import timedelta
+from typing import Optional
+
+from backend.models.database import Alert, Category, DeletedRecord, Product, Provider, User, get_db
+from backend.api.auth import get_current_user
+from backend.api.products import build_product_responses, product_list_query
+from backend.utils.data_version import CATEGORIES_SCOPE, PROVIDERS_SCOPE, get_versions
+from backend.utils.sync import (
+    SYNC_OVERLAP_SECONDS, TOMBSTONE_RETENTION_DAYS, db_now, decode_sync_token, encode_sync_token
+)
+
+router = APIRouter()
+
+def alert_to_dict(alert: Alert) -> dict:
+    return {
+        "id": alert.id,
+        "type": alert.alert_type,
+        "severity": alert.severity,
+        "title": alert.title,
+        "message": alert.message,
+        "entity_type": alert.entity_type,
+        "entity_id": alert.entity_id,
+        "created_at": alert.created_at.isoformat() if alert.created_at else None
+    }
+
+@router.get("/changes")
+async def get_changes(
+    since: Optional[str] = Query(None, description="Token from the previous sync; omit for a full sync"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Rows created, updated or deleted since the client's last sync.
+
+    Each entity is returned as {replace, upserts, deletes}: with `replace`
+    the client drops its local copy and keeps only `upserts`; otherwise it
+    upserts and removes the given ids. Rows may be sent more than once
+    (the window overlaps the previous sync), so applying a change must be
+    idempotent. The returned `token` is sent as `since` next time.
+    """
+    if current_user.restaurant_id is None:
+        raise HTTPException(status_code=403, detail="User not assigned to restaurant")
+
+    restaurant_id = current_user.restaurant_id
+    now = db_now(db)
+    versions = get_versions(db, [CATEGORIES_SCOPE, PROVIDERS_SCOPE])
+
+    previous = decode_sync_token(since) if since else None
+    full = previous is None or previous["since"] < now - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    window_start = None if full else previous["since"] - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+
+    # Products: changed rows plus tombstones of deleted ones
+    product_query = product_list_query(db).filter(Product.restaurant_id == restaurant_id)
+    product_deletes = []
+    if not full:
+        product_query = product_query.filter(or_(
+            Product.updated_at >= window_start,
+            Product.created_at >= window_start
+        ))
+        product_deletes = [
+            entity_id for (entity_id,) in db.query(DeletedRecord.entity_id).filter(
+                DeletedRecord.restaurant_id == restaurant_id,
+                DeletedRecord.entity_type == "product",
+                DeletedRecord.deleted_at >= window_start
+            ).all()
+        ]
+    products = build_product_responses(product_query.order_by(Product.id).all(), db)
+
+    # Alerts: new active alerts; dismissed ones are sent as deletes
+    alert_query = db.query(Alert).filter(Alert.restaurant_id == restaurant_id)
+    if full:
+        alerts = alert_query.filter(Alert.is_active == True).all()
+        alert_deletes = []
+    else:
+        changed = alert_query.filter(or_(
+            Alert.created_at >= window_start,
+            and_(Alert.dismissed_at != None, Alert.dismissed_at >= window_start)
+        )).all()
+        alerts = [a for a in changed if a.is_active]
+        alert_deletes = [a.id for a in changed if not a.is_active]
+
+    # Categories and providers are small global tables: resend them whole
+    # whenever their version moved
+    def reference_changes(model, scope: str, fields):
+        if not full and previous["versions"].get(scope) == versions[scope]:
+            return {"replace": False, "upserts": [], "deletes": []}
+        columns = [getattr(model, field) for field in fields]
+        rows = db.query(*columns).filter(model.is_active == True).order_by(model.id).all()
+        return {"replace": True, "upserts": [dict(zip(fields, row)) for row in rows], "deletes": []}
+
+    return {
+        "token": encode_sync_token(now, versions),
+        "full": full,
+        "products": {"replace": full, "upserts": products, "deletes": product_deletes},
+        "categories": reference_changes(Category, CATEGORIES_SCOPE, ("id", "name", "type", "icon")),
+        "providers": reference_changes(Provider, PROVIDERS_SCOPE, ("id", "name", "contact_person")),
+        "alerts": {"replace": full, "upserts": [alert_to_dict(a) for a in alerts], "deletes": alert_deletes}
+    }
@@ -3,11 +3,11 @@ Waste Management module
 Módulo de gestión de mermas
 """
 
-from fastapi import APIRouter, HTTPException, Depends, status, Query
+from fastapi import APIRouter, HTTPException, Depends, status, Query, Request, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import create_engine, func
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Union
 from decimal import Decimal
 from datetime import datetime
 import os
@@ -18,6 +18,9 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from backend.models.database import WasteLog, Product, User, get_db
 from backend.models.enums import WasteType
 from backend.api.auth import get_current_user, SessionLocal
+from backend.utils.pagination import order_by_keyset, paginate_keyset
+from backend.utils.data_version import bump_tenant_version, check_not_modified, tenant_scope
+from backend.utils.stock import NegativeStockError, apply_stock_delta
 
 # Router
 router = APIRouter()
@@ -61,8 +64,8 @@ async def create_waste_log(
     # if waste.waste_type not in valid_types:
     #    raise HTTPException(status_code=400, detail=f"Invalid waste type. Must be one of: {', '.join(valid_types)}")
     
-    # Get product with row lock to prevent race conditions
-    product = db.query(Product).filter(Product.id == waste.product_id).with_for_update().first()
+    # No row lock: the stock guard is part of the atomic UPDATE below
+    product = db.query(Product).filter(Product.id == waste.product_id).first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
@@ -124,44 +127,57 @@ async def create_waste_log(
 
     
     # Update product stock atomically (prevent race conditions)
-    rows_updated = db.query(Product).filter(
-        Product.id == waste.product_id
-    ).update({
-        "current_stock": Product.current_stock - waste.quantity
-    }, synchronize_session=False)
+    try:
+        change = apply_stock_delta(
+            db,
+            waste.product_id,
+            -waste.quantity,
+            allow_negative=False,
+            record_movement=False
+        )
+    except NegativeStockError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Waste quantity cannot exceed current stock")
     
-    if rows_updated == 0:
+    if change is None:
         db.rollback()
         raise HTTPException(status_code=500, detail="Failed to update stock")
     
     db.commit()
+    bump_tenant_version(db, current_user.restaurant_id)
     db.refresh(waste_log)
     
-    # Get updated stock for response
-    product = db.query(Product).filter(Product.id == waste.product_id).first()
-    
     return {
         "message": "Waste log created successfully",
         "waste_id": waste_log.id,
         "cost": cost,
-        "remaining_stock": product.current_stock
+        "remaining_stock": change.new_stock
     }
 
-@router.get("/", response_model=List[dict])
+@router.get("/", response_model=Union[List[dict], dict])
 async def get_waste_logs(
+    request: Request,
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="Keyset cursor; send an empty value for the first page"),
     waste_type: Optional[WasteType] = None,
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get waste logs with filtering"""
+    """Get waste logs with filtering
+    
+    With `cursor` the list is paginated by (created_at, id) newest first and
+    returned as {items, next_cursor}; skip/limit is kept for older clients.
+    """
     
     if current_user.restaurant_id is None:
         raise HTTPException(status_code=403, detail="User not assigned to restaurant")
     
+    check_not_modified(request, response, db, [tenant_scope(current_user.restaurant_id)])
+    
     query = db.query(WasteLog).filter(
         WasteLog.restaurant_id == current_user.restaurant_id
     )
@@ -185,7 +201,13 @@ async def get_waste_logs(
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid date_to format")
     
-    waste_logs = query.order_by(WasteLog.created_at.desc()).offset(skip).limit(limit).all()
+    sort_key = (WasteLog.created_at, WasteLog.id)
+    next_cursor = None
+    
+    if cursor is not None:
+        waste_logs, next_cursor = paginate_keyset(query, sort_key, cursor, limit, descending=True)
+    else:
+        waste_logs = order_by_keyset(query, sort_key, descending=True).offset(skip).limit(limit).all()
     
     result = []
     for log in waste_logs:
@@ -205,6 +227,9 @@ async def get_waste_logs(
             "created_at": log.created_at.isoformat() if log.created_at else None
         })
     
+    if cursor is not None:
+        return {"items": result, "next_cursor": next_cursor}
+    
     return result
 
 @router.get("/{waste_id}")
@@ -270,6 +295,7 @@ async def update_waste_log(
         setattr(waste_log, field, value)
     
     db.commit()
+    bump_tenant_version(db, current_user.restaurant_id)
     db.refresh(waste_log)
     
     return {
@@ -296,13 +322,12 @@ async def delete_waste_log(
     if current_user.role != "admin" and datetime.utcnow() - waste_log.created_at > timedelta(days=1):
         raise HTTPException(status_code=400, detail="Cannot delete waste log older than 24 hours")
     
-    # Get product and restore stock (with lock)
-    product = db.query(Product).filter(Product.id == waste_log.product_id).with_for_update().first()
-    if product:
-        product.current_stock += waste_log.quantity
+    # Restore stock atomically (the waste log itself was the record, no movement)
+    apply_stock_delta(db, waste_log.product_id, waste_log.quantity, record_movement=False)
     
     db.delete(waste_log)
     db.commit()
+    bump_tenant_version(db, current_user.restaurant_id)
     
     return {"message": "Waste log deleted successfully"}
 
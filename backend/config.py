@@ -38,6 +38,20 @@ class Settings:
         "ALLOWED_FILE_TYPES",
         "image/jpeg,image/png,application/pdf"
     ).split(",")
+    # OCR worker processes (0 = one per CPU), seconds allowed per scan
+    # and scans waiting or running before new ones are refused
+    OCR_WORKERS: int = int(os.getenv("OCR_WORKERS", "0"))
+    OCR_TIMEOUT_SECONDS: int = int(os.getenv("OCR_TIMEOUT_SECONDS", "60"))
+    OCR_MAX_PENDING: int = int(os.getenv("OCR_MAX_PENDING", "32"))
+    # OCR results kept per restaurant for repeated uploads of the same file
+    OCR_CACHE_MAX_ENTRIES: int = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "500"))
+    # Batch uploads: files per batch (ZIP members included) and total upload size
+    OCR_BATCH_MAX_FILES: int = int(os.getenv("OCR_BATCH_MAX_FILES", "100"))
+    OCR_BATCH_MAX_SIZE_MB: int = int(os.getenv("OCR_BATCH_MAX_SIZE_MB", "200"))
+    
+    # Archival of stock movements and waste logs
+    ARCHIVE_DIR: str = os.getenv("ARCHIVE_DIR", "archive")
+    ARCHIVE_KEEP_MONTHS: int = int(os.getenv("ARCHIVE_KEEP_MONTHS", "12"))
     
     # Rate Limiting
     RATE_LIMIT_LOGIN_ATTEMPTS: int = int(os.getenv("RATE_LIMIT_LOGIN_ATTEMPTS", "5"))
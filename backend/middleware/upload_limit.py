@@ -0,0 +1,97 @@
+"""
+Upload size limit middleware
+Middleware que corta las subidas demasiado grandes antes de leerlas enteras
+
+FastAPI parses a multipart body completely before the endpoint runs, so a
+size check in the endpoint comes after the whole upload has been received
+and spooled. This middleware rejects OCR uploads whose Content-Length
+exceeds the limit with 413 right away, and stops reading chunked bodies as
+soon as they pass it.
+"""
+
+import json
+from typing import Callable, Optional
+
+from backend.config import settings
+
+# Room for the multipart boundaries, headers and form fields
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+def upload_limit(path: str) -> Optional[int]:
+    """Maximum request body in bytes for an upload path, None when unlimited"""
+    if path.startswith("/api/invoices/ocr/batch"):
+        return settings.OCR_BATCH_MAX_SIZE_MB * 1024 * 1024 + MULTIPART_OVERHEAD
+    if path.startswith("/api/invoices/ocr/process"):
+        return settings.MAX_UPLOAD_SIZE_MB * 1024 * 1024 + MULTIPART_OVERHEAD
+    return None
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware enforcing upload_limit() on request bodies"""
+
+    def __init__(self, app, limit_for: Callable[[str], Optional[int]] = upload_limit):
+        self.app = app
+        self.limit_for = limit_for
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            return await self.app(scope, receive, send)
+
+        limit = self.limit_for(scope["path"])
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            return await self._reject(send, limit)
+
+        received = 0
+        too_large = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    too_large = True
+                    raise BodyTooLarge()
+            return message
+
+        async def limited_send(message):
+            nonlocal rejected
+            # The body parser turns the error into its own response (400): send 413 instead
+            if too_large:
+                if not rejected:
+                    rejected = True
+                    await self._reject(send, limit)
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, limited_send)
+        except BodyTooLarge:
+            if not rejected:
+                await self._reject(send, limit)
+
+    async def _reject(self, send, limit: int) -> None:
+        body = json.dumps({
+            "detail": f"Upload too large. Maximum size: {limit // (1024 * 1024)}MB"
+        }).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -3,7 +3,7 @@ Modelos de base de datos para Sistema Enterprise de Inventarios
 Enterprise Restaurant Inventory System - Database Models
 """
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Text, Date, Numeric, create_engine
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Text, Date, Numeric, Index, UniqueConstraint, create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 from sqlalchemy.sql import func
@@ -122,6 +122,13 @@ class Provider(Base):
 class Product(Base):
     """Modelo principal para productos del inventario"""
     __tablename__ = "products"
+    __table_args__ = (
+        # Keyset pagination: (restaurant_id, name, id)
+        Index("ix_products_restaurant_name_id", "restaurant_id", "name", "id"),
+        # Delta sync: rows changed since a timestamp
+        Index("ix_products_restaurant_updated_at", "restaurant_id", "updated_at"),
+        Index("ix_products_restaurant_created_at", "restaurant_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), nullable=False, index=True)
@@ -160,6 +167,10 @@ class Product(Base):
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, onupdate=func.now())
     
+    # Concurrencia optimista: cada UPDATE compara y aumenta la versión
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
+    
     # Relaciones
     category = relationship("Category", back_populates="products")
     provider = relationship("Provider", back_populates="products")
@@ -191,6 +202,10 @@ class StockMovement(Base):
 class Invoice(Base):
     """Modelo para facturas procesadas por OCR"""
     __tablename__ = "invoices"
+    __table_args__ = (
+        # Keyset pagination: (restaurant_id, created_at, id)
+        Index("ix_invoices_restaurant_created_id", "restaurant_id", "created_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     invoice_number = Column(String(50), nullable=False)
@@ -245,6 +260,10 @@ class InvoiceItem(Base):
 class PhysicalCount(Base):
     """Modelo para conteos físicos de inventario"""
     __tablename__ = "physical_counts"
+    __table_args__ = (
+        # Keyset pagination: (restaurant_id, started_at, id)
+        Index("ix_physical_counts_restaurant_started_id", "restaurant_id", "started_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     restaurant_id = Column(Integer, ForeignKey("restaurants.id"))
@@ -280,6 +299,10 @@ class PhysicalCountItem(Base):
     # Ajuste realizado
     adjustment_made = Column(Boolean, default=False)
     
+    # Concurrencia optimista
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
+    
     # Relaciones
     count = relationship("PhysicalCount", back_populates="items")
     product = relationship("Product")
@@ -288,6 +311,10 @@ class PhysicalCountItem(Base):
 class WasteLog(Base):
     """Modelo para registro de mermas"""
     __tablename__ = "waste_logs"
+    __table_args__ = (
+        # Keyset pagination: (restaurant_id, created_at, id)
+        Index("ix_waste_logs_restaurant_created_id", "restaurant_id", "created_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id"))
@@ -344,4 +371,188 @@ class Alert(Base):
     entity_type = Column(String(20))  # product, count, etc
     entity_id = Column(Integer)  # ID del objeto relacionado
     
-    created_at = Column(DateTime, server_default=func.now())
\ No newline at end of file
+    created_at = Column(DateTime, server_default=func.now())
+
+
+class DataVersion(Base):
+    """Modelo para versiones de datos por tenant o tabla global (ETags)"""
+    __tablename__ = "data_versions"
+    
+    scope = Column(String(50), primary_key=True)  # tenant:<id>, categories, providers
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class InventoryValuation(Base):
+    """Modelo para valorización agregada del inventario (restaurante, categoría, proveedor)"""
+    __tablename__ = "inventory_valuations"
+    __table_args__ = (
+        UniqueConstraint("restaurant_id", "category_id", "provider_id", name="uq_inventory_valuation"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), nullable=False)
+    category_id = Column(Integer, nullable=False, default=0)  # 0 = sin categoría
+    provider_id = Column(Integer, nullable=False, default=0)  # 0 = sin proveedor
+    product_count = Column(Integer, nullable=False, default=0)
+    total_value = Column(Numeric(18, 5), nullable=False, default=0)  # SUM(current_stock * cost_price)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class Recipe(Base):
+    """Modelo para recetas (platos del menú y sub-recetas)"""
+    __tablename__ = "recipes"
+    __table_args__ = (
+        UniqueConstraint("restaurant_id", "code", name="uq_recipe_code"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), nullable=False)
+    name = Column(String(100), nullable=False)
+    code = Column(String(64))  # Código del plato en el POS (PLU)
+    yield_quantity = Column(Numeric(12, 3), nullable=False, default=1)  # Porciones que rinde
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, onupdate=func.now())
+    
+    # Relaciones
+    components = relationship(
+        "RecipeComponent", foreign_keys="RecipeComponent.recipe_id",
+        back_populates="recipe", cascade="all, delete-orphan"
+    )
+
+
+class RecipeComponent(Base):
+    """Modelo para componentes de receta (producto o sub-receta por porción)"""
+    __tablename__ = "recipe_components"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    recipe_id = Column(Integer, ForeignKey("recipes.id"), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"))
+    sub_recipe_id = Column(Integer, ForeignKey("recipes.id"))
+    quantity = Column(Numeric(12, 4), nullable=False)
+    
+    # Relaciones
+    recipe = relationship("Recipe", foreign_keys=[recipe_id], back_populates="components")
+
+
+class SaleTicket(Base):
+    """Modelo para tickets de venta del POS ya ingeridos (idempotencia)"""
+    __tablename__ = "sale_tickets"
+    __table_args__ = (
+        UniqueConstraint("restaurant_id", "ticket_id", name="uq_sale_ticket"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), nullable=False)
+    ticket_id = Column(String(64), nullable=False)  # ID del ticket en el POS
+    batch_id = Column(String(32), nullable=False)  # reference_id de los movimientos generados
+    line_count = Column(Integer, nullable=False, default=0)
+    sold_at = Column(DateTime)
+    created_at = Column(DateTime, server_default=func.now())
+
+
+class ProductAlias(Base):
+    """Modelo para alias de líneas de factura por proveedor (texto normalizado -> producto)"""
+    __tablename__ = "product_aliases"
+    __table_args__ = (
+        UniqueConstraint("restaurant_id", "provider_id", "line_text", name="uq_product_alias"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), nullable=False)
+    provider_id = Column(Integer, ForeignKey("providers.id"), nullable=False)
+    line_text = Column(String(200), nullable=False)  # Texto de la línea normalizado
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    times_confirmed = Column(Integer, nullable=False, default=1)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now())
+
+
+class OCRResultCache(Base):
+    """Modelo para resultados OCR cacheados por hash del archivo (subidas duplicadas)"""
+    __tablename__ = "ocr_results"
+    __table_args__ = (
+        UniqueConstraint("restaurant_id", "content_hash", name="uq_ocr_result"),
+        # LRU eviction per restaurant
+        Index("ix_ocr_results_restaurant_last_used", "restaurant_id", "last_used_at"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), nullable=False)
+    content_hash = Column(String(64), nullable=False)  # SHA-256 del archivo subido
+    content_type = Column(String(100))
+    file_size = Column(Integer, nullable=False, default=0)
+    result = Column(Text, nullable=False)  # JSON: texto raw y campos extraídos
+    hit_count = Column(Integer, nullable=False, default=0)  # Subidas repetidas
+    created_at = Column(DateTime, server_default=func.now())
+    last_used_at = Column(DateTime, server_default=func.now())
+
+
+class OCRBatchJob(Base):
+    """Modelo para lotes de facturas subidas juntas para OCR (varios archivos o ZIP)"""
+    __tablename__ = "ocr_batch_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), nullable=False, index=True)
+    created_by = Column(Integer, ForeignKey("users.id"))
+    status = Column(String(20), nullable=False, default="processing")  # processing, completed, interrupted, failed
+    file_count = Column(Integer, nullable=False, default=0)
+    done_count = Column(Integer, nullable=False, default=0)
+    failed_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, server_default=func.now())
+    finished_at = Column(DateTime)
+    
+    # Relationships
+    files = relationship("OCRBatchFile", back_populates="job", order_by="OCRBatchFile.position")
+
+
+class OCRBatchFile(Base):
+    """Modelo para cada archivo de un lote OCR y su resultado"""
+    __tablename__ = "ocr_batch_files"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("ocr_batch_jobs.id"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    filename = Column(String(255), nullable=False)  # Nombre subido o ruta dentro del ZIP
+    content_type = Column(String(100))
+    file_size = Column(Integer, nullable=False, default=0)
+    content_hash = Column(String(64))
+    status = Column(String(20), nullable=False, default="queued")  # queued, processing, done, failed
+    duplicate = Column(Boolean, default=False)  # Ya escaneado antes (resultado de la caché)
+    result = Column(Text)  # JSON con los campos extraídos
+    error = Column(String(500))
+    finished_at = Column(DateTime)
+    
+    # Relationships
+    job = relationship("OCRBatchJob", back_populates="files")
+
+
+class ArchivedPeriod(Base):
+    """Modelo para periodos archivados (movimientos y mermas en almacenamiento frío)"""
+    __tablename__ = "archived_periods"
+    __table_args__ = (
+        UniqueConstraint("table_name", "restaurant_id", "period_start", name="uq_archived_period"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    table_name = Column(String(50), nullable=False)  # stock_movements, waste_logs
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"))
+    period_start = Column(DateTime, nullable=False)  # Primer día del mes
+    period_end = Column(DateTime, nullable=False)  # Primer día del mes siguiente
+    row_count = Column(Integer, nullable=False, default=0)
+    file_path = Column(String(500), nullable=False)  # Relativo a ARCHIVE_DIR
+    archived_at = Column(DateTime, server_default=func.now())
+
+
+class DeletedRecord(Base):
+    """Modelo para registros eliminados (tombstones para sincronización)"""
+    __tablename__ = "deleted_records"
+    __table_args__ = (
+        Index("ix_deleted_records_restaurant_deleted_at", "restaurant_id", "deleted_at"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"))
+    entity_type = Column(String(20), nullable=False)  # product
+    entity_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, server_default=func.now())
@@ -0,0 +1,41 @@
+"""
+Archive closed months of stock movements and waste logs
+Archiva los meses cerrados de movimientos de stock y mermas
+
+Run periodically (e.g. monthly cron): python -m backend.scripts.archive_history [--keep-months N]
+"""
+
+import argparse
+import os
+import sys
+
+# Add root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.config import settings
+from backend.models.database import SessionLocal, engine
+from backend.utils.archive import archive_closed_periods
+from backend.utils.partitions import ensure_partitions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive closed months of stock movements and waste logs")
+    parser.add_argument("--keep-months", type=int, default=settings.ARCHIVE_KEEP_MONTHS,
+                        help="Closed months kept in the hot tables")
+    args = parser.parse_args()
+
+    ensure_partitions(engine)
+
+    db = SessionLocal()
+    try:
+        archived = archive_closed_periods(db, keep_months=args.keep_months)
+    finally:
+        db.close()
+
+    for entry in archived:
+        print(f"✅ {entry['table']} {entry['month']}: {entry['restaurants']} restaurante(s)")
+    print(f"\n✨ {len(archived)} periodo(s) archivado(s) en {settings.ARCHIVE_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+Benchmark of the invoice text parser
+Benchmark del parser de texto de facturas
+
+Compares OCRParser.parse_text with the previous implementation (kept below
+as the baseline: patterns as raw strings, three product patterns tried per
+line and a second pass over the lines for the fallback) and checks that
+both produce the same fields and line items.
+
+Usage: python -m backend.scripts.benchmark_ocr_parser [--corpus DIR] [--documents N] [--repeat N]
+Without --corpus a reproducible synthetic corpus of Spanish and German
+invoices is generated; with it every *.txt file in DIR (e.g. saved
+invoices.ocr_text values) is used.
+"""
+
+import argparse
+import glob
+import os
+import random
+import re
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# Add root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.utils.ocr_parser import MAX_ITEMS, OCRParser
+
+
+class LegacyOCRParser:
+    """Text parsing of OCRParser before the single-pass rewrite (baseline)"""
+    
+    def __init__(self):
+        # Spanish invoice patterns
+        self.invoice_patterns = {
+            'invoice_number': [
+                r'(?:factura|rechnung|n[°º]\s+factura|nro\.?\s*factura|rechnungsnummer)[\s:]*([A-Z0-9\-]+)',
+                r'(?:n[°º]\s*[:.]?\s*)([A-Z0-9\-]{5,20})',
+                r'(?:ref\.?|referencia)[\s:]*([A-Z0-9\-]+)'
+            ],
+            'date': [
+                r'(?:fecha|datum|rechnungsdatum|fecha\s+de\s+emisi[óo]n)[\s:]*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
+                r'(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})'
+            ],
+            'provider': [
+                r'(?:proveedor|vendedor|lieferant|raz[óo]n\s+social|firma)[\s:]*(.{5,50})',
+                r'(?:nombre|empresa|name)[\s:]*(.{5,50})'
+            ],
+            'total': [
+                r'(?:total|gesamtsumme|gesamtbetrag|total\s+a\s+pagar)[\s:]*[€$]?\s*(\d+[,.]?\d{0,2})',
+                r'(?:summe)[\s:]*(\d+[,.]?\d{0,2})'
+            ],
+            'subtotal': [
+                r'(?:subtotal|netto|netto-betrag|base\s+imponible)[\s:]*[€$]?\s*(\d+[,.]?\d{0,2})'
+            ],
+            'tax': [
+                r'(?:iva|mwst|mehrwertsteuer|impuesto)[\s:]*[€$]?\s*(\d+[,.]?\d{0,2})',
+                r'(?:ust|vat)[\s:]*[€$]?\s*(\d+[,.]?\d{0,2})'
+            ]
+        }
+        
+        # Product line patterns
+        self.product_patterns = [
+            r'(.{5,40})\s+(\d+(?:[,.]\d{1,3})?)\s+x?\s*\$?\s*(\d+[,.]?\d{0,2})\s+\$?\s*(\d+[,.]?\d{0,2})',
+            r'(.{5,40})\s+\$?\s*(\d+[,.]?\d{0,2})\s+(\d+(?:[,.]\d{1,3})?)\s+\$?\s*(\d+[,.]?\d{0,2})',
+            r'(\d+(?:[,.]\d{1,3})?)\s+(.{5,40})\s+\$?\s*(\d+[,.]?\d{0,2})\s+\$?\s*(\d+[,.]?\d{0,2})'
+        ]
+    
+    def parse_text(self, text: str):
+        return self._parse_invoice_text(text), self._extract_products(text)
+    
+    def _parse_invoice_text(self, text: str) -> Dict[str, Optional[str]]:
+        """Parse invoice text to extract key fields"""
+        
+        result = {}
+        text_lower = text.lower()
+        
+        # Extract invoice number
+        result['invoice_number'] = self._extract_field(text, self.invoice_patterns['invoice_number'])
+        
+        # Extract date
+        date_str = self._extract_field(text, self.invoice_patterns['date'])
+        if date_str:
+            result['invoice_date'] = self._normalize_date(date_str)
+        else:
+            result['invoice_date'] = None
+        
+        # Extract provider
+        result['provider'] = self._extract_field(text, self.invoice_patterns['provider'])
+        
+        # Extract amounts
+        result['subtotal'] = self._extract_amount(text, self.invoice_patterns['subtotal'])
+        result['tax'] = self._extract_amount(text, self.invoice_patterns['tax'])
+        result['total'] = self._extract_amount(text, self.invoice_patterns['total'])
+        
+        return result
+    
+    def _extract_field(self, text: str, patterns: List[str]) -> Optional[str]:
+        """Extract field using regex patterns"""
+        
+        for pattern in patterns:
+            match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
+            if match:
+                value = match.group(1).strip()
+                # Clean up the value
+                value = re.sub(r'\s+', ' ', value)
+                value = value.replace('\n', ' ')
+                return value[:100]  # Limit length
+        
+        return None
+    
+    def _extract_amount(self, text: str, patterns: List[str]) -> Optional[float]:
+        """Extract monetary amount"""
+        
+        for pattern in patterns:
+            match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
+            if match:
+                try:
+                    amount_str = match.group(1).strip()
+                    # Clean and convert
+                    amount_str = amount_str.replace(',', '').replace('$', '')
+                    return float(amount_str)
+                except (ValueError, AttributeError):
+                    continue
+        
+        return None
+    
+    def _extract_products(self, text: str) -> List[Dict[str, Any]]:
+        """Extract product lines from invoice text"""
+        
+        products = []
+        lines = text.split('\n')
+        
+        for line in lines:
+            line = line.strip()
+            if len(line) < 10:  # Skip short lines
+                continue
+            
+            for pattern in self.product_patterns:
+                match = re.search(pattern, line, re.IGNORECASE)
+                if match:
+                    try:
+                        groups = match.groups()
+                        
+                        # Different patterns may have different group orders
+                        if len(groups) == 4:
+                            # Try to identify which group is which
+                            values = list(groups)
+                            
+                            # Find quantity (usually a whole number)
+                            quantity_idx = None
+                            for i, val in enumerate(values):
+                                if re.match(r'^\d+$', val.strip()):
+                                    quantity_idx = i
+                                    break
+                            
+                            if quantity_idx is not None:
+                                quantity = float(values[quantity_idx].replace(',', ''))
+                                
+                                # Find prices (decimal numbers)
+                                prices = []
+                                for i, val in enumerate(values):
+                                    if i != quantity_idx and re.search(r'\d+[,.]?\d{0,2}', val):
+                                        try:
+                                            price = float(val.replace(',', '').replace('$', ''))
+                                            prices.append(price)
+                                        except ValueError:
+                                            continue
+                                
+                                if len(prices) >= 2:
+                                    unit_price = min(prices)
+                                    total_price = max(prices)
+                                    
+                                    # Product name is the remaining value
+                                    name_values = [v for i, v in enumerate(values) if i not in [quantity_idx] + [i for i, p in enumerate(values) if p in [str(unit_price), str(total_price)]]]
+                                    product_name = name_values[0] if name_values else "Unknown Product"
+                                    
+                                    products.append({
+                                        "product_name": product_name[:50],
+                                        "quantity": quantity,
+                                        "unit_price": unit_price,
+                                        "total_price": total_price
+                                    })
+                                    break
+                                    
+                    except (ValueError, IndexError):
+                        continue
+        
+        # If no products found with patterns, try simple line parsing
+        if not products:
+            products = self._extract_products_simple(text)
+        
+        return products[:MAX_ITEMS]
+    
+    def _extract_products_simple(self, text: str) -> List[Dict[str, Any]]:
+        """Simple product extraction as fallback"""
+        
+        products = []
+        lines = text.split('\n')
+        
+        for line in lines:
+            # Look for lines with both text and numbers
+            if re.search(r'[a-zA-Z]{3,}', line) and re.search(r'\d+[,.]?\d{0,2}', line):
+                # Try to extract numbers
+                numbers = re.findall(r'\d+[,.]?\d{0,2}', line)
+                if len(numbers) >= 2:
+                    try:
+                        # Extract product name (text before numbers)
+                        parts = re.split(r'\d+[,.]?\d{0,2}', line)
+                        if parts:
+                            product_name = parts[0].strip()[:50]
+                            
+                            # Convert numbers
+                            nums = [float(n.replace(',', '')) for n in numbers[:3]]
+                            
+                            if len(nums) >= 2:
+                                quantity = nums[0] if nums[0] < 100 else 1
+                                unit_price = min(nums[1:])
+                                total_price = max(nums[1:])
+                                
+                                products.append({
+                                    "product_name": product_name,
+                                    "quantity": quantity,
+                                    "unit_price": unit_price,
+                                    "total_price": total_price
+                                })
+                    except (ValueError, IndexError):
+                        continue
+        
+        return products
+    
+    def _normalize_date(self, date_str: str) -> Optional[str]:
+        """Normalize date to ISO format"""
+        
+        try:
+            # Try different date formats
+            formats = ['%d/%m/%Y', '%d-%m-%Y', '%m/%d/%Y', '%m-%d-%Y', '%d/%m/%y', '%d-%m-%y']
+            
+            for fmt in formats:
+                try:
+                    date_obj = datetime.strptime(date_str.strip(), fmt)
+                    return date_obj.strftime('%Y-%m-%d')
+                except ValueError:
+                    continue
+            
+            return None
+        except:
+            return None
+
+
+PRODUCTS = [
+    "Tomates pera", "Aceite de oliva virgen", "Harina de trigo", "Leche entera", "Queso curado",
+    "Pechuga de pollo", "Cebolla blanca", "Ajo morado", "Arroz bomba", "Azucar blanco",
+    "Kartoffeln festkochend", "Butter ungesalzen", "Sahne 30%", "Mehl Type 405", "Eier Freiland L",
+    "Salz grob", "Pimienta negra molida", "Vino tinto cocina", "Limones", "Patatas agria"
+]
+
+
+def synthetic_invoice(rng: random.Random) -> str:
+    """OCR-like text of a supplier invoice with 5-40 item rows in varied layouts"""
+    spanish = rng.random() < 0.6
+    if spanish:
+        lines = [
+            f"Proveedor: {rng.choice(['Distribuciones Sur SL', 'Mercados Norte SA', 'Frutas Garcia'])}",
+            f"CIF B{rng.randint(10000000, 99999999)}",
+            "Calle Mayor 12, 28013 Madrid",
+            f"Factura N° F-{rng.randint(2020, 2025)}-{rng.randint(1, 999):03d}",
+            f"Fecha de emisión: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2020, 2025)}",
+            "",
+            "Descripcion Cantidad Precio Importe"
+        ]
+    else:
+        lines = [
+            f"Lieferant: {rng.choice(['Metro Grosshandel GmbH', 'Frischdienst Berlin', 'Bio Hof Müller'])}",
+            "Hauptstrasse 5, 10115 Berlin",
+            f"Rechnungsnummer: RE{rng.randint(100000, 999999)}",
+            f"Rechnungsdatum: {rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.{rng.randint(2020, 2025)}",
+            "",
+            "Artikel Menge Preis Betrag"
+        ]
+    
+    subtotal = 0.0
+    for _ in range(rng.randint(5, 40)):
+        name = rng.choice(PRODUCTS)
+        quantity = rng.randint(1, 30)
+        price = round(rng.uniform(0.5, 40), 2)
+        total = round(quantity * price, 2)
+        subtotal += total
+        layout = rng.random()
+        if layout < 0.6:
+            lines.append(f"{name} {quantity} {price:.2f} {total:.2f}")
+        elif layout < 0.8:
+            lines.append(f"{name} ${price:.2f} {quantity} ${total:.2f}")
+        elif layout < 0.9:
+            lines.append(f"{quantity} {name} {price:.2f} {total:.2f}")
+        else:
+            lines.append(f"{name} {quantity} x {price:.2f} {total:.2f}")
+        if rng.random() < 0.1:
+            lines.append(rng.choice(["Lote 2345 cad. 12/2025", "-- oferta --", "Ref 00123", "Kühlware"]))
+    
+    tax = round(subtotal * 0.21, 2)
+    if spanish:
+        lines += ["", f"Base imponible: {subtotal:.2f}", f"IVA 21%: {tax:.2f}", f"Total a pagar: {subtotal + tax:.2f}", "Gracias por su compra"]
+    else:
+        lines += ["", f"Netto: {subtotal:.2f}", f"MwSt: {tax:.2f}", f"Gesamtbetrag: {subtotal + tax:.2f}", "Vielen Dank"]
+    
+    if rng.random() < 0.15:
+        # Badly read scan: no complete item row, only the fallback applies
+        lines = [line for line in lines if not any(c.isdigit() for c in line[-3:])] + ["Tomates pera 3 kg 12"]
+    return "\n".join(lines)
+
+
+def load_corpus(directory: Optional[str], documents: int) -> List[str]:
+    if directory:
+        texts = []
+        for path in sorted(glob.glob(os.path.join(directory, "*.txt"))):
+            with open(path, encoding="utf-8", errors="replace") as f:
+                texts.append(f.read())
+        return texts
+    rng = random.Random(42)
+    return [synthetic_invoice(rng) for _ in range(documents)]
+
+
+def best_time(parser, corpus: List[str], repeat: int) -> float:
+    """Best wall time (seconds) of parsing the whole corpus"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in corpus:
+            parser.parse_text(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the invoice text parser against the previous implementation")
+    parser.add_argument("--corpus", help="Directory with invoice texts (*.txt)")
+    parser.add_argument("--documents", type=int, default=500, help="Synthetic documents when no corpus is given")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs (the best one is reported)")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus, args.documents)
+    if not corpus:
+        print("❌ Corpus vacío")
+        sys.exit(1)
+
+    legacy, current = LegacyOCRParser(), OCRParser()
+
+    mismatches = sum(1 for text in corpus if legacy.parse_text(text) != current.parse_text(text))
+    lines = sum(text.count("\n") + 1 for text in corpus)
+    print(f"📄 {len(corpus)} documento(s), {lines} línea(s)")
+
+    legacy_time = best_time(legacy, corpus, args.repeat)
+    current_time = best_time(current, corpus, args.repeat)
+
+    print(f"   Anterior: {legacy_time * 1000 / len(corpus):.3f} ms/documento")
+    print(f"   Actual:   {current_time * 1000 / len(corpus):.3f} ms/documento")
+    print(f"⚡ Aceleración: x{legacy_time / current_time:.2f}")
+    if mismatches:
+        print(f"⚠️  {mismatches} documento(s) con resultados distintos")
+        sys.exit(1)
+    print("✅ Mismos campos y líneas en todos los documentos")
+
+
+if __name__ == "__main__":
+    main()
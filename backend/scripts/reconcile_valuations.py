@@ -0,0 +1,39 @@
+"""
+Reconcile inventory valuation aggregates with products
+Recalcula la valorización agregada del inventario y corrige diferencias
+
+Run periodically (e.g. nightly cron): python -m backend.scripts.reconcile_valuations [--restaurant-id N]
+"""
+
+import argparse
+import os
+import sys
+
+# Add root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.models.database import SessionLocal
+from backend.utils.valuation import reconcile_valuations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile inventory valuation aggregates")
+    parser.add_argument("--restaurant-id", type=int, default=None, help="Only this restaurant")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        drift = reconcile_valuations(db, restaurant_id=args.restaurant_id)
+    finally:
+        db.close()
+
+    for entry in drift:
+        print(
+            f"⚠️ Restaurante {entry['restaurant_id']} / categoría {entry['category_id']} / "
+            f"proveedor {entry['provider_id']}: {entry['count_delta']:+d} productos, {entry['value_delta']:+,.2f}"
+        )
+    print(f"\n✨ Valorización conciliada ({len(drift)} diferencia(s) corregida(s))")
+
+
+if __name__ == "__main__":
+    main()
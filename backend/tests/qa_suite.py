@@ -1,3 +1,4 @@
+import asyncio
 import sys
 import os
 import threading
@@ -8,11 +9,15 @@ from datetime import datetime
 # Add root to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
-from backend.models.database import Base, Product, Restaurant, User, StockMovement, WasteLog
+from fastapi import HTTPException
+from backend.models.database import Base, Product, Recipe, RecipeComponent, Restaurant, User, StockMovement, WasteLog
 from backend.models.enums import StockMovementType, WasteType
-from backend.api.products import router as products_router
+from backend.api.products import router as products_router, delete_product
+from backend.utils.ocr_parser import OCRParser
+from backend.utils.pagination import order_by_keyset, paginate_keyset
+from backend.utils.valuation import inventory_totals, product_value, reconcile_valuations, record_product_change
 
 # Setup Test DB
 TEST_DB_URL = os.getenv("TEST_DATABASE_URL", "sqlite:///./test_qa_inventory.db")
@@ -173,6 +178,164 @@ def test_negative_stock_prevention(db, restaurant_id):
     except ValueError as e:
         print(f"  ✅ Validacion Correcta: {e}")
 
+def test_keyset_pagination(db, restaurant_id):
+    print("\n[TEST 5] - Paginación por cursor (created_at del servidor)")
+    
+    product = Product(
+        name="Paged Tomato",
+        category_id=1,
+        unit="kg",
+        current_stock=Decimal('1.000'),
+        cost_price=Decimal('1.00'),
+        restaurant_id=restaurant_id
+    )
+    db.add(product)
+    db.commit()
+    
+    # Same-second server timestamps: only the id breaks the ties
+    for _ in range(6):
+        db.add(WasteLog(
+            product_id=product.id,
+            restaurant_id=restaurant_id,
+            quantity=Decimal('1.000'),
+            waste_type=WasteType.EXPIRED,
+            reason="Paging",
+            cost=Decimal('1.00'),
+            user_id=1
+        ))
+    db.commit()
+    
+    query = db.query(WasteLog).filter(WasteLog.reason == "Paging")
+    sort_key = (WasteLog.created_at, WasteLog.id)
+    seen = []
+    cursor = ""
+    for _ in range(10):
+        rows, cursor = paginate_keyset(query, sort_key, cursor, 2, descending=True)
+        seen.extend(row.id for row in rows)
+        if cursor is None:
+            break
+    
+    expected = [w.id for w in order_by_keyset(query, sort_key, descending=True).all()]
+    print(f"  Páginas recorridas: {seen}")
+    assert cursor is None, "La paginación no llegó al final"
+    assert seen == expected and len(set(seen)) == 6, f"Ids repetidos o perdidos: {seen}"
+    print("  ✅ Cada registro aparece exactamente una vez.")
+
+def test_merge_pages_keeps_repeated_items():
+    print("\n[TEST 6] - OCR multipágina: productos repetidos entre páginas")
+    
+    parser = OCRParser()
+    page_1 = "\n".join([
+        "Distribuciones Norte S.L.",
+        "Factura: F-2024-118",
+        "Página 1 de 2",
+        "Cebolla blanca 3 1.20 3.60",
+        "Harina de trigo 5 0.90 4.50",
+        "Aceite de oliva 2 6.00 12.00",
+        "Tomate pera 2 3.50 7.00",
+    ])
+    page_2 = "\n".join([
+        "Tomate pera 4 3.50 9.00",
+        "Distribuciones Norte S.L.",
+        "Factura: F-2024-118",
+        "Página 2 de 2",
+        "Leche entera 6 0.80 4.80",
+        "Pechuga de pollo 1 7.50 7.50",
+        "Total: 48.40",
+    ])
+    
+    merged = parser._merge_pages([page_1, page_2])
+    products = parser._extract_products(merged)
+    tomatoes = [p for p in products if p["product_name"].startswith("Tomate")]
+    
+    print(f"  Líneas de tomate: {[(p['quantity'], p['total_price']) for p in tomatoes]}")
+    assert [p["quantity"] for p in tomatoes] == [2.0, 4.0], f"Línea de producto perdida: {tomatoes}"
+    assert merged.count("Distribuciones Norte") == 1, "Cabecera repetida no eliminada"
+    assert "Página 2 de 2" not in merged, "Numeración de página repetida no eliminada"
+    print("  ✅ Cabeceras repetidas eliminadas, productos conservados.")
+
+def test_reconcile_concurrent_delta(db, restaurant_id):
+    print("\n[TEST 7] - Conciliación de valoración con escritura concurrente")
+    
+    # Readers must not block the concurrent writer
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+    
+    # Earlier tests created products without valuation deltas
+    reconcile_valuations(db, restaurant_id)
+    
+    written = []
+    
+    def write_product(conn, cursor, statement, parameters, context, executemany):
+        # A product write (with its delta) commits once the reconcile has started reading
+        if written or not statement.lstrip().upper().startswith("SELECT") or "products" not in statement:
+            return
+        written.append(True)
+        writer = TestingSessionLocal()
+        product = Product(
+            name="Concurrent Rice",
+            category_id=1,
+            unit="kg",
+            current_stock=Decimal('8.000'),
+            cost_price=Decimal('2.50'),
+            restaurant_id=restaurant_id
+        )
+        writer.add(product)
+        writer.flush()
+        record_product_change(writer, None, product_value(product))
+        writer.commit()
+        writer.close()
+    
+    event.listen(engine, "after_cursor_execute", write_product)
+    try:
+        drift = reconcile_valuations(db, restaurant_id)
+    finally:
+        event.remove(engine, "after_cursor_execute", write_product)
+    
+    products = db.query(Product).filter(Product.restaurant_id == restaurant_id).all()
+    expected = sum(p.current_stock * p.cost_price for p in products)
+    count, value = inventory_totals(db, restaurant_id)
+    print(f"  Correcciones: {drift}")
+    print(f"  Valoración: {count} productos, {value} (esperado {len(products)}, {expected})")
+    assert written, "La escritura concurrente no se ejecutó"
+    assert drift == [], f"Delta concurrente tomado como descuadre: {drift}"
+    assert count == len(products) and value == expected, "Valoración descuadrada"
+    print("  ✅ El delta concurrente no genera corrección.")
+
+def test_delete_product_used_in_recipe(db, restaurant_id, user_id):
+    print("\n[TEST 8] - Borrado de producto usado en recetas")
+    
+    product = Product(
+        name="Recipe Flour",
+        category_id=1,
+        unit="kg",
+        current_stock=Decimal('3.000'),
+        cost_price=Decimal('0.90'),
+        restaurant_id=restaurant_id
+    )
+    db.add(product)
+    db.flush()
+    recipe = Recipe(name="Bread", restaurant_id=restaurant_id)
+    recipe.components.append(RecipeComponent(product_id=product.id, quantity=Decimal('0.5000')))
+    db.add(recipe)
+    db.commit()
+    user = db.query(User).filter(User.id == user_id).first()
+    
+    try:
+        asyncio.run(delete_product(product.id, current_user=user, db=db))
+        raise AssertionError("Se borró un producto usado en una receta")
+    except HTTPException as e:
+        print(f"  Respuesta: {e.status_code} {e.detail}")
+        assert e.status_code == 409 and e.detail["used_in"] == ["Bread"], f"Respuesta inesperada: {e.detail}"
+    assert db.query(Product).filter(Product.id == product.id).count() == 1, "Producto borrado"
+    
+    # Without the recipe the product can go
+    db.delete(recipe)
+    db.commit()
+    asyncio.run(delete_product(product.id, current_user=user, db=db))
+    assert db.query(Product).filter(Product.id == product.id).count() == 0, "Producto no borrado"
+    print("  ✅ El producto en uso se conserva; sin recetas se borra.")
+
 if __name__ == "__main__":
     print("=== INICIANDO QA SUITE (KusiTurno v2 Core) ===")
     
@@ -181,6 +344,10 @@ if __name__ == "__main__":
         test_decimal_precision(db, r_id)
         test_enums(db, r_id)
         test_negative_stock_prevention(db, r_id)
+        test_keyset_pagination(db, r_id)
+        test_merge_pages_keeps_repeated_items()
+        test_reconcile_concurrent_delta(db, r_id)
+        test_delete_product_used_in_recipe(db, r_id, u_id)
         db.close()
         
         # Concurrency needs fresh sessions
@@ -0,0 +1,215 @@
+"""
+Cold archival of stock movements and waste logs
+Archivo histórico de movimientos de stock y mermas
+
+Closed months older than ARCHIVE_KEEP_MONTHS are written to one gzip'd
+JSON-lines file per table, restaurant and month under ARCHIVE_DIR, recorded
+in archived_periods and removed from the hot table (on PostgreSQL the
+month's partition is dropped). Reports whose range reaches an archived
+month read it back through archived_rows(), so their results do not change.
+"""
+
+import enum
+import gzip
+import json
+import logging
+import os
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import Enum as SQLEnum, DateTime, Numeric, func, select
+from sqlalchemy.orm import Session
+
+from backend.config import settings
+from backend.models.database import ArchivedPeriod, StockMovement, WasteLog
+from backend.utils.data_version import bump_tenant_version
+from backend.utils.partitions import (
+    add_months, drop_partition, is_partitioned, iter_months, month_start, partition_exists
+)
+from backend.utils.sync import db_now
+
+logger = logging.getLogger(__name__)
+
+ARCHIVED_MODELS = {
+    "stock_movements": StockMovement,
+    "waste_logs": WasteLog,
+}
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _decoders(table_name: str) -> Dict[str, Callable[[Any], Any]]:
+    """Column name -> function restoring the Python type written by _encode"""
+    decoders = {}
+    for column in ARCHIVED_MODELS[table_name].__table__.columns:
+        if isinstance(column.type, SQLEnum) and column.type.enum_class is not None:
+            decoders[column.name] = column.type.enum_class
+        elif isinstance(column.type, Numeric):
+            decoders[column.name] = Decimal
+        elif isinstance(column.type, DateTime):
+            decoders[column.name] = datetime.fromisoformat
+    return decoders
+
+
+def _archive_path(table_name: str, restaurant_id: Optional[int], month: datetime) -> str:
+    tenant = str(restaurant_id) if restaurant_id is not None else "unassigned"
+    return f"{table_name}/{tenant}/{month:%Y-%m}.jsonl.gz"
+
+
+def _write_archive(relative_path: str, records: List[Dict[str, Any]]) -> None:
+    """Write the file next to its final name and rename it, so readers never see half a file"""
+    path = Path(settings.ARCHIVE_DIR) / relative_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+            for record in records:
+                gz.write(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, path)
+
+
+@lru_cache(maxsize=64)
+def _load_archive(table_name: str, relative_path: str, mtime_ns: int) -> Tuple[SimpleNamespace, ...]:
+    decoders = _decoders(table_name)
+    rows = []
+    with gzip.open(Path(settings.ARCHIVE_DIR) / relative_path, "rt", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            for name, decode in decoders.items():
+                if record.get(name) is not None:
+                    record[name] = decode(record[name])
+            rows.append(SimpleNamespace(**record))
+    return tuple(rows)
+
+
+def read_archive(table_name: str, relative_path: str) -> Tuple[SimpleNamespace, ...]:
+    """Rows of one archive file, with the same attribute names and types as the model"""
+    mtime_ns = (Path(settings.ARCHIVE_DIR) / relative_path).stat().st_mtime_ns
+    return _load_archive(table_name, relative_path, mtime_ns)
+
+
+def archived_rows(
+    db: Session,
+    table_name: str,
+    restaurant_id: int,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None
+) -> List[SimpleNamespace]:
+    """Archived rows of a restaurant with start_date <= created_at <= end_date, oldest first.
+
+    Costs one indexed query when the range has no archived months.
+    """
+    query = db.query(ArchivedPeriod.file_path).filter(
+        ArchivedPeriod.table_name == table_name,
+        ArchivedPeriod.restaurant_id == restaurant_id
+    )
+    if start_date is not None:
+        query = query.filter(ArchivedPeriod.period_end > start_date)
+    if end_date is not None:
+        query = query.filter(ArchivedPeriod.period_start <= end_date)
+
+    rows = []
+    for (file_path,) in query.order_by(ArchivedPeriod.period_start).all():
+        for row in read_archive(table_name, file_path):
+            if start_date is not None and row.created_at < start_date:
+                continue
+            if end_date is not None and row.created_at > end_date:
+                continue
+            rows.append(row)
+    return rows
+
+
+def _archive_month(db: Session, table_name: str, month: datetime) -> List[Optional[int]]:
+    """Move one closed month of `table_name` to archive files; returns the tenants touched"""
+    table = ARCHIVED_MODELS[table_name].__table__
+    period_end = add_months(month, 1)
+    in_month = (table.c.created_at >= month, table.c.created_at < period_end)
+
+    tenants = [rid for (rid,) in db.execute(select(table.c.restaurant_id).where(*in_month).distinct())]
+    for restaurant_id in tenants:
+        records = [
+            {name: _encode(value) for name, value in row._mapping.items()}
+            for row in db.execute(
+                select(table).where(*in_month, table.c.restaurant_id == restaurant_id)
+                .order_by(table.c.created_at, table.c.id)
+            )
+        ]
+
+        period = db.query(ArchivedPeriod).filter(
+            ArchivedPeriod.table_name == table_name,
+            ArchivedPeriod.restaurant_id == restaurant_id,
+            ArchivedPeriod.period_start == month
+        ).first()
+        if period is None:
+            period = ArchivedPeriod(
+                table_name=table_name,
+                restaurant_id=restaurant_id,
+                period_start=month,
+                period_end=period_end,
+                file_path=_archive_path(table_name, restaurant_id, month)
+            )
+            db.add(period)
+        else:
+            # Late rows for a month already archived (or a previous run that
+            # failed before committing): merge them into the existing file
+            archived_ids = {record["id"] for record in records}
+            existing = [
+                {name: _encode(value) for name, value in vars(row).items()}
+                for row in read_archive(table_name, period.file_path)
+                if row.id not in archived_ids
+            ]
+            records = sorted(existing + records, key=lambda r: (r["created_at"], r["id"]))
+
+        _write_archive(period.file_path, records)
+        period.row_count = len(records)
+
+    # Whole-month partitions are dropped; rows that went to the default
+    # partition (or unpartitioned tables) are deleted
+    connection = db.connection()
+    if is_partitioned(connection, table_name) and partition_exists(connection, table_name, month):
+        drop_partition(connection, table_name, month)
+    db.execute(table.delete().where(*in_month))
+    return tenants
+
+
+def archive_closed_periods(db: Session, keep_months: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Archive every month that closed more than `keep_months` months ago.
+
+    Each month is committed on its own, after its files are on disk, so an
+    interrupted run can simply be started again.
+    """
+    if keep_months is None:
+        keep_months = settings.ARCHIVE_KEEP_MONTHS
+    cutoff = add_months(month_start(db_now(db)), -keep_months)
+
+    archived = []
+    for table_name, model in ARCHIVED_MODELS.items():
+        oldest = db.query(func.min(model.created_at)).filter(model.created_at < cutoff).scalar()
+        if oldest is None:
+            continue
+
+        for month in iter_months(oldest, cutoff):
+            tenants = _archive_month(db, table_name, month)
+            db.commit()
+            for restaurant_id in tenants:
+                if restaurant_id is not None:
+                    bump_tenant_version(db, restaurant_id)
+            if tenants:
+                logger.info(f"Archived {table_name} {month:%Y-%m} for {len(tenants)} restaurant(s)")
+                archived.append({"table": table_name, "month": f"{month:%Y-%m}", "restaurants": len(tenants)})
+
+    return archived
@@ -0,0 +1,116 @@
+"""
+Barcode lookup cache for scanners
+Caché de búsqueda por código de barras (escáneres)
+
+Scans are resolved through the unique index on products.barcode and the
+results are kept in a small LRU per restaurant. A tenant's entries are
+valid for one data version: writes in this process drop them immediately
+(data_version.on_bump) and writes made elsewhere are noticed by a version
+check at most every REVALIDATE_SECONDS, so a burst of scans costs no SQL.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from backend.utils.data_version import get_versions, on_bump, tenant_scope
+
+# Cached barcodes per restaurant (least recently scanned are evicted first)
+CACHE_SIZE_PER_TENANT = 2048
+
+# How long a tenant's cache is trusted before its data version is checked
+REVALIDATE_SECONDS = 2
+
+
+class TenantBarcodeCache:
+    """LRU of barcode -> product response for one restaurant and data version"""
+
+    def __init__(self, version: int):
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.entries: "OrderedDict[str, Any]" = OrderedDict()
+
+    def get(self, code: str) -> Optional[Any]:
+        value = self.entries.get(code)
+        if value is not None:
+            self.entries.move_to_end(code)
+        return value
+
+    def put(self, code: str, value: Any) -> None:
+        self.entries[code] = value
+        self.entries.move_to_end(code)
+        while len(self.entries) > CACHE_SIZE_PER_TENANT:
+            self.entries.popitem(last=False)
+
+
+_caches: Dict[int, TenantBarcodeCache] = {}
+_caches_lock = threading.Lock()
+
+
+def invalidate(restaurant_id: Optional[int]) -> None:
+    with _caches_lock:
+        _caches.pop(restaurant_id, None)
+
+
+def _on_bump(scope: str) -> None:
+    if scope.startswith("tenant:"):
+        invalidate(int(scope.split(":", 1)[1]))
+
+
+on_bump(_on_bump)
+
+
+def _tenant_cache(db: Session, restaurant_id: int) -> TenantBarcodeCache:
+    now = time.monotonic()
+    with _caches_lock:
+        cache = _caches.get(restaurant_id)
+        if cache is not None and now - cache.checked_at < REVALIDATE_SECONDS:
+            return cache
+
+    scope = tenant_scope(restaurant_id)
+    version = get_versions(db, [scope])[scope]
+
+    with _caches_lock:
+        cache = _caches.get(restaurant_id)
+        if cache is None or cache.version != version:
+            cache = TenantBarcodeCache(version)
+            _caches[restaurant_id] = cache
+        cache.checked_at = now
+        return cache
+
+
+def lookup_barcodes(
+    db: Session,
+    restaurant_id: int,
+    codes: Iterable[str],
+    loader: Callable[[List[str]], Dict[str, Any]]
+) -> Dict[str, Any]:
+    """Resolve barcodes to product responses; unknown codes are left out.
+
+    `loader` fetches the cache misses in one query and returns {barcode: response}.
+    Negative results are not cached, so a product created with a scanned
+    barcode is found on the next scan.
+    """
+    cache = _tenant_cache(db, restaurant_id)
+
+    found: Dict[str, Any] = {}
+    missing: List[str] = []
+    with _caches_lock:
+        for code in codes:
+            value = cache.get(code)
+            if value is not None:
+                found[code] = value
+            else:
+                missing.append(code)
+
+    if missing:
+        loaded = loader(missing)
+        with _caches_lock:
+            for code, value in loaded.items():
+                cache.put(code, value)
+        found.update(loaded)
+
+    return found
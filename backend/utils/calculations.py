@@ -4,10 +4,32 @@ Módulo de cálculos de negocio
 """
 
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy import func, and_, or_, case
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from decimal import Decimal, ROUND_HALF_UP
+from types import SimpleNamespace
+from backend.models.enums import StockMovementType
+
+
+def _to_decimal(value) -> Decimal:
+    """Normalize aggregate results (Decimal, float, int or None) to Decimal"""
+    if value is None:
+        return Decimal('0.0')
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+# Archived contribution of a product with no archived rows
+_EMPTY_LEDGER = {
+    "opening": None,
+    "closing": None,
+    "purchases": Decimal('0.0'),
+    "out": Decimal('0.0'),
+    "waste": Decimal('0.0')
+}
+
 
 class ReportCalculator:
     """Calculator for business reports and analysis"""
@@ -75,108 +97,225 @@ class ReportCalculator:
         product = self.db.query(Product).filter(Product.id == product_id).first()
         return product.cost_price if product else 0.0
     
-    def calculate_theoretical_vs_actual(self, start_date: datetime, end_date: datetime) -> Dict[str, float]:
-        """Calculate theoretical vs actual consumption variance"""
-        
-        from backend.models.database import StockMovement, Product, WasteLog
-        
-        # Calculate theoretical consumption
-        # Theoretical = Stock_initial + Purchases - Stock_final
-        
-        # Stock at beginning of period
-        stock_initial = self._get_stock_at_date(start_date - timedelta(days=1))
+    def calculate_theoretical_vs_actual(self, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
+        """Calculate theoretical vs actual consumption variance per product.
         
-        # Purchases during period
-        purchases = self._get_purchases_in_period(start_date, end_date)
+        Opening stock, purchases, closing stock, OUT and waste are resolved for
+        every product in a single grouped statement over the ledger, so the cost
+        does not grow with the number of products.
+        """
         
-        # Stock at end of period
-        stock_final = self._get_stock_at_date(end_date)
-        
-        # Theoretical consumption
-        theoretical = stock_initial + purchases - stock_final
+        from backend.models.database import StockMovement, Product, WasteLog
         
-        # Actual consumption (OUT movements + waste)
-        out_movements = self.db.query(func.sum(StockMovement.quantity)).filter(
+        # Movements up to the end of the period, ranked per product.
+        # Rows before the period give the opening stock, rows inside it give
+        # purchases/consumption, and the latest row gives the closing stock.
+        is_before = case((StockMovement.created_at < start_date, 1), else_=0)
+        newest_first = (StockMovement.created_at.desc(), StockMovement.id.desc())
+        oldest_first = (StockMovement.created_at.asc(), StockMovement.id.asc())
+        
+        ledger = self.db.query(
+            StockMovement.product_id.label("product_id"),
+            StockMovement.movement_type.label("movement_type"),
+            StockMovement.quantity.label("quantity"),
+            StockMovement.previous_stock.label("previous_stock"),
+            StockMovement.new_stock.label("new_stock"),
+            is_before.label("is_before"),
+            func.row_number().over(
+                partition_by=StockMovement.product_id, order_by=newest_first
+            ).label("rn_last"),
+            func.row_number().over(
+                partition_by=(StockMovement.product_id, is_before), order_by=newest_first
+            ).label("rn_segment_last"),
+            func.row_number().over(
+                partition_by=(StockMovement.product_id, is_before), order_by=oldest_first
+            ).label("rn_segment_first")
+        ).filter(
             StockMovement.restaurant_id == self.restaurant_id,
-            StockMovement.movement_type == "OUT",
-            StockMovement.created_at >= start_date,
             StockMovement.created_at <= end_date
-        ).scalar() or 0.0
-        
-        waste_quantity = self.db.query(func.sum(WasteLog.quantity)).filter(
+        ).subquery()
+        
+        in_period = ledger.c.is_before == 0
+        movements = self.db.query(
+            ledger.c.product_id.label("product_id"),
+            func.max(case(
+                (and_(ledger.c.is_before == 1, ledger.c.rn_segment_last == 1), ledger.c.new_stock)
+            )).label("opening_before"),
+            func.max(case(
+                (and_(in_period, ledger.c.rn_segment_first == 1), ledger.c.previous_stock)
+            )).label("opening_in_period"),
+            func.max(case(
+                (ledger.c.rn_last == 1, ledger.c.new_stock)
+            )).label("closing"),
+            func.sum(case(
+                (and_(in_period, ledger.c.movement_type == StockMovementType.IN), ledger.c.quantity),
+                else_=0
+            )).label("purchases"),
+            func.sum(case(
+                (and_(in_period, ledger.c.movement_type == StockMovementType.OUT), ledger.c.quantity),
+                else_=0
+            )).label("out")
+        ).group_by(ledger.c.product_id).subquery()
+        
+        waste = self.db.query(
+            WasteLog.product_id.label("product_id"),
+            func.sum(WasteLog.quantity).label("waste")
+        ).filter(
             WasteLog.restaurant_id == self.restaurant_id,
             WasteLog.created_at >= start_date,
             WasteLog.created_at <= end_date
-        ).scalar() or 0.0
-        
-        actual = out_movements + waste_quantity
-        
-        # Calculate variance
-        variance = actual - theoretical
-        variance_percentage = (variance / theoretical * 100) if theoretical > 0 else 0
-        
-        return {
-            "theoretical": float(theoretical),
-            "actual": float(actual),
-            "variance": float(variance),
-            "variance_percentage": float(variance_percentage),
-            "is_abnormal": abs(variance_percentage) > 5.0
-        }
-    
-    def _get_stock_at_date(self, target_date: datetime) -> float:
-        """Get total stock value at a specific date"""
-        
-        from backend.models.database import StockMovement, Product
-        
-        products = self.db.query(Product).filter(
-            Product.restaurant_id == self.restaurant_id
+        ).group_by(WasteLog.product_id).subquery()
+        
+        rows = self.db.query(
+            Product.id,
+            Product.name,
+            Product.unit,
+            Product.cost_price,
+            Product.current_stock,
+            movements.c.opening_before,
+            movements.c.opening_in_period,
+            movements.c.closing,
+            movements.c.purchases,
+            movements.c.out,
+            waste.c.waste
+        ).outerjoin(
+            movements, movements.c.product_id == Product.id
+        ).outerjoin(
+            waste, waste.c.product_id == Product.id
+        ).filter(
+            Product.restaurant_id == self.restaurant_id,
+            or_(movements.c.product_id.isnot(None), waste.c.product_id.isnot(None))
         ).all()
         
-        total_stock = 0.0
+        # Archived months are older than every row still in the hot tables,
+        # so they give the opening stock and add to the period's flows
+        archived = self._archived_ledger(start_date, end_date)
+        missing = set(archived) - {row.id for row in rows}
+        if missing:
+            rows += [
+                SimpleNamespace(
+                    id=p.id, name=p.name, unit=p.unit, cost_price=p.cost_price, current_stock=p.current_stock,
+                    opening_before=None, opening_in_period=None, closing=None, purchases=0, out=0, waste=0
+                )
+                for p in self.db.query(Product).filter(
+                    Product.restaurant_id == self.restaurant_id,
+                    Product.id.in_(missing)
+                ).all()
+            ]
         
-        for product in products:
-            # Get last movement before target date
-            last_movement = self.db.query(StockMovement).filter(
-                StockMovement.product_id == product.id,
-                StockMovement.created_at <= target_date
-            ).order_by(StockMovement.created_at.desc()).first()
+        products_data = []
+        total_theoretical = Decimal('0.0')
+        total_actual = Decimal('0.0')
+        
+        for row in rows:
+            cost_price = _to_decimal(row.cost_price)
+            current_stock = _to_decimal(row.current_stock)
+            cold = archived.get(row.id, _EMPTY_LEDGER)
             
-            if last_movement:
-                stock_quantity = last_movement.new_stock
+            # Theoretical = Stock_initial + Purchases - Stock_final
+            if cold["opening"] is not None:
+                opening = cold["opening"]
+            elif row.opening_before is not None:
+                opening = _to_decimal(row.opening_before)
+            elif row.opening_in_period is not None:
+                opening = _to_decimal(row.opening_in_period)
+            else:
+                opening = current_stock
+            if row.closing is not None:
+                closing = _to_decimal(row.closing)
+            elif cold["closing"] is not None:
+                closing = cold["closing"]
             else:
-                # No movements before target date, use current stock
-                stock_quantity = product.current_stock
+                closing = current_stock
+            purchases = _to_decimal(row.purchases) + cold["purchases"]
+            theoretical = opening + purchases - closing
             
-            total_stock += stock_quantity * product.cost_price
-        
-        return total_stock
-    
-    def _get_purchases_in_period(self, start_date: datetime, end_date: datetime) -> float:
-        """Get total purchases value in a period"""
+            # Actual consumption (OUT movements + waste)
+            out = _to_decimal(row.out) + cold["out"]
+            waste_quantity = _to_decimal(row.waste) + cold["waste"]
+            actual = out + waste_quantity
+            
+            variance = actual - theoretical
+            variance_percentage = (variance / theoretical * 100) if theoretical > 0 else Decimal('0.0')
+            
+            theoretical_value = theoretical * cost_price
+            actual_value = actual * cost_price
+            total_theoretical += theoretical_value
+            total_actual += actual_value
+            
+            products_data.append({
+                "product_id": row.id,
+                "product_name": row.name,
+                "unit": row.unit,
+                "cost_price": float(cost_price),
+                "opening_stock": float(opening),
+                "purchases": float(purchases),
+                "closing_stock": float(closing),
+                "out": float(out),
+                "waste": float(waste_quantity),
+                "theoretical": float(theoretical),
+                "actual": float(actual),
+                "variance": float(variance),
+                "variance_value": float(actual_value - theoretical_value),
+                "variance_percentage": float(variance_percentage),
+                "is_abnormal": abs(variance_percentage) > 5
+            })
         
-        from backend.models.database import StockMovement
+        # Rank products by the money they add to the variance
+        products_data.sort(key=lambda x: abs(x["variance_value"]), reverse=True)
         
-        purchases = self.db.query(func.sum(StockMovement.quantity)).filter(
-            StockMovement.restaurant_id == self.restaurant_id,
-            StockMovement.movement_type == "IN",
-            StockMovement.created_at >= start_date,
-            StockMovement.created_at <= end_date
-        ).scalar() or 0.0
+        # Tenant totals (valued at cost, since units differ between products)
+        total_variance = total_actual - total_theoretical
+        total_variance_percentage = (total_variance / total_theoretical * 100) if total_theoretical > 0 else Decimal('0.0')
         
-        # Convert to value (approximation using current prices)
-        return purchases
+        return {
+            "theoretical": float(total_theoretical),
+            "actual": float(total_actual),
+            "variance": float(total_variance),
+            "variance_percentage": float(total_variance_percentage),
+            "is_abnormal": abs(total_variance_percentage) > 5,
+            "product_count": len(products_data),
+            "products": products_data
+        }
+    
+    def _archived_ledger(self, start_date: datetime, end_date: datetime) -> Dict[int, Dict[str, Any]]:
+        """Per-product opening/closing stock and flows from archived months in the range"""
+        
+        from backend.utils.archive import archived_rows
+        
+        ledger = {}
+        for movement in archived_rows(self.db, "stock_movements", self.restaurant_id, start_date, end_date):
+            entry = ledger.setdefault(movement.product_id, dict(_EMPTY_LEDGER))
+            if entry["opening"] is None:
+                entry["opening"] = movement.previous_stock
+            entry["closing"] = movement.new_stock
+            if movement.movement_type == StockMovementType.IN:
+                entry["purchases"] += movement.quantity
+            elif movement.movement_type == StockMovementType.OUT:
+                entry["out"] += movement.quantity
+        
+        for log in archived_rows(self.db, "waste_logs", self.restaurant_id, start_date, end_date):
+            entry = ledger.setdefault(log.product_id, dict(_EMPTY_LEDGER))
+            entry["waste"] += log.quantity
+        
+        return ledger
     
     def calculate_waste_percentage(self, start_date: datetime, end_date: datetime) -> float:
         """Calculate waste percentage vs consumption"""
         
         from backend.models.database import WasteLog, StockMovement
+        from backend.utils.archive import archived_rows
         
         # Total waste cost
-        total_waste = self.db.query(func.sum(WasteLog.cost)).filter(
+        total_waste = _to_decimal(self.db.query(func.sum(WasteLog.cost)).filter(
             WasteLog.restaurant_id == self.restaurant_id,
             WasteLog.created_at >= start_date,
             WasteLog.created_at <= end_date
-        ).scalar() or 0.0
+        ).scalar())
+        total_waste += sum(
+            (log.cost or 0 for log in archived_rows(self.db, "waste_logs", self.restaurant_id, start_date, end_date)),
+            Decimal('0.0')
+        )
         
         # Total consumption value (OUT movements)
         consumption_movements = self.db.query(StockMovement).filter(
@@ -185,6 +324,10 @@ class ReportCalculator:
             StockMovement.created_at >= start_date,
             StockMovement.created_at <= end_date
         ).all()
+        consumption_movements += [
+            m for m in archived_rows(self.db, "stock_movements", self.restaurant_id, start_date, end_date)
+            if m.movement_type == StockMovementType.OUT
+        ]
         
         total_consumption_value = 0.0
         for movement in consumption_movements:
@@ -0,0 +1,37 @@
+"""
+Optimistic concurrency helpers (version columns)
+Utilidades de concurrencia optimista (columnas de versión)
+
+Rows with a `version` column are updated with compare-and-swap:
+UPDATE ... SET ..., version = version + 1 WHERE id = :id AND version = :seen.
+No lock is held between reading a row and writing it; a writer that lost
+the race gets zero affected rows and either retries (when its change does
+not depend on what the other writer did) or reports a conflict.
+"""
+
+from typing import Any, Dict, Optional
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+# Attempts for writes that are safe to re-apply on a fresh read
+MAX_CAS_ATTEMPTS = 3
+
+
+class VersionConflictError(Exception):
+    """The row changed since the version the caller based its write on"""
+
+    def __init__(self, current_version: Optional[int] = None):
+        super().__init__("Row was modified by another request")
+        self.current_version = current_version
+
+
+def compare_and_swap(db: Session, model, row_id: int, seen_version: int, values: Dict[str, Any], *criteria) -> bool:
+    """Apply `values` only if the row is still at `seen_version` (bumps the version)"""
+    stmt = update(model).where(
+        model.id == row_id,
+        model.version == seen_version,
+        *criteria
+    ).values(version=model.version + 1, **values)
+    result = db.execute(stmt, execution_options={"synchronize_session": False})
+    return result.rowcount == 1
@@ -0,0 +1,132 @@
+"""
+Data versions and conditional GET (ETag / If-None-Match)
+Versiones de datos y respuestas condicionales (304 Not Modified)
+
+Every write bumps a version counter for the data it touched: the tenant
+scope for restaurant data, or a table scope for the global categories and
+providers tables. Read endpoints derive their ETag from those counters, so
+an unchanged resource is answered with 304 after a single version lookup.
+"""
+
+import hashlib
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from backend.models.database import DataVersion
+
+CATEGORIES_SCOPE = "categories"
+PROVIDERS_SCOPE = "providers"
+
+# In-process caches notified after a scope is bumped
+_bump_listeners: List[Callable[[str], None]] = []
+
+
+def tenant_scope(restaurant_id: int) -> str:
+    return f"tenant:{restaurant_id}"
+
+
+def recipe_scope(restaurant_id: int) -> str:
+    return f"recipes:{restaurant_id}"
+
+
+def alias_scope(restaurant_id: int) -> str:
+    return f"aliases:{restaurant_id}"
+
+
+def on_bump(listener: Callable[[str], None]) -> None:
+    """Register a callback run with each scope bumped by this process"""
+    _bump_listeners.append(listener)
+
+
+def bump_version(db: Session, *scopes: str) -> None:
+    """Increment the version of each scope.
+
+    Call it right after the write has been committed: a reader may then see
+    new data with the old version for a moment (one extra download), but
+    never old data with the new version. The counter row is only locked for
+    this short statement, not for the whole write transaction.
+    """
+    def _increment() -> int:
+        return db.query(DataVersion).filter(DataVersion.scope.in_(scopes)).update(
+            {DataVersion.version: DataVersion.version + 1},
+            synchronize_session=False
+        )
+
+    try:
+        if _increment() < len(scopes):
+            existing = {s for (s,) in db.query(DataVersion.scope).filter(DataVersion.scope.in_(scopes)).all()}
+            for scope in scopes:
+                if scope not in existing:
+                    db.add(DataVersion(scope=scope, version=1))
+        db.commit()
+    except IntegrityError:
+        # A concurrent first bump created the row: increment it instead
+        db.rollback()
+        _increment()
+        db.commit()
+
+    for scope in scopes:
+        for listener in _bump_listeners:
+            listener(scope)
+
+
+def bump_tenant_version(db: Session, restaurant_id: Optional[int]) -> None:
+    if restaurant_id is not None:
+        bump_version(db, tenant_scope(restaurant_id))
+
+
+def get_versions(db: Session, scopes: Iterable[str]) -> Dict[str, int]:
+    """Current version of each scope (0 when it was never bumped)"""
+    scopes = list(scopes)
+    rows = db.query(DataVersion.scope, DataVersion.version).filter(DataVersion.scope.in_(scopes)).all()
+    versions = {scope: 0 for scope in scopes}
+    versions.update({scope: version for scope, version in rows})
+    return versions
+
+
+def compute_etag(request: Request, versions: Dict[str, int], time_bucket: Optional[str] = None) -> str:
+    """Weak ETag over the data versions and the request (path + query)"""
+    parts = [request.url.path, str(sorted(request.query_params.multi_items()))]
+    parts += [f"{scope}={version}" for scope, version in sorted(versions.items())]
+    if time_bucket:
+        parts.append(time_bucket)
+    digest = hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison: ignore W/ prefixes
+    wanted = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == wanted for tag in header.split(","))
+
+
+def check_not_modified(
+    request: Request,
+    response: Response,
+    db: Session,
+    scopes: Iterable[str],
+    hourly: bool = False
+) -> str:
+    """Answer 304 if the client's copy is current, otherwise set the ETag.
+
+    `hourly` adds the current UTC hour to the ETag for endpoints whose result
+    also depends on the clock (e.g. "last 7 days" figures).
+    """
+    time_bucket = datetime.utcnow().strftime("%Y-%m-%dT%H") if hourly else None
+    etag = compute_etag(request, get_versions(db, scopes), time_bucket)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if _etag_matches(request, etag):
+        raise HTTPException(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return etag
@@ -0,0 +1,165 @@
+"""
+Supplier line aliases
+Alias de líneas de factura por proveedor
+
+Suppliers repeat the same line texts on every invoice. When a user maps a
+line to a product in create_invoice, the pair (provider, normalized line
+text) -> product is stored in product_aliases, and later lines with the
+same text are resolved by a dictionary lookup before any fuzzy matching.
+Each restaurant's aliases are loaded with one query over the unique
+index and cached; the cache is tied to the restaurant's alias data
+version: edits in this process drop it at once and edits made elsewhere
+are noticed by a version check at most every REVALIDATE_SECONDS.
+"""
+
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from backend.models.database import ProductAlias
+from backend.utils.data_version import alias_scope, get_versions, on_bump
+from backend.utils.product_search import normalize
+
+# How long a tenant's aliases are trusted before the alias version is checked
+REVALIDATE_SECONDS = 5
+
+
+def alias_key(line_text: Optional[str]) -> str:
+    return normalize(line_text)[:200]
+
+
+class TenantAliases:
+    """Aliases of one restaurant: per provider, and by text alone for unknown providers"""
+
+    def __init__(self, rows: Iterable, version: int = 0):
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.by_provider: Dict[Tuple[int, str], int] = {}
+        self.by_text: Dict[str, int] = {}
+        # Rows come oldest first, so the latest confirmation wins across providers
+        for provider_id, line_text, product_id in rows:
+            self.by_provider[(provider_id, line_text)] = product_id
+            self.by_text[line_text] = product_id
+
+    def resolve(self, provider_id: Optional[int], line_text: str) -> Optional[int]:
+        key = alias_key(line_text)
+        if not key:
+            return None
+        if provider_id is not None:
+            return self.by_provider.get((provider_id, key))
+        return self.by_text.get(key)
+
+
+_aliases: Dict[int, TenantAliases] = {}
+_aliases_lock = threading.Lock()
+
+
+def invalidate(restaurant_id: Optional[int]) -> None:
+    with _aliases_lock:
+        _aliases.pop(restaurant_id, None)
+
+
+def _on_bump(scope: str) -> None:
+    if scope.startswith("aliases:"):
+        invalidate(int(scope.split(":", 1)[1]))
+
+
+on_bump(_on_bump)
+
+
+def get_aliases(db: Session, restaurant_id: int) -> TenantAliases:
+    """The restaurant's aliases, reloaded only when they changed"""
+    now = time.monotonic()
+    with _aliases_lock:
+        aliases = _aliases.get(restaurant_id)
+        if aliases is not None and now - aliases.checked_at < REVALIDATE_SECONDS:
+            return aliases
+
+    scope = alias_scope(restaurant_id)
+    version = get_versions(db, [scope])[scope]
+    if aliases is not None and aliases.version == version:
+        aliases.checked_at = now
+        return aliases
+
+    rows = db.query(ProductAlias.provider_id, ProductAlias.line_text, ProductAlias.product_id).filter(
+        ProductAlias.restaurant_id == restaurant_id
+    ).order_by(ProductAlias.updated_at, ProductAlias.id).all()
+    aliases = TenantAliases(rows, version)
+    with _aliases_lock:
+        _aliases[restaurant_id] = aliases
+    return aliases
+
+
+def resolve_lines(db: Session, restaurant_id: int, provider_id: Optional[int], lines: Sequence[str]) -> List[Optional[int]]:
+    """Aliased product id (or None) for each line"""
+    aliases = get_aliases(db, restaurant_id)
+    return [aliases.resolve(provider_id, line) for line in lines]
+
+
+def learn_aliases(db: Session, restaurant_id: int, provider_id: int, pairs: Iterable[Tuple[str, int]]) -> int:
+    """Store confirmed (line text, product_id) mappings (upsert, not committed).
+
+    A line mapped to another product than before replaces the alias.
+    Returns the number of aliases written; bump alias_scope after commit.
+    """
+    mappings = {}
+    for line_text, product_id in pairs:
+        key = alias_key(line_text)
+        if key and product_id:
+            mappings[key] = product_id
+    if not mappings:
+        return 0
+
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = dialect_insert(ProductAlias)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["restaurant_id", "provider_id", "line_text"],
+            set_={
+                "product_id": stmt.excluded.product_id,
+                "times_confirmed": ProductAlias.times_confirmed + 1,
+                "updated_at": func.now(),
+            }
+        )
+        for key in sorted(mappings):
+            db.execute(stmt, {
+                "restaurant_id": restaurant_id,
+                "provider_id": provider_id,
+                "line_text": key,
+                "product_id": mappings[key],
+                "times_confirmed": 1,
+            })
+        return len(mappings)
+
+    for key in sorted(mappings):
+        matched = db.execute(
+            update(ProductAlias).where(
+                ProductAlias.restaurant_id == restaurant_id,
+                ProductAlias.provider_id == provider_id,
+                ProductAlias.line_text == key
+            ).values(
+                product_id=mappings[key],
+                times_confirmed=ProductAlias.times_confirmed + 1,
+                updated_at=func.now()
+            ),
+            execution_options={"synchronize_session": False}
+        ).rowcount
+        if not matched:
+            db.add(ProductAlias(
+                restaurant_id=restaurant_id,
+                provider_id=provider_id,
+                line_text=key,
+                product_id=mappings[key]
+            ))
+    db.flush()
+    return len(mappings)
+
+
+def forget_product(db: Session, product_id: int) -> None:
+    """Drop the aliases of a product being deleted (not committed)"""
+    db.query(ProductAlias).filter(ProductAlias.product_id == product_id).delete(synchronize_session=False)
@@ -0,0 +1,312 @@
+"""
+Batch invoice OCR
+Lotes de facturas para OCR (varios archivos o un ZIP)
+
+A week of paper invoices is uploaded at once as many files and/or ZIP
+archives. Uploads are copied to a per-job temporary directory in chunks
+(ZIP members are extracted one by one, each capped at MAX_UPLOAD_SIZE_MB),
+hashed and type-sniffed on the way, and recorded as an OCRBatchJob with one OCRBatchFile
+per invoice. The job then runs in the background of the API process: as
+many files as there are OCR workers are in flight at once, so while one
+worker rasterizes a PDF another is running tesseract and another parsing,
+and throughput grows with the number of cores. Identical files are
+scanned once and results already cached for the restaurant are reused.
+Progress is read from the job rows.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import zipfile
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+from fastapi import UploadFile
+from sqlalchemy import update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from backend.config import settings
+from backend.models.database import OCRBatchFile, OCRBatchJob
+from backend.utils.ocr_cache import CACHED_FIELDS, get_cached_result, store_result
+from backend.utils.ocr_pool import OCRQueueFull, run_ocr, worker_count
+from backend.utils.uploads import SavedFile, UploadTooLarge, save_stream, save_upload, sniff_upload
+
+logger = logging.getLogger(__name__)
+
+# Seconds a batch waits before retrying when the OCR queue is full
+QUEUE_RETRY_SECONDS = 2
+
+
+class BatchUploadError(Exception):
+    """The batch upload cannot be accepted"""
+
+
+class StagedFile:
+    """An uploaded invoice saved to the job directory"""
+
+    def __init__(self, filename: str, path: Optional[str], content_type: Optional[str],
+                 size: int = 0, digest: Optional[str] = None, error: Optional[str] = None):
+        self.filename = filename
+        self.path = path
+        self.content_type = content_type
+        self.size = size
+        self.digest = digest
+        self.error = error
+
+
+def _stage_saved(filename: str, saved: SavedFile, max_bytes: int) -> StagedFile:
+    """Check a saved invoice's sniffed type and size; rejected files are removed"""
+    error = None
+    if saved.content_type not in settings.ALLOWED_FILE_TYPES:
+        error = "Invalid file type"
+    elif saved.size > max_bytes:
+        error = "File too large"
+    if error:
+        os.remove(saved.path)
+        return StagedFile(filename, None, saved.content_type, saved.size, error=error)
+    return StagedFile(filename, saved.path, saved.content_type, saved.size, saved.digest)
+
+
+def _extract_zip(zip_path: str, directory: str, first_index: int, max_files: int) -> List[StagedFile]:
+    """Extract the invoices of a ZIP member by member (blocking)"""
+    max_bytes = settings.MAX_UPLOAD_SIZE_MB * 1024 * 1024
+    staged: List[StagedFile] = []
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            for info in archive.infolist():
+                name = info.filename
+                basename = os.path.basename(name)
+                if info.is_dir() or name.startswith("__MACOSX/") or not basename or basename.startswith("."):
+                    continue
+                if len(staged) >= max_files:
+                    raise BatchUploadError(f"Too many files (max {settings.OCR_BATCH_MAX_FILES})")
+
+                # Declared size first, then the bytes actually inflated
+                if info.file_size > max_bytes:
+                    staged.append(StagedFile(name, None, None, info.file_size, error="File too large"))
+                    continue
+
+                path = os.path.join(directory, f"{first_index + len(staged):05d}")
+                try:
+                    with archive.open(info) as member:
+                        saved = save_stream(member, path, max_bytes)
+                except UploadTooLarge:
+                    staged.append(StagedFile(name, None, None, info.file_size, error="File too large"))
+                    continue
+                staged.append(_stage_saved(name, saved, max_bytes))
+    except zipfile.BadZipFile:
+        raise BatchUploadError("Invalid ZIP archive")
+    return staged
+
+
+async def stage_uploads(uploads: List[UploadFile], directory: str) -> List[StagedFile]:
+    """Save the uploaded files (and the contents of ZIPs) to directory"""
+    max_bytes = settings.MAX_UPLOAD_SIZE_MB * 1024 * 1024
+    max_total = settings.OCR_BATCH_MAX_SIZE_MB * 1024 * 1024
+    staged: List[StagedFile] = []
+    total = 0
+
+    for upload in uploads:
+        name = upload.filename or f"file-{len(staged) + 1}"
+        remaining_files = settings.OCR_BATCH_MAX_FILES - len(staged)
+        if remaining_files <= 0:
+            raise BatchUploadError(f"Too many files (max {settings.OCR_BATCH_MAX_FILES})")
+
+        # The first bytes decide the cap: a ZIP may use the rest of the
+        # batch size, anything else MAX_UPLOAD_SIZE_MB
+        is_zip = await sniff_upload(upload) == "application/zip"
+        remaining_bytes = max_total - total
+        cap = remaining_bytes if is_zip else min(max_bytes, remaining_bytes)
+        path = os.path.join(directory, f"upload-{len(staged):05d}")
+        try:
+            saved = await save_upload(upload, path, cap)
+        except UploadTooLarge:
+            if cap == remaining_bytes:
+                raise BatchUploadError(f"Batch too large. Maximum size: {settings.OCR_BATCH_MAX_SIZE_MB}MB")
+            staged.append(StagedFile(name, None, None, error="File too large"))
+            continue
+        total += saved.size
+
+        if is_zip:
+            staged.extend(await asyncio.to_thread(_extract_zip, path, directory, len(staged), remaining_files))
+            os.remove(path)
+        else:
+            staged.append(_stage_saved(name, saved, max_bytes))
+
+    if not staged:
+        raise BatchUploadError("No files uploaded")
+    return staged
+
+
+def create_job(db: Session, restaurant_id: int, user_id: int, staged: List[StagedFile]) -> OCRBatchJob:
+    """Record the job and its files; files rejected while staging are already failed"""
+    job = OCRBatchJob(
+        restaurant_id=restaurant_id,
+        created_by=user_id,
+        status="processing",
+        file_count=len(staged),
+        failed_count=sum(1 for f in staged if f.error)
+    )
+    db.add(job)
+    db.flush()
+    db.add_all([
+        OCRBatchFile(
+            job_id=job.id,
+            position=i,
+            filename=f.filename[:255],
+            content_type=f.content_type,
+            file_size=f.size,
+            content_hash=f.digest,
+            status="failed" if f.error else "queued",
+            error=f.error,
+            finished_at=datetime.utcnow() if f.error else None
+        )
+        for i, f in enumerate(staged)
+    ])
+    db.commit()
+    return job
+
+
+def _finish_files(db: Session, job_id: int, positions: List[int], result: Optional[Dict[str, Any]],
+                  error: Optional[str] = None, duplicate: bool = False) -> None:
+    values = {"finished_at": datetime.utcnow()}
+    if result is not None:
+        values.update(
+            status="done",
+            duplicate=duplicate,
+            result=json.dumps({field: result.get(field) for field in CACHED_FIELDS}, default=str)
+        )
+    else:
+        values.update(status="failed", error=(error or "OCR processing failed")[:500])
+    db.execute(
+        update(OCRBatchFile).where(OCRBatchFile.job_id == job_id, OCRBatchFile.position.in_(positions)).values(**values)
+    )
+    counter = OCRBatchJob.done_count if result is not None else OCRBatchJob.failed_count
+    db.execute(update(OCRBatchJob).where(OCRBatchJob.id == job_id).values({counter: counter + len(positions)}))
+    db.commit()
+
+
+async def _scan(db: Session, restaurant_id: int, staged: StagedFile) -> tuple:
+    """(result, error, duplicate) for one distinct file"""
+    cached = get_cached_result(db, restaurant_id, staged.digest)
+    if cached is not None:
+        return cached, None, True
+
+    while True:
+        try:
+            result = await run_ocr(staged.path, staged.content_type)
+            break
+        except OCRQueueFull:
+            # Interactive scans take the free slots; the batch waits its turn
+            await asyncio.sleep(QUEUE_RETRY_SECONDS)
+    if not result.get("success"):
+        return None, result.get("error"), False
+
+    store_result(db, restaurant_id, staged.digest, staged.content_type, staged.size, result)
+    return result, None, False
+
+
+async def run_job(bind: Engine, job_id: int, restaurant_id: int, staged: List[StagedFile], directory: str) -> None:
+    """Scan every staged file of the job, worker_count() files at a time.
+
+    Each file uses its own short-lived session: the scans run concurrently
+    and a failure (rollback) in one must not touch another's writes. An
+    unexpected error stops the job: it ends "failed", as do its unfinished files.
+    """
+    # Identical files (same hash) are scanned once
+    groups: Dict[str, List[int]] = {}
+    for position, f in enumerate(staged):
+        if not f.error:
+            groups.setdefault(f.digest, []).append(position)
+    slots = asyncio.Semaphore(worker_count())
+
+    async def process(positions: List[int]) -> None:
+        async with slots:
+            db = Session(bind=bind, autoflush=False)
+            try:
+                db.execute(
+                    update(OCRBatchFile).where(
+                        OCRBatchFile.job_id == job_id, OCRBatchFile.position.in_(positions)
+                    ).values(status="processing")
+                )
+                db.commit()
+                try:
+                    result, error, duplicate = await _scan(db, restaurant_id, staged[positions[0]])
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Batch OCR error (job {job_id}): {str(e)}")
+                    db.rollback()
+                    result, error, duplicate = None, str(e), False
+                _finish_files(db, job_id, positions, result, error, duplicate)
+                # Later copies of the same file within the batch are duplicates
+                if result is not None and len(positions) > 1:
+                    db.execute(
+                        update(OCRBatchFile).where(
+                            OCRBatchFile.job_id == job_id, OCRBatchFile.position.in_(positions[1:])
+                        ).values(duplicate=True)
+                    )
+                    db.commit()
+            finally:
+                db.close()
+
+    tasks = [asyncio.ensure_future(process(positions)) for positions in groups.values()]
+    status = "completed"
+    try:
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        status = "interrupted"
+        raise
+    except Exception as e:
+        logger.error(f"Batch OCR job {job_id} failed: {str(e)}")
+        status = "failed"
+        # Stop the other files before their rows are marked failed
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        db = Session(bind=bind, autoflush=False)
+        try:
+            unfinished = 0
+            if status != "completed":
+                unfinished = db.execute(
+                    update(OCRBatchFile).where(
+                        OCRBatchFile.job_id == job_id, OCRBatchFile.status.in_(("queued", "processing"))
+                    ).values(
+                        status="failed",
+                        error="Interrupted" if status == "interrupted" else "Batch failed",
+                        finished_at=datetime.utcnow()
+                    )
+                ).rowcount
+            db.execute(
+                update(OCRBatchJob).where(OCRBatchJob.id == job_id).values(
+                    status=status,
+                    failed_count=OCRBatchJob.failed_count + unfinished,
+                    finished_at=datetime.utcnow()
+                )
+            )
+            db.commit()
+        finally:
+            db.close()
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+_tasks: Set[asyncio.Task] = set()
+
+
+def start_job(bind: Engine, job_id: int, restaurant_id: int, staged: List[StagedFile], directory: str) -> None:
+    task = asyncio.create_task(run_job(bind, job_id, restaurant_id, staged, directory))
+    # Keep a reference until it ends (the loop only holds weak ones)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def shutdown_batch_jobs() -> None:
+    """Stop running batches on shutdown; their unfinished files are marked failed"""
+    tasks = list(_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
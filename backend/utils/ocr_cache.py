@@ -0,0 +1,106 @@
+"""
+OCR result cache
+Caché de resultados OCR por hash del contenido
+
+The same invoice photo or PDF is often uploaded twice (a failed save, a
+second device). Successful OCR results are stored per restaurant under the
+SHA-256 of the uploaded bytes, so a repeated upload is answered from the
+database without running tesseract again and can be flagged as a likely
+duplicate. Each restaurant keeps at most OCR_CACHE_MAX_ENTRIES results;
+the least recently used ones are evicted.
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from backend.config import settings
+from backend.models.database import OCRResultCache
+
+# Result fields that are stored; suggestions depend on the current catalog
+# and are always recomputed
+CACHED_FIELDS = (
+    "invoice_number", "invoice_date", "provider_name", "items", "subtotal",
+    "tax", "total", "confidence", "raw_text", "source", "pages"
+)
+
+
+def content_hash(file_content: bytes) -> str:
+    return hashlib.sha256(file_content).hexdigest()
+
+
+def get_cached_result(db: Session, restaurant_id: int, digest: str) -> Optional[Dict[str, Any]]:
+    """Stored result for this content, with duplicate metadata; counts the hit"""
+    entry = db.query(OCRResultCache).filter(
+        OCRResultCache.restaurant_id == restaurant_id,
+        OCRResultCache.content_hash == digest
+    ).first()
+    if entry is None:
+        return None
+
+    result = json.loads(entry.result)
+    result.update(
+        success=True,
+        duplicate=True,
+        first_seen_at=entry.created_at.isoformat() if entry.created_at else None,
+        upload_count=entry.hit_count + 2  # The first upload and this one
+    )
+
+    db.execute(
+        update(OCRResultCache).where(OCRResultCache.id == entry.id).values(
+            hit_count=OCRResultCache.hit_count + 1,
+            last_used_at=func.now()
+        )
+    )
+    db.commit()
+    return result
+
+
+def store_result(
+    db: Session,
+    restaurant_id: int,
+    digest: str,
+    content_type: Optional[str],
+    file_size: int,
+    result: Dict[str, Any]
+) -> None:
+    """Save a successful OCR result and evict the restaurant's oldest entries"""
+    row = {
+        "restaurant_id": restaurant_id,
+        "content_hash": digest,
+        "content_type": content_type,
+        "file_size": file_size,
+        "result": json.dumps({field: result.get(field) for field in CACHED_FIELDS}, default=str),
+        "hit_count": 0,
+    }
+
+    dialect = db.get_bind().dialect.name
+    try:
+        if dialect in ("postgresql", "sqlite"):
+            dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+            # The same file scanned twice at once: the first result wins
+            db.execute(dialect_insert(OCRResultCache).values(**row).on_conflict_do_nothing(
+                index_elements=["restaurant_id", "content_hash"]
+            ))
+        else:
+            db.add(OCRResultCache(**row))
+            db.flush()
+    except IntegrityError:
+        db.rollback()
+        return
+
+    stale_ids = db.execute(
+        select(OCRResultCache.id).where(
+            OCRResultCache.restaurant_id == restaurant_id
+        ).order_by(
+            OCRResultCache.last_used_at.desc(), OCRResultCache.id.desc()
+        ).offset(settings.OCR_CACHE_MAX_ENTRIES)
+    ).scalars().all()
+    if stale_ids:
+        db.execute(delete(OCRResultCache).where(OCRResultCache.id.in_(stale_ids)))
+    db.commit()
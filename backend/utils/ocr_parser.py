@@ -5,85 +5,121 @@ Parser OCR para procesamiento de facturas
 
 import re
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Any, BinaryIO, Dict, List, NamedTuple, Optional, Pattern, Tuple, Union
 import pytesseract
 from PIL import Image
 import io
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 import pdf2image
 import logging
 
+from backend.utils.pdf_text import MAX_PDF_PAGES, pdf_text_pages
+
 logger = logging.getLogger(__name__)
 
+# Line items returned per invoice (multi-page invoices are read whole)
+MAX_ITEMS = 200
+
+# Rasterization resolution for scanned PDF pages (bounds memory per page)
+PDF_OCR_DPI = 200
+
+# Scanned pages of one PDF OCRed at the same time
+MAX_PARALLEL_PAGES = 4
+
+# Lines at the top and bottom of a page checked for repeated headers/footers
+EDGE_LINES = 4
+
+
+class FieldPattern(NamedTuple):
+    regex: Pattern
+    # Lower-case words every match starts with (empty = can start anywhere)
+    starts: Tuple[str, ...]
+
+
+def _field(pattern: str, *starts: str) -> FieldPattern:
+    return FieldPattern(re.compile(pattern, re.IGNORECASE | re.MULTILINE), starts)
+
+
+# Header fields and totals (Spanish and German invoices), in priority order
+FIELD_PATTERNS: Dict[str, List[FieldPattern]] = {
+    'invoice_number': [
+        _field(r'(?:factura|rechnung|n[°º]\s+factura|nro\.?\s*factura|rechnungsnummer)[\s:]*([A-Z0-9\-]+)', 'factura', 'rechnung', 'n°', 'nº', 'nro'),
+        _field(r'(?:n[°º]\s*[:.]?\s*)([A-Z0-9\-]{5,20})', 'n°', 'nº'),
+        _field(r'(?:ref\.?|referencia)[\s:]*([A-Z0-9\-]+)', 'ref')
+    ],
+    'date': [
+        _field(r'(?:fecha|datum|rechnungsdatum|fecha\s+de\s+emisi[óo]n)[\s:]*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})', 'fecha', 'datum', 'rechnungsdatum'),
+        _field(r'(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})')
+    ],
+    'provider': [
+        _field(r'(?:proveedor|vendedor|lieferant|raz[óo]n\s+social|firma)[\s:]*(.{5,50})', 'proveedor', 'vendedor', 'lieferant', 'raz', 'firma'),
+        _field(r'(?:nombre|empresa|name)[\s:]*(.{5,50})', 'nombre', 'empresa', 'name')
+    ],
+    'total': [
+        _field(r'(?:total|gesamtsumme|gesamtbetrag|total\s+a\s+pagar)[\s:]*[€$]?\s*(\d+[,.]?\d{0,2})', 'total', 'gesamtsumme', 'gesamtbetrag'),
+        _field(r'(?:summe)[\s:]*(\d+[,.]?\d{0,2})', 'summe')
+    ],
+    'subtotal': [
+        _field(r'(?:subtotal|netto|netto-betrag|base\s+imponible)[\s:]*[€$]?\s*(\d+[,.]?\d{0,2})', 'subtotal', 'netto', 'base')
+    ],
+    'tax': [
+        _field(r'(?:iva|mwst|mehrwertsteuer|impuesto)[\s:]*[€$]?\s*(\d+[,.]?\d{0,2})', 'iva', 'mwst', 'mehrwertsteuer', 'impuesto'),
+        _field(r'(?:ust|vat)[\s:]*[€$]?\s*(\d+[,.]?\d{0,2})', 'ust', 'vat')
+    ]
+}
+
+# Product line patterns: name, quantity, unit price and total in the usual column orders
+PRODUCT_PATTERNS: List[Pattern] = [
+    re.compile(r'(.{5,40})\s+(\d+(?:[,.]\d{1,3})?)\s+x?\s*\$?\s*(\d+[,.]?\d{0,2})\s+\$?\s*(\d+[,.]?\d{0,2})', re.IGNORECASE),
+    re.compile(r'(.{5,40})\s+\$?\s*(\d+[,.]?\d{0,2})\s+(\d+(?:[,.]\d{1,3})?)\s+\$?\s*(\d+[,.]?\d{0,2})', re.IGNORECASE),
+    re.compile(r'(\d+(?:[,.]\d{1,3})?)\s+(.{5,40})\s+\$?\s*(\d+[,.]?\d{0,2})\s+\$?\s*(\d+[,.]?\d{0,2})', re.IGNORECASE)
+]
+
+# Numbers as written on invoice lines (each item column starts a new one)
+_NUMBER = re.compile(r'\d+[,.]?\d{0,2}')
+_LETTERS = re.compile(r'[a-zA-Z]{3,}')
+_WHITESPACE = re.compile(r'\s+')
+
+DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%m/%d/%Y', '%m-%d-%Y', '%d/%m/%y', '%d-%m-%y')
+
 class OCRParser:
     """OCR Parser for Spanish invoices"""
     
-    def __init__(self):
-        # Spanish invoice patterns
-        self.invoice_patterns = {
-            'invoice_number': [
-                r'(?:factura|rechnung|n[°º]\s+factura|nro\.?\s*factura|rechnungsnummer)[\s:]*([A-Z0-9\-]+)',
-                r'(?:n[°º]\s*[:.]?\s*)([A-Z0-9\-]{5,20})',
-                r'(?:ref\.?|referencia)[\s:]*([A-Z0-9\-]+)'
-            ],
-            'date': [
-                r'(?:fecha|datum|rechnungsdatum|fecha\s+de\s+emisi[óo]n)[\s:]*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
-                r'(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})'
-            ],
-            'provider': [
-                r'(?:proveedor|vendedor|lieferant|raz[óo]n\s+social|firma)[\s:]*(.{5,50})',
-                r'(?:nombre|empresa|name)[\s:]*(.{5,50})'
-            ],
-            'total': [
-                r'(?:total|gesamtsumme|gesamtbetrag|total\s+a\s+pagar)[\s:]*[€$]?\s*(\d+[,.]?\d{0,2})',
-                r'(?:summe)[\s:]*(\d+[,.]?\d{0,2})'
-            ],
-            'subtotal': [
-                r'(?:subtotal|netto|netto-betrag|base\s+imponible)[\s:]*[€$]?\s*(\d+[,.]?\d{0,2})'
-            ],
-            'tax': [
-                r'(?:iva|mwst|mehrwertsteuer|impuesto)[\s:]*[€$]?\s*(\d+[,.]?\d{0,2})',
-                r'(?:ust|vat)[\s:]*[€$]?\s*(\d+[,.]?\d{0,2})'
-            ]
-        }
+    # Compiled once at import and shared by every instance
+    invoice_patterns = FIELD_PATTERNS
+    product_patterns = PRODUCT_PATTERNS
+    
+    def process_invoice(self, file_content: bytes, content_type: str, timeout: int = 15) -> Dict[str, Any]:
+        """Process invoice file contents with OCR (see process_invoice_file)"""
+        
+        if content_type != "application/pdf":
+            return self.process_invoice_file(io.BytesIO(file_content), content_type, timeout)
         
-        # Product line patterns
-        self.product_patterns = [
-            r'(.{5,40})\s+(\d+(?:[,.]\d{1,3})?)\s+x?\s*\$?\s*(\d+[,.]?\d{0,2})\s+\$?\s*(\d+[,.]?\d{0,2})',
-            r'(.{5,40})\s+\$?\s*(\d+[,.]?\d{0,2})\s+(\d+(?:[,.]\d{1,3})?)\s+\$?\s*(\d+[,.]?\d{0,2})',
-            r'(\d+(?:[,.]\d{1,3})?)\s+(.{5,40})\s+\$?\s*(\d+[,.]?\d{0,2})\s+\$?\s*(\d+[,.]?\d{0,2})'
-        ]
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf_file:
+            pdf_file.write(file_content)
+            pdf_file.flush()
+            return self.process_invoice_file(pdf_file.name, content_type, timeout)
     
-    def process_invoice(self, file_content: bytes, content_type: str) -> Dict[str, Any]:
-        """Process invoice file with OCR"""
+    def process_invoice_file(self, file: Union[str, BinaryIO], content_type: str, timeout: int = 15) -> Dict[str, Any]:
+        """Process an invoice file on disk with OCR (timeout bounds the poppler and tesseract subprocesses).
+
+        `file` is a path (PDFs are read by path) or an open image file.
+        Digital PDFs are read from their text layer; only scanned pages are OCRed.
+        """
         
         try:
-            # Convert file to image
             if content_type == "application/pdf":
-                # Limit to first page only and add timeout to prevent DoS
-                images = pdf2image.convert_from_bytes(
-                    file_content,
-                    first_page=1,
-                    last_page=1,  # Only process first page
-                    timeout=15  # 15 second timeout
-                )
-                if not images:
+                text, source, page_count = self._read_pdf(file, timeout)
+                if text is None:
                     return {"success": False, "error": "Could not convert PDF to image"}
-                image = images[0]
             else:
-                image = Image.open(io.BytesIO(file_content))
-            
-            # Preprocess image for better OCR
-            processed_image = self._preprocess_image(image)
+                with Image.open(file) as image:
+                    text, source, page_count = self._ocr_image(image, timeout), "ocr", 1
             
-            # Perform OCR with Spanish and German language support
-            custom_config = r'--oem 3 --psm 6 -l spa+deu'
-            text = pytesseract.image_to_string(processed_image, config=custom_config)
-            
-            # Parse extracted text
-            parsed_data = self._parse_invoice_text(text)
-            
-            # Extract products
-            products = self._extract_products(text)
+            # Parse extracted text (header fields, totals and line items)
+            parsed_data, products = self.parse_text(text)
             
             # Calculate confidence based on extracted fields
             confidence = self._calculate_confidence(parsed_data, products)
@@ -98,7 +134,9 @@ class OCRParser:
                 "tax": parsed_data.get("tax"),
                 "total": parsed_data.get("total"),
                 "confidence": confidence,
-                "raw_text": text
+                "raw_text": text,
+                "source": source,
+                "pages": page_count
             }
             
         except Exception as e:
@@ -110,6 +148,90 @@ class OCRParser:
                 "confidence": 0.0
             }
     
+    def _ocr_image(self, image: Image.Image, timeout: int) -> str:
+        """Preprocess and OCR one page image"""
+        
+        # Preprocess image for better OCR
+        processed_image = self._preprocess_image(image)
+        
+        # Perform OCR with Spanish and German language support
+        custom_config = r'--oem 3 --psm 6 -l spa+deu'
+        return pytesseract.image_to_string(processed_image, config=custom_config, timeout=timeout)
+    
+    def _ocr_pdf_page(self, pdf_path: str, page_number: int, timeout: int) -> str:
+        """Rasterize a single PDF page (1-based) and OCR it; only this page is held in memory"""
+        
+        images = pdf2image.convert_from_path(
+            pdf_path,
+            dpi=PDF_OCR_DPI,
+            first_page=page_number,
+            last_page=page_number,
+            grayscale=True,
+            timeout=timeout
+        )
+        return self._ocr_image(images[0], timeout) if images else ""
+    
+    def _page_count(self, pdf_path: str, timeout: int) -> int:
+        try:
+            return min(int(pdf2image.pdfinfo_from_path(pdf_path, timeout=timeout)["Pages"]), MAX_PDF_PAGES)
+        except Exception as e:
+            logger.warning(f"Could not read PDF page count: {str(e)}")
+            return 1
+    
+    def _read_pdf(self, pdf_path: str, timeout: int):
+        """(text, source, page count): text layer of every page, OCR for scanned pages only"""
+        
+        pages = pdf_text_pages(pdf_path, timeout)
+        if pages is None:
+            # No readable text layer: OCR every page
+            pages = [None] * self._page_count(pdf_path, timeout)
+        if not pages:
+            return None, None, 0
+        
+        scanned = [page_number for page_number, page_text in enumerate(pages, start=1) if page_text is None]
+        texts = list(pages)
+        if len(scanned) == 1:
+            texts[scanned[0] - 1] = self._ocr_pdf_page(pdf_path, scanned[0], timeout)
+        elif scanned:
+            # Pages are rasterized lazily by the threads, so at most
+            # MAX_PARALLEL_PAGES page images exist at once; the work runs
+            # in the pdftoppm and tesseract subprocesses
+            with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_PAGES, len(scanned))) as executor:
+                ocr_texts = executor.map(
+                    lambda page_number: self._ocr_pdf_page(pdf_path, page_number, timeout),
+                    scanned
+                )
+                for page_number, page_text in zip(scanned, ocr_texts):
+                    texts[page_number - 1] = page_text
+        
+        source = "text" if not scanned else "ocr" if len(scanned) == len(pages) else "mixed"
+        return self._merge_pages(texts), source, len(pages)
+    
+    def _merge_pages(self, pages: List[str]) -> str:
+        """Join page texts, dropping header/footer lines already seen on an earlier page.
+        
+        Lines in the first or last EDGE_LINES lines of a page are compared with
+        digits masked, so "Página 2 de 3" repeats "Página 1 de 3" and a carried
+        forward total repeats on every page. Item rows are always kept, even
+        at a page edge: the same product may be invoiced on several pages.
+        """
+        
+        seen_edges = set()
+        merged = []
+        for page in pages:
+            lines = [line for line in page.split('\n') if line.strip()]
+            edges = set(range(min(EDGE_LINES, len(lines)))) | set(range(max(len(lines) - EDGE_LINES, 0), len(lines)))
+            page_edges = set()
+            for i, line in enumerate(lines):
+                if i in edges and not self._is_item_row(line):
+                    key = re.sub(r'\d', '#', re.sub(r'\s+', ' ', line.strip().lower()))
+                    if key in seen_edges:
+                        continue
+                    page_edges.add(key)
+                merged.append(line)
+            seen_edges |= page_edges
+        return '\n'.join(merged)
+    
     def _preprocess_image(self, image: Image.Image) -> Image.Image:
         """Preprocess image for better OCR results"""
         
@@ -129,183 +251,192 @@ class OCRParser:
         
         return image
     
+    def parse_text(self, text: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Header fields and line items of an invoice text"""
+        return self._parse_invoice_text(text), self._extract_products(text)
+    
     def _parse_invoice_text(self, text: str) -> Dict[str, Optional[str]]:
         """Parse invoice text to extract key fields"""
         
         result = {}
-        text_lower = text.lower()
+        # Used to skip or shorten the pattern searches (see _search)
+        folded = text.casefold()
         
         # Extract invoice number
-        result['invoice_number'] = self._extract_field(text, self.invoice_patterns['invoice_number'])
+        result['invoice_number'] = self._extract_field(text, folded, self.invoice_patterns['invoice_number'])
         
         # Extract date
-        date_str = self._extract_field(text, self.invoice_patterns['date'])
-        if date_str:
-            result['invoice_date'] = self._normalize_date(date_str)
-        else:
-            result['invoice_date'] = None
+        date_str = self._extract_field(text, folded, self.invoice_patterns['date'])
+        result['invoice_date'] = self._normalize_date(date_str) if date_str else None
         
         # Extract provider
-        result['provider'] = self._extract_field(text, self.invoice_patterns['provider'])
+        result['provider'] = self._extract_field(text, folded, self.invoice_patterns['provider'])
         
         # Extract amounts
-        result['subtotal'] = self._extract_amount(text, self.invoice_patterns['subtotal'])
-        result['tax'] = self._extract_amount(text, self.invoice_patterns['tax'])
-        result['total'] = self._extract_amount(text, self.invoice_patterns['total'])
+        result['subtotal'] = self._extract_amount(text, folded, self.invoice_patterns['subtotal'])
+        result['tax'] = self._extract_amount(text, folded, self.invoice_patterns['tax'])
+        result['total'] = self._extract_amount(text, folded, self.invoice_patterns['total'])
         
         return result
     
-    def _extract_field(self, text: str, patterns: List[str]) -> Optional[str]:
-        """Extract field using regex patterns"""
+    def _search(self, text: str, folded: str, patterns: List[FieldPattern]):
+        """Matches of the applicable patterns, in priority order.
+        
+        A labelled pattern is skipped when none of its start words is in the
+        text, and otherwise searched from the first one (positions in the
+        case-folded text match the original when the lengths are equal).
+        """
         
+        same_positions = len(folded) == len(text)
         for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
+            start = 0
+            if pattern.starts:
+                found = [i for i in (folded.find(word) for word in pattern.starts) if i >= 0]
+                if not found:
+                    continue
+                if same_positions:
+                    start = min(found)
+            match = pattern.regex.search(text, start)
             if match:
-                value = match.group(1).strip()
-                # Clean up the value
-                value = re.sub(r'\s+', ' ', value)
-                value = value.replace('\n', ' ')
-                return value[:100]  # Limit length
+                yield match
+    
+    def _extract_field(self, text: str, folded: str, patterns: List[FieldPattern]) -> Optional[str]:
+        """Extract field using the first matching pattern"""
+        
+        for match in self._search(text, folded, patterns):
+            # Clean up the value
+            value = _WHITESPACE.sub(' ', match.group(1).strip())
+            return value[:100]  # Limit length
         
         return None
     
-    def _extract_amount(self, text: str, patterns: List[str]) -> Optional[float]:
+    def _extract_amount(self, text: str, folded: str, patterns: List[FieldPattern]) -> Optional[float]:
         """Extract monetary amount"""
         
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
-            if match:
-                try:
-                    amount_str = match.group(1).strip()
-                    # Clean and convert
-                    amount_str = amount_str.replace(',', '').replace('$', '')
-                    return float(amount_str)
-                except (ValueError, AttributeError):
-                    continue
+        for match in self._search(text, folded, patterns):
+            try:
+                return float(match.group(1).strip().replace(',', '').replace('$', ''))
+            except ValueError:
+                continue
         
         return None
     
     def _extract_products(self, text: str) -> List[Dict[str, Any]]:
-        """Extract product lines from invoice text"""
+        """Extract product lines in a single pass over the text.
+        
+        Numbers are tokenized once per line: lines with three or more are
+        tried as item rows (an item row needs quantity, price and total),
+        lines with two are kept as fallback rows and only parsed when no
+        item row matched in the whole text.
+        """
         
         products = []
-        lines = text.split('\n')
+        fallback_rows = []
         
-        for line in lines:
-            line = line.strip()
-            if len(line) < 10:  # Skip short lines
+        for line in text.split('\n'):
+            numbers = _NUMBER.findall(line)
+            if len(numbers) < 2:
                 continue
             
-            for pattern in self.product_patterns:
-                match = re.search(pattern, line, re.IGNORECASE)
-                if match:
-                    try:
-                        groups = match.groups()
-                        
-                        # Different patterns may have different group orders
-                        if len(groups) == 4:
-                            # Try to identify which group is which
-                            values = list(groups)
-                            
-                            # Find quantity (usually a whole number)
-                            quantity_idx = None
-                            for i, val in enumerate(values):
-                                if re.match(r'^\d+$', val.strip()):
-                                    quantity_idx = i
-                                    break
-                            
-                            if quantity_idx is not None:
-                                quantity = float(values[quantity_idx].replace(',', ''))
-                                
-                                # Find prices (decimal numbers)
-                                prices = []
-                                for i, val in enumerate(values):
-                                    if i != quantity_idx and re.search(r'\d+[,.]?\d{0,2}', val):
-                                        try:
-                                            price = float(val.replace(',', '').replace('$', ''))
-                                            prices.append(price)
-                                        except ValueError:
-                                            continue
-                                
-                                if len(prices) >= 2:
-                                    unit_price = min(prices)
-                                    total_price = max(prices)
-                                    
-                                    # Product name is the remaining value
-                                    name_values = [v for i, v in enumerate(values) if i not in [quantity_idx] + [i for i, p in enumerate(values) if p in [str(unit_price), str(total_price)]]]
-                                    product_name = name_values[0] if name_values else "Unknown Product"
-                                    
-                                    products.append({
-                                        "product_name": product_name[:50],
-                                        "quantity": quantity,
-                                        "unit_price": unit_price,
-                                        "total_price": total_price
-                                    })
-                                    break
-                                    
-                    except (ValueError, IndexError):
+            if len(numbers) >= 3:
+                stripped = line.strip()
+                if len(stripped) >= 10:  # Skip short lines
+                    product = self._match_item_row(stripped)
+                    if product:
+                        products.append(product)
                         continue
+            
+            if not products and _LETTERS.search(line):
+                fallback_rows.append((line, numbers))
         
         # If no products found with patterns, try simple line parsing
         if not products:
-            products = self._extract_products_simple(text)
+            products = [self._parse_fallback_row(line, numbers) for line, numbers in fallback_rows]
         
-        return products[:20]  # Limit to 20 products
+        return products[:MAX_ITEMS]
+    
+    def _is_item_row(self, line: str) -> bool:
+        """Whether _extract_products reads the line as an item row"""
+        stripped = line.strip()
+        return (
+            len(stripped) >= 10
+            and len(_NUMBER.findall(stripped)) >= 3
+            and self._match_item_row(stripped) is not None
+        )
     
-    def _extract_products_simple(self, text: str) -> List[Dict[str, Any]]:
-        """Simple product extraction as fallback"""
+    def _match_item_row(self, line: str) -> Optional[Dict[str, Any]]:
+        """Product from the first item pattern that yields a quantity and two prices"""
         
-        products = []
-        lines = text.split('\n')
-        
-        for line in lines:
-            # Look for lines with both text and numbers
-            if re.search(r'[a-zA-Z]{3,}', line) and re.search(r'\d+[,.]?\d{0,2}', line):
-                # Try to extract numbers
-                numbers = re.findall(r'\d+[,.]?\d{0,2}', line)
-                if len(numbers) >= 2:
-                    try:
-                        # Extract product name (text before numbers)
-                        parts = re.split(r'\d+[,.]?\d{0,2}', line)
-                        if parts:
-                            product_name = parts[0].strip()[:50]
-                            
-                            # Convert numbers
-                            nums = [float(n.replace(',', '')) for n in numbers[:3]]
-                            
-                            if len(nums) >= 2:
-                                quantity = nums[0] if nums[0] < 100 else 1
-                                unit_price = min(nums[1:])
-                                total_price = max(nums[1:])
-                                
-                                products.append({
-                                    "product_name": product_name,
-                                    "quantity": quantity,
-                                    "unit_price": unit_price,
-                                    "total_price": total_price
-                                })
-                    except (ValueError, IndexError):
-                        continue
+        for pattern in self.product_patterns:
+            match = pattern.search(line)
+            if not match:
+                continue
+            
+            try:
+                values = match.groups()
+                
+                # Find quantity (usually a whole number)
+                quantity_idx = next((i for i, val in enumerate(values) if val.strip().isdecimal()), None)
+                if quantity_idx is None:
+                    continue
+                quantity = float(values[quantity_idx].replace(',', ''))
+                
+                # Find prices (decimal numbers)
+                prices = []
+                for i, val in enumerate(values):
+                    if i != quantity_idx and _NUMBER.search(val):
+                        try:
+                            prices.append(float(val.replace(',', '').replace('$', '')))
+                        except ValueError:
+                            continue
+                
+                if len(prices) < 2:
+                    continue
+                unit_price = min(prices)
+                total_price = max(prices)
+                
+                # Product name is the first remaining value
+                price_texts = (str(unit_price), str(total_price))
+                product_name = next(
+                    (val for i, val in enumerate(values) if i != quantity_idx and val not in price_texts),
+                    "Unknown Product"
+                )
+                
+                return {
+                    "product_name": product_name[:50],
+                    "quantity": quantity,
+                    "unit_price": unit_price,
+                    "total_price": total_price
+                }
+            except (ValueError, IndexError):
+                continue
+        
+        return None
+    
+    def _parse_fallback_row(self, line: str, numbers: List[str]) -> Dict[str, Any]:
+        """Simple product extraction: name before the first number, then quantity and prices"""
+        
+        product_name = line[:_NUMBER.search(line).start()].strip()[:50]
+        nums = [float(n.replace(',', '')) for n in numbers[:3]]
         
-        return products
+        return {
+            "product_name": product_name,
+            "quantity": nums[0] if nums[0] < 100 else 1,
+            "unit_price": min(nums[1:]),
+            "total_price": max(nums[1:])
+        }
     
     def _normalize_date(self, date_str: str) -> Optional[str]:
         """Normalize date to ISO format"""
         
-        try:
-            # Try different date formats
-            formats = ['%d/%m/%Y', '%d-%m-%Y', '%m/%d/%Y', '%m-%d-%Y', '%d/%m/%y', '%d-%m-%y']
-            
-            for fmt in formats:
-                try:
-                    date_obj = datetime.strptime(date_str.strip(), fmt)
-                    return date_obj.strftime('%Y-%m-%d')
-                except ValueError:
-                    continue
-            
-            return None
-        except:
-            return None
+        date_str = date_str.strip()
+        for fmt in DATE_FORMATS:
+            try:
+                return datetime.strptime(date_str, fmt).strftime('%Y-%m-%d')
+            except ValueError:
+                continue
+        
+        return None
     
     def _calculate_confidence(self, parsed_data: Dict, products: List) -> float:
         """Calculate OCR confidence score"""
@@ -329,4 +460,24 @@ class OCRParser:
         if len(products) > 0:
             score += min(len(products) * 0.1, 1.0)
         
-        return min(score / max_score, 1.0)
\ No newline at end of file
+        return min(score / max_score, 1.0)
+
+
+# Parser of the current OCR worker process (see backend/utils/ocr_pool.py)
+_worker_parser: Optional[OCRParser] = None
+
+
+def init_ocr_worker() -> None:
+    """Process pool initializer: one tesseract thread per worker, parser built once"""
+    global _worker_parser
+    # The pool already runs one scan per core
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+    _worker_parser = OCRParser()
+
+
+def process_invoice_job(file_path: str, content_type: str, timeout: int) -> Dict[str, Any]:
+    """Entry point run in an OCR worker process; the file is read from disk by the worker"""
+    global _worker_parser
+    if _worker_parser is None:
+        _worker_parser = OCRParser()
+    return _worker_parser.process_invoice_file(file_path, content_type, timeout=timeout)
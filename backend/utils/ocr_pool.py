@@ -0,0 +1,121 @@
+"""
+OCR process pool
+Pool de procesos para el OCR de facturas
+
+PDF rasterization, PIL preprocessing and tesseract are CPU bound and
+blocking, so scans run in a pool of worker processes (one per CPU by
+default) and the endpoint awaits the result: the event loop keeps serving
+other requests and concurrent scans use every core. At most
+OCR_MAX_PENDING scans may be queued or running; beyond that new scans are
+refused instead of piling up. Files are passed by path, so an invoice is
+not pickled to the worker. Each scan must finish within
+OCR_TIMEOUT_SECONDS of being submitted; inside the worker the same limit
+is passed to pdftoppm and tesseract, which are killed when they exceed it.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+
+from backend.config import settings
+from backend.utils.ocr_parser import init_ocr_worker, process_invoice_job
+
+logger = logging.getLogger(__name__)
+
+
+class OCRQueueFull(Exception):
+    """Too many scans queued or running"""
+
+
+class OCRTimeout(Exception):
+    """A scan did not finish in time"""
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+_pending = 0
+
+
+def worker_count() -> int:
+    return settings.OCR_WORKERS or os.cpu_count() or 1
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            # spawn: workers do not inherit the server's threads or DB connections
+            _executor = ProcessPoolExecutor(
+                max_workers=worker_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_ocr_worker
+            )
+        return _executor
+
+
+def _discard_executor(executor: ProcessPoolExecutor) -> None:
+    """Drop a broken pool; the next scan starts a new one"""
+    global _executor
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _release(future: Future) -> None:
+    global _pending
+    with _lock:
+        _pending -= 1
+
+
+def pending_jobs() -> int:
+    return _pending
+
+
+async def run_ocr(file_path: str, content_type: str) -> Dict[str, Any]:
+    """Run OCRParser.process_invoice_file in the pool and wait for it without blocking the loop.
+
+    The worker reads the file itself; it must exist until the scan ends.
+    """
+    global _pending
+    with _lock:
+        if _pending >= settings.OCR_MAX_PENDING:
+            raise OCRQueueFull(f"{_pending} scans in progress")
+        _pending += 1
+
+    executor = _get_executor()
+    try:
+        future = executor.submit(process_invoice_job, file_path, content_type, settings.OCR_TIMEOUT_SECONDS)
+    except (BrokenProcessPool, RuntimeError):
+        _discard_executor(executor)
+        executor = _get_executor()
+        try:
+            future = executor.submit(process_invoice_job, file_path, content_type, settings.OCR_TIMEOUT_SECONDS)
+        except Exception:
+            _release(None)
+            raise
+    # The slot is freed when the worker is done, not when the caller stops waiting
+    future.add_done_callback(_release)
+
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=settings.OCR_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        # Cancelling drops the scan if it is still queued; a running one ends on its own timeouts
+        raise OCRTimeout(f"OCR did not finish in {settings.OCR_TIMEOUT_SECONDS}s")
+    except BrokenProcessPool:
+        logger.error("OCR worker process died; restarting the pool")
+        _discard_executor(executor)
+        raise
+
+
+def shutdown_ocr_pool() -> None:
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
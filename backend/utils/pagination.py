@@ -0,0 +1,122 @@
+"""
+Keyset (cursor) pagination helpers
+Utilidades de paginación por cursor (keyset)
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import DateTime, Numeric, and_, func, literal, or_
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Encode the sort key of the last row of a page as an opaque cursor"""
+    serializable = []
+    for value in values:
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        serializable.append(value)
+
+    raw = json.dumps(serializable, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: Sequence) -> List[Any]:
+    """Decode a cursor back into typed sort key values for the given columns"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, binascii.Error, UnicodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    typed = []
+    for column, value in zip(columns, values):
+        try:
+            if value is not None and isinstance(column.type, DateTime):
+                value = datetime.fromisoformat(value)
+            elif value is not None and isinstance(column.type, Numeric):
+                value = Decimal(value)
+        except (TypeError, ValueError, ArithmeticError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        typed.append(value)
+
+    return typed
+
+
+def keyset_condition(columns: Sequence, values: Sequence[Any], descending: bool = False):
+    """Build the "row comes after (values)" condition for a lexicographic sort key.
+
+    (a, b) > (x, y) is expanded to a > x OR (a = x AND b > y) so it works
+    on every backend, and still lets the planner seek on a composite index.
+    """
+    clauses = []
+    for i, column in enumerate(columns):
+        equal_prefix = [columns[j] == values[j] for j in range(i)]
+        step = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*equal_prefix, step))
+    return or_(*clauses)
+
+
+def order_by_keyset(query, columns: Sequence, descending: bool = False):
+    """Apply the stable ordering used by both offset and cursor pagination"""
+    return query.order_by(*[c.desc() if descending else c.asc() for c in columns])
+
+
+def _comparable(query, columns: Sequence, values: Optional[Sequence[Any]] = None):
+    """Sort key expressions (and bound values) compared the same way the rows are stored.
+
+    SQLite keeps datetimes as text: server_default rows hold "YYYY-MM-DD
+    HH:MM:SS" while a bound datetime is sent as "YYYY-MM-DD HH:MM:SS.ffffff",
+    so the same instant never compares equal. Both sides go through
+    julianday() there; other backends compare the columns directly.
+    """
+    if query.session.get_bind().dialect.name != "sqlite":
+        return list(columns), values
+
+    expressions = [func.julianday(c) if isinstance(c.type, DateTime) else c for c in columns]
+    if values is not None:
+        values = [
+            func.julianday(literal(v, c.type)) if isinstance(c.type, DateTime) and v is not None else v
+            for c, v in zip(columns, values)
+        ]
+    return expressions, values
+
+
+def paginate_keyset(
+    query,
+    columns: Sequence,
+    cursor: Optional[str],
+    limit: int,
+    descending: bool = False
+) -> Tuple[list, Optional[str]]:
+    """Fetch one page after `cursor` (an empty cursor means the first page).
+
+    `columns` is the sort key and must end with a unique column (the id) so
+    ordering is total. Returns the rows and the cursor of the next page, or
+    None when there are no more rows.
+    """
+    if cursor:
+        expressions, values = _comparable(query, columns, decode_cursor(cursor, columns))
+        query = query.filter(keyset_condition(expressions, values, descending))
+    else:
+        expressions, _ = _comparable(query, columns)
+
+    rows = order_by_keyset(query, expressions, descending).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column in columns])
+
+    return rows, next_cursor
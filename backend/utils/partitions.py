@@ -0,0 +1,95 @@
+"""
+Monthly partitions for stock_movements and waste_logs (PostgreSQL)
+Particiones mensuales para movimientos de stock y mermas (PostgreSQL)
+
+The tables are converted once by database/migrations/004_partition_movements_wastes.sql
+(PARTITION BY RANGE (created_at), one partition per calendar month plus a
+DEFAULT partition). New months are created ahead of time at startup; closed
+months are dropped by the archival job (backend.utils.archive) once their
+rows are in cold storage. On SQLite or unconverted tables nothing happens.
+"""
+
+import logging
+from datetime import datetime
+from typing import Iterator
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLES = ("stock_movements", "waste_logs")
+
+# Months created in advance, so inserts never land in the default partition
+MONTHS_AHEAD = 2
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def iter_months(start: datetime, end: datetime) -> Iterator[datetime]:
+    """First day of every month from start's month up to (excluding) end's month"""
+    month = month_start(start)
+    while month < month_start(end):
+        yield month
+        month = add_months(month, 1)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_{month.year:04d}_{month.month:02d}"
+
+
+def is_partitioned(conn, table: str) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :table AND c.relnamespace = current_schema()::regnamespace"
+    ), {"table": table}).first() is not None
+
+
+def partition_exists(conn, table: str, month: datetime) -> bool:
+    return conn.execute(text(
+        "SELECT 1 FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST(:parent AS regclass) AND c.relname = :name"
+    ), {"parent": table, "name": partition_name(table, month)}).first() is not None
+
+
+def create_partition(conn, table: str, month: datetime) -> None:
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+    ))
+
+
+def drop_partition(conn, table: str, month: datetime) -> None:
+    """Detach and drop a month (its rows must already be archived)"""
+    name = partition_name(table, month)
+    conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+    conn.execute(text(f"DROP TABLE {name}"))
+
+
+def ensure_partitions(engine, months_ahead: int = MONTHS_AHEAD) -> None:
+    """Create the partitions for this month and the next `months_ahead` (idempotent)"""
+    if engine.dialect.name != "postgresql":
+        return
+
+    current = month_start(datetime.utcnow())
+    for table in PARTITIONED_TABLES:
+        with engine.connect() as conn:
+            if not is_partitioned(conn, table):
+                continue
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            try:
+                with engine.begin() as conn:
+                    create_partition(conn, table, month)
+            except Exception as e:
+                # Fails if rows for the month are already in the default partition;
+                # they stay readable there and the archival job removes them later
+                logger.warning(f"Could not create partition {partition_name(table, month)}: {e}")
@@ -0,0 +1,95 @@
+"""
+PDF text layer extraction
+Extracción de la capa de texto de PDFs digitales
+
+Digitally generated invoices already contain their text, so reading it is
+much faster and more exact than rasterizing and running tesseract. Words
+and their boxes come from poppler's pdftotext (installed with pdf2image's
+poppler-utils dependency) and are regrouped into visual rows, so a table
+line (description, quantity, unit price, total) comes back as one line
+even when the PDF stores its columns as separate text runs. Pages without
+a usable text layer (scans) are reported so only those get OCR.
+"""
+
+import html
+import logging
+import re
+import subprocess
+from typing import List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Pages with fewer visible characters than this are treated as scanned
+MIN_PAGE_CHARS = 20
+
+# Pages read from one PDF
+MAX_PDF_PAGES = 50
+
+_PAGE_RE = re.compile(r'<page\b[^>]*>(.*?)</page>', re.DOTALL)
+_WORD_RE = re.compile(
+    r'<word xMin="([\d.]+)" yMin="([\d.]+)" xMax="([\d.]+)" yMax="([\d.]+)">(.*?)</word>',
+    re.DOTALL
+)
+
+
+class Word(NamedTuple):
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+    text: str
+
+
+def parse_bbox_html(document: str) -> List[List[Word]]:
+    """Words per page from `pdftotext -bbox` output"""
+    return [
+        [
+            Word(float(x0), float(y0), float(x1), float(y1), html.unescape(text))
+            for x0, y0, x1, y1, text in _WORD_RE.findall(page)
+        ]
+        for page in _PAGE_RE.findall(document)
+    ]
+
+
+def words_to_lines(words: List[Word]) -> List[str]:
+    """Group words into rows (top to bottom) and each row left to right"""
+    rows: List[List[Word]] = []
+    row_top = row_bottom = 0.0
+    for word in sorted(words, key=lambda w: ((w.y0 + w.y1) / 2, w.x0)):
+        middle = (word.y0 + word.y1) / 2
+        # Same row when the word's vertical centre falls inside the current row
+        if rows and row_top <= middle <= row_bottom:
+            rows[-1].append(word)
+            row_top = min(row_top, word.y0)
+            row_bottom = max(row_bottom, word.y1)
+        else:
+            rows.append([word])
+            row_top, row_bottom = word.y0, word.y1
+    return [" ".join(w.text for w in sorted(row, key=lambda w: w.x0)) for row in rows]
+
+
+def pdf_text_pages(pdf_path: str, timeout: int = 15) -> Optional[List[Optional[str]]]:
+    """Text of each page, None for pages that need OCR.
+
+    Returns None when the text layer cannot be read at all (pdftotext
+    missing, damaged PDF or timeout).
+    """
+    try:
+        completed = subprocess.run(
+            ["pdftotext", "-bbox", "-enc", "UTF-8", "-l", str(MAX_PDF_PAGES), pdf_path, "-"],
+            capture_output=True,
+            timeout=timeout
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"PDF text layer not available: {str(e)}")
+        return None
+
+    if completed.returncode != 0:
+        logger.warning(f"pdftotext failed: {completed.stderr.decode(errors='replace').strip()}")
+        return None
+
+    pages = []
+    for words in parse_bbox_html(completed.stdout.decode("utf-8", errors="replace")):
+        visible = sum(len(w.text.strip()) for w in words)
+        pages.append("\n".join(words_to_lines(words)) if visible >= MIN_PAGE_CHARS else None)
+    return pages
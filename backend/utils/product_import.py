@@ -0,0 +1,277 @@
+"""
+Bulk product import (CSV / XLSX)
+Importación masiva de productos desde CSV o Excel
+"""
+
+import csv
+import io
+import logging
+from decimal import Decimal, InvalidOperation
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from backend.models.database import Category, Product, Provider, StockMovement
+from backend.models.enums import StockMovementType
+from backend.utils.product_search import normalize
+from backend.utils.valuation import ProductValue, record_product_changes
+
+logger = logging.getLogger(__name__)
+
+# Rows validated and inserted per transaction
+CHUNK_SIZE = 1000
+
+# Per-row errors returned in the response (the counters are always complete)
+MAX_REPORTED_ERRORS = 500
+
+# Accepted header names (normalized) -> product field
+HEADER_ALIASES = {
+    "name": "name", "nombre": "name", "producto": "name",
+    "description": "description", "descripcion": "description",
+    "barcode": "barcode", "codigo": "barcode", "ean": "barcode",
+    "unit": "unit", "unidad": "unit",
+    "current_stock": "current_stock", "stock": "current_stock",
+    "min_stock": "min_stock", "max_stock": "max_stock",
+    "cost_price": "cost_price", "costo": "cost_price", "cost": "cost_price",
+    "selling_price": "selling_price", "precio": "selling_price", "price": "selling_price",
+    "category": "category", "category_id": "category", "categoria": "category",
+    "provider": "provider", "provider_id": "provider", "proveedor": "provider",
+    "brand": "brand", "marca": "brand",
+    "variant_type": "variant_type", "size": "size", "presentation": "presentation",
+    "origin": "origin", "notes": "notes",
+}
+
+DECIMAL_FIELDS = {
+    "current_stock": Decimal('0.0'),
+    "min_stock": Decimal('0.0'),
+    "max_stock": Decimal('100.0'),
+    "cost_price": Decimal('0.0'),
+    "selling_price": Decimal('0.0'),
+}
+
+TEXT_LIMITS = {
+    "name": 100, "barcode": 50, "unit": 20, "brand": 100, "variant_type": 100,
+    "size": 50, "presentation": 100, "origin": 100,
+}
+
+TEXT_FIELDS = ("description", "barcode", "brand", "variant_type", "size", "presentation", "origin", "notes")
+
+
+def _parse_decimal(value: Any) -> Decimal:
+    """Parse numbers written as 1234.5, 1234,5 or 1.234,5"""
+    if isinstance(value, (int, float, Decimal)):
+        return Decimal(str(value))
+    text = str(value).strip().replace(" ", "")
+    if "," in text:
+        text = text.replace(".", "").replace(",", ".")
+    return Decimal(text)
+
+
+def _normalize_header(header: Any) -> Optional[str]:
+    key = normalize(str(header or "")).replace(" ", "_").replace("-", "_")
+    return HEADER_ALIASES.get(key)
+
+
+def iter_rows(file: BinaryIO, filename: str) -> Iterator[Dict[str, Any]]:
+    """Yield rows as {field: raw value} without loading the whole file"""
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            headers = [_normalize_header(h) for h in next(rows, ())]
+            for values in rows:
+                yield {h: v for h, v in zip(headers, values) if h}
+        finally:
+            workbook.close()
+    else:
+        text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+        sample = text.read(4096)
+        text.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(text, dialect)
+        headers = [_normalize_header(h) for h in next(reader, [])]
+        for values in reader:
+            yield {h: v for h, v in zip(headers, values) if h}
+
+
+class ProductImporter:
+    """Validate and insert product rows in chunked transactions"""
+
+    def __init__(self, db: Session, restaurant_id: int, user_id: int, dry_run: bool = False):
+        self.db = db
+        self.restaurant_id = restaurant_id
+        self.user_id = user_id
+        self.dry_run = dry_run
+
+        # Reference maps resolved once per import (name or id -> id)
+        self.categories = self._reference_map(Category)
+        self.providers = self._reference_map(Provider)
+        self.seen_barcodes = set()
+
+        self.total_rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def _reference_map(self, model) -> Dict[str, int]:
+        mapping = {}
+        for ref_id, name in self.db.query(model.id, model.name).all():
+            mapping[str(ref_id)] = ref_id
+            mapping[normalize(name)] = ref_id
+        return mapping
+
+    def _add_error(self, row_number: int, messages: List[str]) -> None:
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row_number, "errors": messages})
+
+    def _resolve(self, mapping: Dict[str, int], value: Any) -> Optional[int]:
+        if value is None:
+            return None
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return mapping.get(normalize(str(value)))
+
+    def _validate(self, raw: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        errors = []
+        data: Dict[str, Any] = {}
+
+        for field in ("name", "unit"):
+            value = str(raw.get(field) or "").strip()
+            if not value:
+                errors.append(f"{field} is required")
+            data[field] = value
+
+        for field in TEXT_FIELDS:
+            value = raw.get(field)
+            value = str(value).strip() if value not in (None, "") else None
+            data[field] = value
+
+        for field, limit in TEXT_LIMITS.items():
+            if data.get(field) and len(data[field]) > limit:
+                errors.append(f"{field} longer than {limit} characters")
+
+        for field, default in DECIMAL_FIELDS.items():
+            value = raw.get(field)
+            if value in (None, ""):
+                data[field] = default
+                continue
+            try:
+                data[field] = _parse_decimal(value)
+            except (InvalidOperation, ValueError):
+                errors.append(f"{field} is not a number: {value}")
+                continue
+            if data[field] < 0:
+                errors.append(f"{field} cannot be negative")
+
+        data["category_id"] = self._resolve(self.categories, raw.get("category"))
+        if data["category_id"] is None:
+            errors.append(f"Unknown category: {raw.get('category')}")
+
+        data["provider_id"] = self._resolve(self.providers, raw.get("provider"))
+        if data["provider_id"] is None:
+            errors.append(f"Unknown provider: {raw.get('provider')}")
+
+        barcode = data.get("barcode")
+        if barcode:
+            if barcode in self.seen_barcodes:
+                errors.append(f"Duplicate barcode in file: {barcode}")
+            self.seen_barcodes.add(barcode)
+
+        return (None if errors else data), errors
+
+    def run(self, rows: Iterator[Dict[str, Any]]) -> Dict[str, Any]:
+        chunk: List[Tuple[int, Dict[str, Any]]] = []
+        # Row 1 is the header
+        for row_number, raw in enumerate(rows, start=2):
+            if not any(v not in (None, "") for v in raw.values()):
+                continue
+            self.total_rows += 1
+            data, errors = self._validate(raw)
+            if errors:
+                self._add_error(row_number, errors)
+                continue
+            chunk.append((row_number, data))
+            if len(chunk) >= CHUNK_SIZE:
+                self._flush_chunk(chunk)
+                chunk = []
+
+        if chunk:
+            self._flush_chunk(chunk)
+
+        return {
+            "total_rows": self.total_rows,
+            "imported": self.imported,
+            "failed": self.failed,
+            "dry_run": self.dry_run,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors)
+        }
+
+    def _flush_chunk(self, chunk: List[Tuple[int, Dict[str, Any]]]) -> None:
+        # Barcodes are unique across the whole table: one lookup per chunk
+        barcodes = [data["barcode"] for _, data in chunk if data["barcode"]]
+        taken = set()
+        if barcodes:
+            taken = {b for (b,) in self.db.query(Product.barcode).filter(Product.barcode.in_(barcodes)).all()}
+
+        valid = []
+        for row_number, data in chunk:
+            if data["barcode"] and data["barcode"] in taken:
+                self._add_error(row_number, [f"Barcode already exists: {data['barcode']}"])
+            else:
+                valid.append((row_number, data))
+
+        if not valid:
+            return
+        if self.dry_run:
+            self.imported += len(valid)
+            return
+
+        try:
+            product_rows = [dict(data, restaurant_id=self.restaurant_id) for _, data in valid]
+            # Batched multi-row INSERT ... RETURNING, ids in parameter order
+            ids = self.db.execute(
+                insert(Product).returning(Product.id, sort_by_parameter_order=True),
+                product_rows
+            ).scalars().all()
+
+            movements = [
+                {
+                    "product_id": product_id,
+                    "movement_type": StockMovementType.IN,
+                    "quantity": data["current_stock"],
+                    "previous_stock": Decimal('0.0'),
+                    "new_stock": data["current_stock"],
+                    "reason": "Initial stock (import)",
+                    "user_id": self.user_id,
+                    "restaurant_id": self.restaurant_id,
+                }
+                for product_id, (_, data) in zip(ids, valid)
+                if data["current_stock"] > 0
+            ]
+            if movements:
+                self.db.execute(insert(StockMovement), movements)
+
+            record_product_changes(self.db, [
+                (None, ProductValue(
+                    self.restaurant_id, data["category_id"], data["provider_id"],
+                    data["current_stock"], data["cost_price"]
+                ))
+                for _, data in valid
+            ])
+
+            self.db.commit()
+            self.imported += len(valid)
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            logger.error(f"Product import chunk failed: {e}")
+            for row_number, _ in valid:
+                self._add_error(row_number, ["Database error while inserting this chunk"])
@@ -0,0 +1,193 @@
+"""
+Invoice line to product matching
+Emparejamiento de líneas de factura con productos (índice TF-IDF por restaurante)
+
+Each restaurant's products are indexed in memory as TF-IDF vectors over
+normalized word tokens and trigrams of the name (brand terms count half).
+All the lines of an invoice are resolved together: their query vectors
+are multiplied against the inverted index in one pass over the distinct
+features, so a term shared by several lines walks its posting list once.
+Scores are cosine similarities in [0, 1]; an exact (normalized) name
+match scores 1. The index is rebuilt lazily after product writes
+(product_search.invalidate) and at most every INDEX_TTL_SECONDS for
+writes made by other processes.
+"""
+
+import math
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+from backend.models.database import Product
+from backend.utils import product_search
+from backend.utils.product_search import normalize, trigrams
+
+# Candidates scoring below this are not returned
+MIN_MATCH_SCORE = 0.3
+
+# Best candidate accepted without confirmation (stock updates from invoices)
+AUTO_MATCH_SCORE = 0.6
+
+# Weight of brand terms relative to name terms
+BRAND_WEIGHT = 0.5
+
+# Terms in more than this share of a large catalog (e.g. "de", "pack") do
+# not generate candidates: their posting lists are long and their weight
+# small; they still count in the score of the candidates found otherwise
+COMMON_TERM_RATIO = 0.1
+COMMON_TERM_MIN_PRODUCTS = 200
+
+INDEX_TTL_SECONDS = product_search.INDEX_TTL_SECONDS
+
+
+def features(value: str) -> Dict[str, float]:
+    """Term frequencies of a normalized text: words (prefixed "w:") and trigrams"""
+    counts: Dict[str, float] = defaultdict(float)
+    for word in "".join(c if c.isalnum() else " " for c in value).split():
+        counts["w:" + word] += 1
+    for gram in trigrams(value):
+        counts[gram] += 1
+    return counts
+
+
+class ProductMatcher:
+    """TF-IDF index over one restaurant's product names and brands"""
+
+    def __init__(self, rows: Iterable):
+        self.built_at = time.monotonic()
+        self.names: Dict[int, str] = {}
+        self.by_name: Dict[str, int] = {}
+
+        documents: Dict[int, Dict[str, float]] = {}
+        for row in rows:
+            name = normalize(row.name)
+            document = features(name)
+            for term, count in features(normalize(row.brand)).items():
+                document[term] += BRAND_WEIGHT * count
+            documents[row.id] = document
+            self.names[row.id] = row.name
+            # Lowest id wins for duplicated names
+            self.by_name.setdefault(name, row.id)
+
+        document_frequency: Dict[str, int] = defaultdict(int)
+        for document in documents.values():
+            for term in document:
+                document_frequency[term] += 1
+
+        total = len(documents)
+        self.idf = {
+            term: math.log((1 + total) / (1 + frequency)) + 1
+            for term, frequency in document_frequency.items()
+        }
+        # Terms unknown to the catalog still count in a line's norm
+        self.unknown_idf = math.log(1 + total) + 1
+
+        self.common = {
+            term for term, frequency in document_frequency.items()
+            if total >= COMMON_TERM_MIN_PRODUCTS and frequency > COMMON_TERM_RATIO * total
+        }
+
+        # Normalized product vectors and the inverted index: term -> [(product_id, weight)]
+        self.vectors: Dict[int, Dict[str, float]] = {}
+        self.postings: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+        for product_id, document in documents.items():
+            weights = {term: count * self.idf[term] for term, count in document.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            vector = {term: weight / norm for term, weight in weights.items()}
+            self.vectors[product_id] = vector
+            for term, weight in vector.items():
+                self.postings[term].append((product_id, weight))
+
+    def _query_vector(self, text: str) -> Dict[str, float]:
+        weights = {
+            term: count * self.idf.get(term, self.unknown_idf)
+            for term, count in features(text).items()
+        }
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {term: weight / norm for term, weight in weights.items() if term in self.postings}
+
+    def match_lines(self, lines: Sequence[str], limit: int = 3) -> List[List[Tuple[int, float]]]:
+        """Ranked (product_id, score) candidates for each line, in input order"""
+        queries = [normalize(line) for line in lines]
+        distinct = list(dict.fromkeys(q for q in queries if q))
+        position = {query: i for i, query in enumerate(distinct)}
+
+        # Sparse (lines x terms) query matrix, stored by term; common terms
+        # are kept apart unless a line has nothing else
+        by_term: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+        common_terms: List[Dict[str, float]] = []
+        for i, query in enumerate(distinct):
+            vector = self._query_vector(query)
+            common = {term: w for term, w in vector.items() if term in self.common}
+            if len(common) == len(vector):
+                common = {}
+            common_terms.append(common)
+            for term, weight in vector.items():
+                if term not in common:
+                    by_term[term].append((i, weight))
+
+        # (lines x terms) . (terms x products): each posting list is read once
+        scores: List[Dict[int, float]] = [defaultdict(float) for _ in distinct]
+        for term, line_weights in by_term.items():
+            posting = self.postings[term]
+            for i, query_weight in line_weights:
+                line_scores = scores[i]
+                for product_id, product_weight in posting:
+                    line_scores[product_id] += query_weight * product_weight
+
+        # Common terms only complete the scores of the candidates found
+        for line_scores, common in zip(scores, common_terms):
+            if common:
+                for product_id in line_scores:
+                    vector = self.vectors[product_id]
+                    line_scores[product_id] += sum(w * vector.get(term, 0.0) for term, w in common.items())
+
+        ranked: List[List[Tuple[int, float]]] = []
+        for i, query in enumerate(distinct):
+            line_scores = scores[i]
+            exact = self.by_name.get(query)
+            if exact is not None:
+                line_scores[exact] = 1.0
+            candidates = sorted(
+                ((product_id, min(score, 1.0)) for product_id, score in line_scores.items() if score >= MIN_MATCH_SCORE),
+                key=lambda item: (-item[1], item[0])
+            )
+            ranked.append(candidates[:limit])
+
+        return [ranked[position[query]] if query else [] for query in queries]
+
+
+_matchers: Dict[int, ProductMatcher] = {}
+_matchers_lock = threading.Lock()
+
+
+def invalidate(restaurant_id: Optional[int]) -> None:
+    with _matchers_lock:
+        _matchers.pop(restaurant_id, None)
+
+
+product_search.on_invalidate(invalidate)
+
+
+def get_matcher(db: Session, restaurant_id: int) -> ProductMatcher:
+    """The restaurant's matching index, rebuilt when its products changed"""
+    with _matchers_lock:
+        matcher = _matchers.get(restaurant_id)
+    if matcher is not None and time.monotonic() - matcher.built_at < INDEX_TTL_SECONDS:
+        return matcher
+
+    rows = db.query(Product.id, Product.name, Product.brand).filter(
+        Product.restaurant_id == restaurant_id
+    ).all()
+    matcher = ProductMatcher(rows)
+
+    with _matchers_lock:
+        _matchers[restaurant_id] = matcher
+    return matcher
+
+
+def match_lines(db: Session, restaurant_id: int, lines: Sequence[str], limit: int = 3) -> List[List[Tuple[int, float]]]:
+    return get_matcher(db, restaurant_id).match_lines(lines, limit)
@@ -0,0 +1,207 @@
+"""
+Product search engine
+Motor de búsqueda de productos (tolerante a errores tipográficos)
+
+PostgreSQL: pg_trgm GIN index over a search document (name, brand, barcode
+and variant fields), queried with the word-similarity operator.
+SQLite / no pg_trgm: in-memory trigram inverted index per tenant, rebuilt
+lazily after product writes.
+"""
+
+import logging
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, func, literal_column, or_, text
+from sqlalchemy.orm import Session
+
+from backend.models.database import Product
+
+logger = logging.getLogger(__name__)
+
+# Searchable columns, in the order they are concatenated into the document
+SEARCH_FIELDS = ("name", "brand", "barcode", "variant_type", "size", "presentation", "origin")
+
+# Expression shared by the GIN index and the queries (must match exactly)
+SEARCH_DOCUMENT_SQL = "lower(" + " || ' ' || ".join(
+    f"coalesce({field}, '')" for field in SEARCH_FIELDS
+) + ")"
+
+TRIGRAM_INDEX_NAME = "ix_products_search_trgm"
+
+# Minimum share of query trigrams a product must contain to be a match
+MIN_SCORE = 0.5
+
+# Safety net for writes made by other processes (in-memory backend only)
+INDEX_TTL_SECONDS = 300
+
+# Set by setup_product_search() when the pg_trgm index is usable
+_use_pg_trgm = False
+
+
+def setup_product_search(engine) -> None:
+    """Create the trigram extension and index on PostgreSQL (idempotent)"""
+    global _use_pg_trgm
+
+    if engine.dialect.name != "postgresql":
+        _use_pg_trgm = False
+        return
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX_NAME} "
+                f"ON products USING gin (({SEARCH_DOCUMENT_SQL}) gin_trgm_ops)"
+            ))
+        _use_pg_trgm = True
+    except Exception as e:
+        # Without pg_trgm (e.g. missing privileges) fall back to the in-memory index
+        logger.warning(f"pg_trgm search index unavailable, using in-memory index: {e}")
+        _use_pg_trgm = False
+
+
+def normalize(value: Optional[str]) -> str:
+    """Lowercase, strip accents and collapse whitespace"""
+    if not value:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", value)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.lower().split())
+
+
+def trigrams(value: str) -> Set[str]:
+    """Word trigrams in the pg_trgm style (each word padded with two leading blanks and one trailing)"""
+    grams = set()
+    for word in "".join(c if c.isalnum() else " " for c in value).split():
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+class TenantSearchIndex:
+    """Trigram inverted index over one restaurant's products"""
+
+    def __init__(self, rows):
+        self.built_at = time.monotonic()
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        self.name_grams: Dict[int, Set[str]] = {}
+        self.names: Dict[int, str] = {}
+        self.barcodes: Dict[str, int] = {}
+
+        for row in rows:
+            document = normalize(" ".join(getattr(row, field) or "" for field in SEARCH_FIELDS))
+            for gram in trigrams(document):
+                self.postings[gram].append(row.id)
+
+            name = normalize(row.name)
+            self.names[row.id] = name
+            self.name_grams[row.id] = trigrams(name)
+            if row.barcode:
+                self.barcodes[row.barcode.strip().lower()] = row.id
+
+    def search(self, term: str, limit: Optional[int]) -> List[Tuple[int, float]]:
+        """Ranked (product_id, score) matches for a search term (all of them when limit is None)"""
+        query = normalize(term)
+        if not query:
+            return []
+
+        scores: Dict[int, float] = {}
+
+        barcode_match = self.barcodes.get(query)
+        if barcode_match is not None:
+            scores[barcode_match] = 2.0
+
+        query_grams = trigrams(query)
+        if query_grams:
+            # Count shared trigrams only for products that have any of them
+            overlap: Dict[int, int] = defaultdict(int)
+            for gram in query_grams:
+                for product_id in self.postings.get(gram, ()):
+                    overlap[product_id] += 1
+
+            total = len(query_grams)
+            for product_id, shared in overlap.items():
+                score = shared / total
+                if score < MIN_SCORE:
+                    continue
+                # Prefer hits on the name and names that start with the term
+                name_shared = len(query_grams & self.name_grams[product_id])
+                score = 0.6 * score + 0.4 * (name_shared / total)
+                if self.names[product_id].startswith(query):
+                    score += 0.2
+                scores[product_id] = max(scores.get(product_id, 0.0), score)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.names.get(item[0], "")))
+        return ranked[:limit]
+
+
+_indexes: Dict[int, TenantSearchIndex] = {}
+_indexes_lock = threading.Lock()
+
+# Other per-tenant product indexes dropped together with this one
+_invalidate_listeners: List[Callable[[Optional[int]], None]] = []
+
+
+def on_invalidate(listener: Callable[[Optional[int]], None]) -> None:
+    _invalidate_listeners.append(listener)
+
+
+def invalidate(restaurant_id: Optional[int]) -> None:
+    """Drop a tenant's in-memory indexes after its products change"""
+    with _indexes_lock:
+        _indexes.pop(restaurant_id, None)
+    for listener in _invalidate_listeners:
+        listener(restaurant_id)
+
+
+def _get_tenant_index(db: Session, restaurant_id: int) -> TenantSearchIndex:
+    with _indexes_lock:
+        index = _indexes.get(restaurant_id)
+    if index is not None and time.monotonic() - index.built_at < INDEX_TTL_SECONDS:
+        return index
+
+    columns = [Product.id] + [getattr(Product, field) for field in SEARCH_FIELDS]
+    rows = db.query(*columns).filter(Product.restaurant_id == restaurant_id).all()
+    index = TenantSearchIndex(rows)
+
+    with _indexes_lock:
+        _indexes[restaurant_id] = index
+    return index
+
+
+def search_products(db: Session, restaurant_id: int, term: str, limit: Optional[int] = 20) -> List[Tuple[int, float]]:
+    """Ranked, typo-tolerant (product_id, score) matches within a restaurant"""
+    term = (term or "").strip()
+    if not term:
+        return []
+
+    if _use_pg_trgm:
+        document = literal_column(SEARCH_DOCUMENT_SQL)
+        query = term.lower()
+        score = func.word_similarity(query, document)
+        rows = db.query(Product.id, score.label("score")).filter(
+            Product.restaurant_id == restaurant_id,
+            or_(document.op("%>")(query), Product.barcode == term)
+        ).order_by(score.desc(), Product.name).limit(limit).all()
+        return [(row.id, float(row.score)) for row in rows]
+
+    return _get_tenant_index(db, restaurant_id).search(term, limit)
+
+
+def search_filter(db: Session, restaurant_id: int, term: str):
+    """SQL criterion restricting a Product query to every search match"""
+    if _use_pg_trgm:
+        query = term.strip().lower()
+        return or_(literal_column(SEARCH_DOCUMENT_SQL).op("%>")(query), Product.barcode == term.strip())
+
+    # No limit: the caller paginates over the whole match set. The ids are
+    # rendered inline so a large set does not hit the bound parameter limit
+    matches = search_products(db, restaurant_id, term, limit=None)
+    return Product.id.in_(bindparam(
+        "search_ids", [product_id for product_id, _ in matches], expanding=True, literal_execute=True
+    ))
@@ -0,0 +1,173 @@
+"""
+Recipe (BOM) explosion engine
+Motor de explosión de recetas (consumo de ingredientes por plato vendido)
+
+Every recipe of a restaurant is flattened once into its ingredient vector:
+product quantities per portion sold, with sub-recipes expanded and scaled
+by their yield. The vectors are stored as the rows of a sparse matrix
+(CSR: only non-zero entries), so turning a batch of sold dishes into
+per-product depletion is one sparse vector-matrix product, independent of
+how deep the recipes nest. The compiled matrix is cached per restaurant and
+tied to the recipe data version: edits in this process drop it at once and
+edits made elsewhere are noticed by a version check at most every
+REVALIDATE_SECONDS.
+"""
+
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from backend.models.database import Recipe, RecipeComponent
+from backend.utils.data_version import get_versions, on_bump, recipe_scope
+
+# How long a compiled matrix is trusted before the recipe version is checked
+REVALIDATE_SECONDS = 5
+
+# Stock quantities are stored with 3 decimals
+QUANTITY_STEP = Decimal("0.001")
+
+# (product_id, sub_recipe_id, quantity) per component
+Component = Tuple[Optional[int], Optional[int], Decimal]
+
+
+class RecipeCycleError(ValueError):
+    """A recipe contains itself through its sub-recipes"""
+
+
+def flatten_recipes(
+    yields: Mapping[int, Decimal],
+    components: Mapping[int, List[Component]]
+) -> Dict[int, Dict[int, Decimal]]:
+    """Ingredient vector per recipe: {recipe_id: {product_id: quantity per portion}}"""
+    flat: Dict[int, Dict[int, Decimal]] = {}
+    in_progress = set()
+
+    def expand(recipe_id: int) -> Dict[int, Decimal]:
+        if recipe_id in flat:
+            return flat[recipe_id]
+        if recipe_id in in_progress:
+            raise RecipeCycleError(f"Recipe {recipe_id} contains itself")
+        in_progress.add(recipe_id)
+
+        portion_yield = yields[recipe_id] or Decimal(1)
+        vector: Dict[int, Decimal] = defaultdict(Decimal)
+        for product_id, sub_recipe_id, quantity in components.get(recipe_id, ()):
+            if product_id is not None:
+                vector[product_id] += quantity / portion_yield
+            else:
+                for sub_product_id, sub_quantity in expand(sub_recipe_id).items():
+                    vector[sub_product_id] += quantity * sub_quantity / portion_yield
+
+        in_progress.discard(recipe_id)
+        flat[recipe_id] = {pid: q for pid, q in vector.items() if q != 0}
+        return flat[recipe_id]
+
+    for recipe_id in yields:
+        expand(recipe_id)
+    return flat
+
+
+class IngredientMatrix:
+    """Flattened recipes of one restaurant as a CSR sparse matrix (recipes x products)"""
+
+    def __init__(self, flat: Mapping[int, Mapping[int, Decimal]], codes: Mapping[str, int], version: int = 0):
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.codes = dict(codes)
+        self.row_of: Dict[int, int] = {}
+        self.indptr: List[int] = [0]
+        self.indices: List[int] = []
+        self.data: List[Decimal] = []
+        for recipe_id, vector in flat.items():
+            self.row_of[recipe_id] = len(self.indptr) - 1
+            for product_id in sorted(vector):
+                self.indices.append(product_id)
+                self.data.append(vector[product_id])
+            self.indptr.append(len(self.indices))
+
+    def __contains__(self, recipe_id: int) -> bool:
+        return recipe_id in self.row_of
+
+    def row(self, recipe_id: int) -> Dict[int, Decimal]:
+        """Ingredient vector of one recipe (per portion)"""
+        i = self.row_of[recipe_id]
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return dict(zip(self.indices[start:end], self.data[start:end]))
+
+    def multiply(self, sold: Mapping[int, Decimal]) -> Dict[int, Decimal]:
+        """Depletion per product for {recipe_id: portions sold}; unknown recipes raise KeyError"""
+        result: Dict[int, Decimal] = defaultdict(Decimal)
+        indptr, indices, data = self.indptr, self.indices, self.data
+        for recipe_id, portions in sold.items():
+            i = self.row_of[recipe_id]
+            for k in range(indptr[i], indptr[i + 1]):
+                result[indices[k]] += portions * data[k]
+        return {
+            product_id: quantity.quantize(QUANTITY_STEP, rounding=ROUND_HALF_UP)
+            for product_id, quantity in result.items()
+        }
+
+
+def load_recipes(db: Session, restaurant_id: int) -> Tuple[Dict[int, Decimal], Dict[int, List[Component]], Dict[str, int]]:
+    """Yields, components and POS codes of every recipe of a restaurant (two queries)"""
+    yields = {}
+    codes = {}
+    for recipe_id, code, portion_yield in db.query(Recipe.id, Recipe.code, Recipe.yield_quantity).filter(
+        Recipe.restaurant_id == restaurant_id
+    ).all():
+        yields[recipe_id] = Decimal(portion_yield)
+        if code:
+            codes[code] = recipe_id
+
+    components: Dict[int, List[Component]] = defaultdict(list)
+    for recipe_id, product_id, sub_recipe_id, quantity in db.query(
+        RecipeComponent.recipe_id, RecipeComponent.product_id,
+        RecipeComponent.sub_recipe_id, RecipeComponent.quantity
+    ).join(Recipe, Recipe.id == RecipeComponent.recipe_id).filter(
+        Recipe.restaurant_id == restaurant_id
+    ).all():
+        components[recipe_id].append((product_id, sub_recipe_id, Decimal(quantity)))
+
+    return yields, components, codes
+
+
+_matrices: Dict[int, IngredientMatrix] = {}
+_matrices_lock = threading.Lock()
+
+
+def invalidate(restaurant_id: Optional[int]) -> None:
+    with _matrices_lock:
+        _matrices.pop(restaurant_id, None)
+
+
+def _on_bump(scope: str) -> None:
+    if scope.startswith("recipes:"):
+        invalidate(int(scope.split(":", 1)[1]))
+
+
+on_bump(_on_bump)
+
+
+def get_matrix(db: Session, restaurant_id: int) -> IngredientMatrix:
+    """Compiled recipes of a restaurant, rebuilt only when they changed"""
+    now = time.monotonic()
+    with _matrices_lock:
+        matrix = _matrices.get(restaurant_id)
+        if matrix is not None and now - matrix.checked_at < REVALIDATE_SECONDS:
+            return matrix
+
+    scope = recipe_scope(restaurant_id)
+    version = get_versions(db, [scope])[scope]
+    if matrix is not None and matrix.version == version:
+        matrix.checked_at = now
+        return matrix
+
+    yields, components, codes = load_recipes(db, restaurant_id)
+    matrix = IngredientMatrix(flatten_recipes(yields, components), codes, version)
+    with _matrices_lock:
+        _matrices[restaurant_id] = matrix
+    return matrix
@@ -0,0 +1,86 @@
+"""
+Process-wide cache for global reference tables (categories, providers)
+Caché en memoria de tablas de referencia globales (categorías, proveedores)
+
+Both tables are small and shared by every restaurant, so each process keeps
+a snapshot of them and hot paths resolve names from a dict instead of
+joining or lazy-loading. A snapshot is tied to the table's data version
+(see data_version): writes in this process drop it right away, and writes
+made by other processes are picked up at the next version check.
+"""
+
+import threading
+import time
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional
+
+from sqlalchemy.orm import Session
+
+from backend.models.database import Category, Provider
+from backend.utils.data_version import CATEGORIES_SCOPE, PROVIDERS_SCOPE, get_versions
+
+# How long a snapshot is trusted before its version is checked again
+REVALIDATE_SECONDS = 5
+
+# Full reload even if the version did not change (writes that bypass the API)
+MAX_AGE_SECONDS = 600
+
+
+class ReferenceTable:
+    """Versioned in-memory snapshot of one reference table"""
+
+    def __init__(self, model, scope: str, fields: List[str]):
+        self.model = model
+        self.scope = scope
+        self.fields = fields
+        self._lock = threading.Lock()
+        self._rows: Optional[Mapping[int, Dict[str, Any]]] = None
+        self._version: Optional[int] = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._rows = None
+
+    def rows(self, db: Session) -> Mapping[int, Dict[str, Any]]:
+        """All rows keyed by id (read-only)"""
+        now = time.monotonic()
+        with self._lock:
+            rows, version = self._rows, self._version
+            fresh = rows is not None and now - self._loaded_at < MAX_AGE_SECONDS
+            if fresh and now - self._checked_at < REVALIDATE_SECONDS:
+                return rows
+
+        current_version = get_versions(db, [self.scope])[self.scope]
+        if fresh and current_version == version:
+            with self._lock:
+                self._checked_at = now
+            return rows
+
+        columns = [getattr(self.model, field) for field in self.fields]
+        loaded = {
+            row.id: dict(zip(self.fields, row))
+            for row in db.query(*columns).order_by(self.model.id).all()
+        }
+        rows = MappingProxyType(loaded)
+
+        with self._lock:
+            self._rows = rows
+            self._version = current_version
+            self._loaded_at = self._checked_at = now
+        return rows
+
+    def active(self, db: Session) -> List[Dict[str, Any]]:
+        return [row for row in self.rows(db).values() if row["is_active"]]
+
+    def names(self, db: Session) -> Dict[int, str]:
+        return {row_id: row["name"] for row_id, row in self.rows(db).items()}
+
+    def name(self, db: Session, row_id: Optional[int], default: str = "Unknown") -> str:
+        row = self.rows(db).get(row_id)
+        return row["name"] if row else default
+
+
+categories = ReferenceTable(Category, CATEGORIES_SCOPE, ["id", "name", "type", "icon", "is_active"])
+providers = ReferenceTable(Provider, PROVIDERS_SCOPE, ["id", "name", "contact_person", "is_active"])
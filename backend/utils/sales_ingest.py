@@ -0,0 +1,313 @@
+"""
+POS sales ingestion
+Ingesta de ventas del POS (consumo por tickets)
+
+A batch of sale lines is validated, grouped by ticket and applied in one
+transaction: tickets are claimed with INSERT ... ON CONFLICT DO NOTHING on
+(restaurant_id, ticket_id), so a ticket is applied exactly once even when
+the POS resends it or two batches race; the lines of the claimed tickets
+are summed per product (dishes are exploded into ingredients through the
+recipe matrix) and each product gets a single stock delta and a single OUT
+movement, inserted in bulk.
+"""
+
+import json
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from backend.models.database import Product, SaleTicket, StockMovement
+from backend.models.enums import StockMovementType
+from backend.utils.recipes import get_matrix
+from backend.utils.stock import apply_stock_delta
+
+# Lines accepted per request
+MAX_LINES = 50000
+
+# Per-line errors returned in the response (the counters are always complete)
+MAX_REPORTED_ERRORS = 500
+
+# Rows per IN (...) lookup and per INSERT batch
+LOOKUP_CHUNK_SIZE = 1000
+
+UNRESOLVED_MESSAGES = {
+    "product": "Product not found: {}",
+    "barcode": "Unknown barcode: {}",
+    "recipe": "Recipe not found: {}",
+    "code": "Unknown item code: {}",
+}
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines")
+
+
+def parse_sale_lines(body: bytes, content_type: Optional[str]) -> List[Any]:
+    """Decode a JSON array (or {"lines": [...]}) or NDJSON body; numbers stay exact"""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in NDJSON_CONTENT_TYPES:
+        lines = [json.loads(line, parse_float=Decimal) for line in body.splitlines() if line.strip()]
+    else:
+        data = json.loads(body, parse_float=Decimal)
+        lines = data.get("lines") if isinstance(data, dict) else data
+        if not isinstance(lines, list):
+            raise ValueError("Expected a JSON array of sale lines")
+
+    if len(lines) > MAX_LINES:
+        raise ValueError(f"Too many lines (max {MAX_LINES})")
+    return lines
+
+
+def _chunks(values: List[Any]):
+    for i in range(0, len(values), LOOKUP_CHUNK_SIZE):
+        yield values[i:i + LOOKUP_CHUNK_SIZE]
+
+
+class SalesIngestor:
+    """Validate sale lines and apply them as per-product OUT movements"""
+
+    def __init__(self, db: Session, restaurant_id: int, user_id: int):
+        self.db = db
+        self.restaurant_id = restaurant_id
+        self.user_id = user_id
+        # Shared by every ticket claimed in this batch and used as the movements' reference_id
+        self.batch_id = f"POS-{uuid.uuid4().hex[:12]}"
+
+        self.total_lines = 0
+        self.failed_lines = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def _add_error(self, line_number: int, ticket_id: Optional[str], message: str) -> None:
+        self.failed_lines += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_number, "ticket_id": ticket_id, "error": message})
+
+    def _validate(self, line: Any) -> Tuple[Optional[Tuple], Optional[str]]:
+        """Return ((ticket_id, kind, reference, quantity, sold_at), None) or (None, error).
+
+        kind is "product", "barcode", "recipe" or "code" (the dish's POS code).
+        """
+        if not isinstance(line, dict):
+            return None, "Line must be an object"
+
+        ticket_id = line.get("ticket_id")
+        if ticket_id in (None, "") or isinstance(ticket_id, (bool, dict, list)):
+            return None, "ticket_id is required"
+        ticket_id = str(ticket_id)
+        if len(ticket_id) > 64:
+            return None, "ticket_id longer than 64 characters"
+
+        if line.get("product_id") is not None:
+            kind, reference = "product", line["product_id"]
+        elif line.get("recipe_id") is not None:
+            kind, reference = "recipe", line["recipe_id"]
+        elif line.get("barcode") not in (None, ""):
+            kind, reference = "barcode", str(line["barcode"])
+        elif line.get("item_code") not in (None, ""):
+            kind, reference = "code", str(line["item_code"])
+        else:
+            return None, "product_id, barcode, recipe_id or item_code is required"
+        if kind in ("product", "recipe") and (isinstance(reference, bool) or not isinstance(reference, int)):
+            return None, f"{kind}_id must be an integer"
+
+        quantity = line.get("quantity")
+        if isinstance(quantity, bool) or not isinstance(quantity, (int, Decimal, str)):
+            return None, "quantity must be a number"
+        try:
+            quantity = Decimal(quantity.strip() if isinstance(quantity, str) else quantity)
+        except InvalidOperation:
+            return None, f"quantity is not a number: {quantity}"
+        if not quantity.is_finite() or quantity == 0:
+            return None, "quantity must be a non-zero number (negative for returns)"
+
+        sold_at = line.get("sold_at")
+        if sold_at is not None:
+            try:
+                sold_at = datetime.fromisoformat(str(sold_at)).replace(tzinfo=None)
+            except ValueError:
+                return None, f"Invalid sold_at: {sold_at}"
+
+        return (ticket_id, kind, reference, quantity, sold_at), None
+
+    def _known_products(self, product_ids: Set[int], barcodes: Set[str]) -> Tuple[Set[int], Dict[str, int]]:
+        """Tenant's products among the referenced ids, and barcode -> id"""
+        known = set()
+        for chunk in _chunks(list(product_ids)):
+            known.update(self.db.execute(
+                select(Product.id).where(Product.restaurant_id == self.restaurant_id, Product.id.in_(chunk))
+            ).scalars())
+
+        by_barcode = {}
+        for chunk in _chunks(list(barcodes)):
+            by_barcode.update(self.db.execute(
+                select(Product.barcode, Product.id).where(
+                    Product.restaurant_id == self.restaurant_id,
+                    Product.barcode.in_(chunk)
+                )
+            ).tuples().all())
+        return known, by_barcode
+
+    def _claim_tickets(self, tickets: Dict[str, Dict[str, Any]]) -> Set[str]:
+        """Insert the tickets not seen before; returns the ids this batch now owns"""
+        rows = [
+            {
+                "restaurant_id": self.restaurant_id,
+                "ticket_id": ticket_id,
+                "batch_id": self.batch_id,
+                "line_count": len(ticket["lines"]),
+                "sold_at": ticket["sold_at"],
+            }
+            for ticket_id, ticket in tickets.items()
+        ]
+
+        dialect = self.db.get_bind().dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+            stmt = dialect_insert(SaleTicket).on_conflict_do_nothing(
+                index_elements=["restaurant_id", "ticket_id"]
+            ).returning(SaleTicket.ticket_id)
+            claimed = set()
+            for chunk in _chunks(rows):
+                claimed.update(self.db.execute(stmt, chunk).scalars())
+            return claimed
+
+        # Other databases: skip known tickets; a concurrent duplicate fails on the unique constraint
+        seen = set()
+        for chunk in _chunks(list(tickets)):
+            seen.update(self.db.execute(
+                select(SaleTicket.ticket_id).where(
+                    SaleTicket.restaurant_id == self.restaurant_id,
+                    SaleTicket.ticket_id.in_(chunk)
+                )
+            ).scalars())
+        new_rows = [row for row in rows if row["ticket_id"] not in seen]
+        if new_rows:
+            self.db.execute(insert(SaleTicket), new_rows)
+        return {row["ticket_id"] for row in new_rows}
+
+    def run(self, lines: List[Any]) -> Dict[str, Any]:
+        # Validate and group by ticket; a ticket with any bad line is rejected
+        # whole (and not claimed), so the POS can fix and resend it
+        tickets: Dict[str, Dict[str, Any]] = {}
+        rejected: Set[str] = set()
+        product_ids: Set[int] = set()
+        barcodes: Set[str] = set()
+        has_dishes = False
+
+        for line_number, line in enumerate(lines, start=1):
+            self.total_lines += 1
+            parsed, error = self._validate(line)
+            if error:
+                ticket_id = line.get("ticket_id") if isinstance(line, dict) else None
+                self._add_error(line_number, ticket_id, error)
+                if ticket_id not in (None, ""):
+                    rejected.add(str(ticket_id))
+                continue
+
+            ticket_id, kind, reference, quantity, sold_at = parsed
+            ticket = tickets.setdefault(ticket_id, {"lines": [], "sold_at": sold_at})
+            ticket["lines"].append((line_number, kind, reference, quantity))
+            if kind == "product":
+                product_ids.add(reference)
+            elif kind == "barcode":
+                barcodes.add(reference)
+            else:
+                has_dishes = True
+
+        known, by_barcode = self._known_products(product_ids, barcodes)
+        matrix = get_matrix(self.db, self.restaurant_id) if has_dishes else None
+
+        # Resolve every line to a product or a recipe of this restaurant
+        for ticket_id, ticket in tickets.items():
+            resolved = []
+            for line_number, kind, reference, quantity in ticket["lines"]:
+                if kind == "product":
+                    target = reference if reference in known else None
+                elif kind == "barcode":
+                    target = by_barcode.get(reference)
+                elif kind == "recipe":
+                    target = reference if reference in matrix else None
+                else:
+                    target = matrix.codes.get(reference)
+                if target is None:
+                    self._add_error(line_number, ticket_id, UNRESOLVED_MESSAGES[kind].format(reference))
+                    rejected.add(ticket_id)
+                    continue
+                resolved.append((kind in ("recipe", "code"), target, quantity))
+            ticket["lines"] = resolved
+
+        for ticket_id in rejected:
+            tickets.pop(ticket_id, None)
+
+        claimed = self._claim_tickets(tickets) if tickets else set()
+
+        # One delta per product over all claimed tickets; dishes are exploded
+        # into their ingredients with one sparse product against the recipe matrix
+        sold: Dict[int, Decimal] = defaultdict(Decimal)
+        dishes: Dict[int, Decimal] = defaultdict(Decimal)
+        applied_lines = 0
+        for ticket_id in claimed:
+            for is_dish, target, quantity in tickets[ticket_id]["lines"]:
+                if is_dish:
+                    dishes[target] += quantity
+                else:
+                    sold[target] += quantity
+                applied_lines += 1
+        if dishes:
+            for product_id, quantity in matrix.multiply(dishes).items():
+                sold[product_id] += quantity
+
+        movements = []
+        negative_stock = []
+        # Fixed id order, so concurrent batches lock products in the same order
+        for product_id in sorted(sold):
+            if sold[product_id] == 0:
+                continue
+            change = apply_stock_delta(
+                self.db, product_id, -sold[product_id],
+                restaurant_id=self.restaurant_id,
+                record_movement=False
+            )
+            if change is None:
+                continue
+            if change.new_stock < 0:
+                negative_stock.append(product_id)
+            movements.append({
+                "product_id": product_id,
+                "movement_type": StockMovementType.OUT if sold[product_id] > 0 else StockMovementType.IN,
+                "quantity": abs(sold[product_id]),
+                "previous_stock": change.previous_stock,
+                "new_stock": change.new_stock,
+                "reason": "POS sales",
+                "reference_id": self.batch_id,
+                "user_id": self.user_id,
+                "restaurant_id": self.restaurant_id,
+            })
+
+        if movements:
+            self.db.execute(insert(StockMovement), movements)
+        self.db.commit()
+
+        return {
+            "batch_id": self.batch_id,
+            "tickets": {
+                "received": len(tickets) + len(rejected),
+                "applied": len(claimed),
+                "duplicate": len(tickets) - len(claimed),
+                "rejected": len(rejected),
+            },
+            "lines": {
+                "received": self.total_lines,
+                "applied": applied_lines,
+                "failed": self.failed_lines,
+            },
+            "products_updated": len(movements),
+            # Sales are never refused for lack of stock; these need a count
+            "negative_stock": negative_stock,
+            "errors": self.errors,
+            "errors_truncated": self.failed_lines > len(self.errors),
+        }
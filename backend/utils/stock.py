@@ -0,0 +1,178 @@
+"""
+Stock mutation service
+Servicio de movimientos de stock (actualizaciones atómicas en SQL)
+
+All stock changes go through here. Deltas are computed by the database in
+a single UPDATE ... RETURNING, so there is no read-modify-write window in
+Python and the row lock is taken by that one statement; absolute levels are
+written with compare-and-swap on the product version. The StockMovement and
+the inventory valuation delta are written from the levels the database
+confirmed.
+"""
+
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from backend.models.database import Product, StockMovement
+from backend.models.enums import StockMovementType
+from backend.utils.concurrency import MAX_CAS_ATTEMPTS, VersionConflictError, compare_and_swap
+from backend.utils.valuation import (
+    PRODUCT_VALUE_COLUMNS, product_value, record_product_change, record_stock_delta
+)
+
+
+class StockChange(NamedTuple):
+    product_id: int
+    previous_stock: Decimal
+    new_stock: Decimal
+
+
+class NegativeStockError(ValueError):
+    """The change would leave the product below zero"""
+
+
+def _supports_returning(db: Session) -> bool:
+    return db.get_bind().dialect.update_returning
+
+
+def _product_filter(product_id: int, restaurant_id: Optional[int]):
+    criteria = [Product.id == product_id]
+    if restaurant_id is not None:
+        criteria.append(Product.restaurant_id == restaurant_id)
+    return criteria
+
+
+def apply_stock_delta(
+    db: Session,
+    product_id: int,
+    delta: Decimal,
+    *,
+    restaurant_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    reason: Optional[str] = None,
+    reference_id: Optional[str] = None,
+    movement_type: Optional[StockMovementType] = None,
+    allow_negative: bool = True,
+    record_movement: bool = True,
+    **values
+) -> Optional[StockChange]:
+    """Add `delta` to a product's stock atomically.
+
+    Returns the previous and new levels, or None if the product does not
+    exist (or belongs to another restaurant). With allow_negative=False the
+    guard is part of the UPDATE and NegativeStockError is raised when it
+    fails. Extra keyword arguments are set on the row in the same statement
+    (e.g. last_purchase_date). Nothing is committed.
+    """
+    delta = Decimal(str(delta))
+    criteria = _product_filter(product_id, restaurant_id)
+    if not allow_negative:
+        criteria.append(Product.current_stock + delta >= 0)
+
+    # A pure delta never conflicts: the database serializes it on the row,
+    # so it only bumps the version for optimistic writers
+    stmt = update(Product).where(*criteria).values(
+        current_stock=Product.current_stock + delta,
+        version=Product.version + 1,
+        **values
+    )
+
+    if _supports_returning(db):
+        row = db.execute(stmt.returning(*PRODUCT_VALUE_COLUMNS)).first()
+    else:
+        # Emulation: the UPDATE holds the row's write lock, so reading it
+        # back in the same transaction returns our own result
+        matched = db.execute(stmt, execution_options={"synchronize_session": False}).rowcount
+        row = None
+        if matched:
+            row = db.execute(select(*PRODUCT_VALUE_COLUMNS).where(Product.id == product_id)).first()
+
+    if row is None:
+        if not allow_negative and db.execute(
+            select(Product.id).where(*_product_filter(product_id, restaurant_id))
+        ).first():
+            raise NegativeStockError(f"Stock cannot be negative for product {product_id}")
+        return None
+
+    new_stock = row.current_stock
+    change = StockChange(product_id, new_stock - delta, new_stock)
+    record_stock_delta(db, product_value(row), delta)
+    if record_movement and delta != 0:
+        _add_movement(db, change, restaurant_id, user_id, reason, reference_id, movement_type)
+    return change
+
+
+def set_stock_level(
+    db: Session,
+    product_id: int,
+    new_stock: Decimal,
+    *,
+    restaurant_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    reason: Optional[str] = None,
+    reference_id: Optional[str] = None,
+    expected_version: Optional[int] = None,
+    record_movement: bool = True,
+    **values
+) -> Optional[StockChange]:
+    """Set a product's stock to an absolute level (manual corrections).
+
+    Compare-and-swap on the product version, without locking: the level read
+    is the previous stock only if nobody wrote in between. With
+    `expected_version` (the version the client edited) a concurrent write
+    raises VersionConflictError; without it the write is retried on a fresh
+    read up to MAX_CAS_ATTEMPTS times.
+    """
+    new_stock = Decimal(str(new_stock))
+    if new_stock < 0:
+        raise NegativeStockError("Stock cannot be negative")
+
+    criteria = _product_filter(product_id, restaurant_id)
+    for _ in range(MAX_CAS_ATTEMPTS):
+        row = db.execute(select(Product.version, *PRODUCT_VALUE_COLUMNS).where(*criteria)).first()
+        if row is None:
+            return None
+        if expected_version is not None and row.version != expected_version:
+            raise VersionConflictError(row.version)
+
+        values["current_stock"] = new_stock
+        if compare_and_swap(db, Product, product_id, row.version, values):
+            record_product_change(db, product_value(row), product_value(row, **values))
+            change = StockChange(product_id, row.current_stock, new_stock)
+            if record_movement and row.current_stock != new_stock:
+                _add_movement(db, change, restaurant_id, user_id, reason, reference_id, None)
+            return change
+
+        if expected_version is not None:
+            raise VersionConflictError()
+
+    raise VersionConflictError()
+
+
+def _add_movement(
+    db: Session,
+    change: StockChange,
+    restaurant_id: Optional[int],
+    user_id: Optional[int],
+    reason: Optional[str],
+    reference_id: Optional[str],
+    movement_type: Optional[StockMovementType]
+) -> None:
+    delta = change.new_stock - change.previous_stock
+    if movement_type is None:
+        movement_type = StockMovementType.IN if delta > 0 else StockMovementType.OUT
+
+    db.add(StockMovement(
+        product_id=change.product_id,
+        movement_type=movement_type,
+        quantity=abs(delta),
+        previous_stock=change.previous_stock,
+        new_stock=change.new_stock,
+        reason=reason,
+        reference_id=reference_id,
+        user_id=user_id,
+        restaurant_id=restaurant_id
+    ))
@@ -0,0 +1,62 @@
+"""
+Delta sync helpers (sync tokens and tombstones)
+Utilidades de sincronización incremental (tokens y registros eliminados)
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from backend.models.database import DeletedRecord
+
+# Rows changed this long before the previous sync are sent again, so writes
+# from transactions that were still open at that time are not missed
+SYNC_OVERLAP_SECONDS = 120
+
+# Tombstones are kept this long; older tokens get a full resync
+TOMBSTONE_RETENTION_DAYS = 30
+
+
+def db_now(db: Session) -> datetime:
+    """Current time on the database clock (the one that stamps created_at / updated_at)"""
+    now = db.query(func.now()).scalar()
+    if isinstance(now, str):
+        now = datetime.fromisoformat(now)
+    return now.replace(tzinfo=None)
+
+
+def encode_sync_token(synced_at: datetime, versions: Dict[str, int]) -> str:
+    raw = json.dumps({"t": synced_at.isoformat(), "v": versions}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_sync_token(token: str) -> Dict[str, Any]:
+    """Return {"since": datetime, "versions": {scope: version}}"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return {
+            "since": datetime.fromisoformat(data["t"]),
+            "versions": {str(k): int(v) for k, v in data["v"].items()}
+        }
+    except (ValueError, TypeError, KeyError, AttributeError, binascii.Error, UnicodeError):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+
+def record_deletion(db: Session, restaurant_id: Optional[int], entity_type: str, entity_id: int) -> None:
+    """Leave a tombstone for a hard-deleted row (committed with the delete)"""
+    db.add(DeletedRecord(restaurant_id=restaurant_id, entity_type=entity_type, entity_id=entity_id))
+
+
+def purge_tombstones(db: Session, restaurant_id: Optional[int]) -> None:
+    cutoff = db_now(db) - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    db.query(DeletedRecord).filter(
+        DeletedRecord.restaurant_id == restaurant_id,
+        DeletedRecord.deleted_at < cutoff
+    ).delete(synchronize_session=False)
@@ -0,0 +1,91 @@
+"""
+Upload handling
+Recepción de archivos subidos en bloques, con límite de tamaño
+
+Uploaded invoices are copied from the multipart spool (kept in memory only
+up to 1 MB by Starlette, then on disk) to a named file in CHUNK_SIZE
+pieces: the copy stops as soon as the size limit is passed, the SHA-256
+is computed on the way, and the type is taken from the file's leading
+bytes rather than the client's Content-Type. The OCR workers then open the
+file by path, so an upload is never held whole in memory.
+"""
+
+import asyncio
+import hashlib
+import os
+from typing import BinaryIO, NamedTuple, Optional
+
+from fastapi import UploadFile
+
+# Bytes copied per read
+CHUNK_SIZE = 1024 * 1024
+
+# Leading bytes of the accepted formats
+SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"PK\x03\x04", "application/zip"),
+)
+
+# PDF readers accept the header anywhere in the first kilobyte
+PDF_HEADER_WINDOW = 1024
+
+
+class UploadTooLarge(Exception):
+    """The upload exceeds its size limit"""
+
+
+class SavedFile(NamedTuple):
+    path: str
+    size: int
+    digest: str  # SHA-256
+    content_type: Optional[str]  # Sniffed, None when unknown
+
+
+def sniff_content_type(head: bytes) -> Optional[str]:
+    """Content type from a file's first bytes (PDF, JPEG, PNG or ZIP)"""
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if b"%PDF-" in head[:PDF_HEADER_WINDOW]:
+        return "application/pdf"
+    return None
+
+
+def save_stream(source: BinaryIO, target_path: str, max_bytes: int) -> SavedFile:
+    """Copy a readable stream to target_path in chunks (blocking).
+
+    Raises UploadTooLarge (and removes the partial file) past max_bytes.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    with open(target_path, "wb") as target:
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                break
+            if len(head) < PDF_HEADER_WINDOW:
+                head += chunk[:PDF_HEADER_WINDOW - len(head)]
+            digest.update(chunk)
+            target.write(chunk)
+
+    if size > max_bytes:
+        os.remove(target_path)
+        raise UploadTooLarge(f"More than {max_bytes} bytes")
+    return SavedFile(target_path, size, digest.hexdigest(), sniff_content_type(head))
+
+
+async def sniff_upload(upload: UploadFile) -> Optional[str]:
+    """Content type of an upload from its first bytes, leaving it at the start"""
+    head = await upload.read(PDF_HEADER_WINDOW)
+    await upload.seek(0)
+    return sniff_content_type(head)
+
+
+async def save_upload(upload: UploadFile, target_path: str, max_bytes: int) -> SavedFile:
+    """save_stream for an UploadFile, off the event loop"""
+    return await asyncio.to_thread(save_stream, upload.file, target_path, max_bytes)
@@ -0,0 +1,247 @@
+"""
+Incremental inventory valuation
+Valorización incremental del inventario (por categoría y proveedor)
+
+inventory_valuations keeps SUM(current_stock * cost_price) and the product
+count per (restaurant, category, provider). Every write that changes a
+product's stock, cost, category or provider applies the signed difference
+to it in the same transaction (the stock service and the product
+endpoints do this), so valuation summaries read a few dozen rows instead
+of the whole catalog. reconcile_valuations() recomputes the totals from
+products and corrects any drift (writes made outside the API); run it
+periodically with backend/scripts/reconcile_valuations.py.
+"""
+
+import logging
+from collections import defaultdict
+from decimal import Decimal
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import and_, func, select, type_coerce, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from backend.models.database import InventoryValuation, Product
+
+logger = logging.getLogger(__name__)
+
+# Stored in place of NULL category / provider (the unique key needs non-null columns)
+UNASSIGNED = 0
+
+# (restaurant_id, category_id, provider_id)
+ValuationKey = Tuple[int, int, int]
+
+
+class ProductValue(NamedTuple):
+    """The product fields the valuation depends on"""
+    restaurant_id: Optional[int]
+    category_id: Optional[int]
+    provider_id: Optional[int]
+    stock: Decimal
+    cost: Decimal
+
+    @property
+    def key(self) -> ValuationKey:
+        return (self.restaurant_id, self.category_id or UNASSIGNED, self.provider_id or UNASSIGNED)
+
+    @property
+    def value(self) -> Decimal:
+        return self.stock * self.cost
+
+
+def _decimal(value: Any) -> Decimal:
+    if value is None:
+        return Decimal("0")
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+def product_value(source: Any, **overrides) -> ProductValue:
+    """ProductValue of a Product (or a row with the same attribute names), with optional new values"""
+    def field(name: str, attribute: str):
+        return overrides[name] if name in overrides else getattr(source, attribute)
+
+    return ProductValue(
+        restaurant_id=field("restaurant_id", "restaurant_id"),
+        category_id=field("category_id", "category_id"),
+        provider_id=field("provider_id", "provider_id"),
+        stock=_decimal(field("current_stock", "current_stock")),
+        cost=_decimal(field("cost_price", "cost_price"))
+    )
+
+
+# Columns to select or return to build a ProductValue
+PRODUCT_VALUE_COLUMNS = (
+    Product.restaurant_id, Product.category_id, Product.provider_id, Product.current_stock, Product.cost_price
+)
+
+
+def apply_valuation_deltas(db: Session, deltas: Dict[ValuationKey, List[Decimal]]) -> None:
+    """Add {key: [value_delta, count_delta]} to the aggregate rows (upsert, not committed)"""
+    rows = [
+        {
+            "restaurant_id": key[0],
+            "category_id": key[1],
+            "provider_id": key[2],
+            "total_value": value_delta,
+            "product_count": int(count_delta),
+        }
+        # Fixed key order, so concurrent writers lock the rows in the same order
+        for key, (value_delta, count_delta) in sorted(deltas.items())
+        if key[0] is not None and (value_delta != 0 or count_delta != 0)
+    ]
+    if not rows:
+        return
+
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = dialect_insert(InventoryValuation)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["restaurant_id", "category_id", "provider_id"],
+            set_={
+                "total_value": InventoryValuation.total_value + stmt.excluded.total_value,
+                "product_count": InventoryValuation.product_count + stmt.excluded.product_count,
+                "updated_at": func.now(),
+            }
+        )
+        for row in rows:
+            db.execute(stmt, row)
+        return
+
+    for row in rows:
+        matched = db.execute(
+            update(InventoryValuation).where(
+                InventoryValuation.restaurant_id == row["restaurant_id"],
+                InventoryValuation.category_id == row["category_id"],
+                InventoryValuation.provider_id == row["provider_id"]
+            ).values(
+                total_value=InventoryValuation.total_value + row["total_value"],
+                product_count=InventoryValuation.product_count + row["product_count"]
+            ),
+            execution_options={"synchronize_session": False}
+        ).rowcount
+        if not matched:
+            db.add(InventoryValuation(**row))
+    db.flush()
+
+
+def record_product_changes(db: Session, changes: List[Tuple[Optional[ProductValue], Optional[ProductValue]]]) -> None:
+    """Apply (before, after) pairs: None before is a new product, None after a deleted one"""
+    deltas: Dict[ValuationKey, List[Decimal]] = defaultdict(lambda: [Decimal("0"), 0])
+    for before, after in changes:
+        if before is not None:
+            deltas[before.key][0] -= before.value
+            deltas[before.key][1] -= 1
+        if after is not None:
+            deltas[after.key][0] += after.value
+            deltas[after.key][1] += 1
+    apply_valuation_deltas(db, deltas)
+
+
+def record_product_change(db: Session, before: Optional[ProductValue], after: Optional[ProductValue]) -> None:
+    record_product_changes(db, [(before, after)])
+
+
+def record_stock_delta(db: Session, product: ProductValue, delta: Decimal) -> None:
+    """Stock moved by `delta` at the product's cost (category and provider unchanged)"""
+    apply_valuation_deltas(db, {product.key: [delta * product.cost, 0]})
+
+
+def inventory_totals(db: Session, restaurant_id: int) -> Tuple[int, Decimal]:
+    """(product count, inventory value) of a restaurant"""
+    count, value = db.query(
+        func.sum(InventoryValuation.product_count),
+        func.sum(InventoryValuation.total_value)
+    ).filter(InventoryValuation.restaurant_id == restaurant_id).one()
+    return int(count or 0), _decimal(value)
+
+
+def valuation_totals(db: Session, restaurant_id: int, group_by: str = "category") -> Dict[int, Dict[str, Any]]:
+    """{category_id or provider_id: {"product_count", "total_value"}} from the aggregate rows"""
+    column = InventoryValuation.category_id if group_by == "category" else InventoryValuation.provider_id
+    rows = db.query(
+        column,
+        func.sum(InventoryValuation.product_count),
+        func.sum(InventoryValuation.total_value)
+    ).filter(
+        InventoryValuation.restaurant_id == restaurant_id
+    ).group_by(column).all()
+    return {
+        key: {"product_count": int(count or 0), "total_value": _decimal(value)}
+        for key, count, value in rows
+    }
+
+
+def reconcile_valuations(db: Session, restaurant_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Recompute the aggregates from products and apply the corrections.
+
+    Returns the keys that had drifted. Products and stored aggregates are
+    compared in one statement (a FULL OUTER JOIN), so both sides come from
+    the same snapshot: a product write committed meanwhile is seen with its
+    valuation delta or not at all. Corrections are applied as deltas, so
+    writes running at the same time are not overwritten.
+    """
+    category = func.coalesce(Product.category_id, UNASSIGNED)
+    provider = func.coalesce(Product.provider_id, UNASSIGNED)
+    actual_query = select(
+        Product.restaurant_id.label("restaurant_id"),
+        category.label("category_id"),
+        provider.label("provider_id"),
+        func.count(Product.id).label("product_count"),
+        # Typed as the stored column: the operands' scale (2) would round the sum on read
+        type_coerce(
+            func.sum(func.coalesce(Product.current_stock, 0) * func.coalesce(Product.cost_price, 0)),
+            InventoryValuation.total_value.type
+        ).label("total_value")
+    ).where(Product.restaurant_id.isnot(None)).group_by(Product.restaurant_id, category, provider)
+    stored_query = select(
+        InventoryValuation.restaurant_id, InventoryValuation.category_id, InventoryValuation.provider_id,
+        InventoryValuation.product_count, InventoryValuation.total_value
+    )
+    if restaurant_id is not None:
+        actual_query = actual_query.where(Product.restaurant_id == restaurant_id)
+        stored_query = stored_query.where(InventoryValuation.restaurant_id == restaurant_id)
+
+    actual = actual_query.subquery()
+    stored = stored_query.subquery()
+    rows = db.execute(
+        select(
+            func.coalesce(actual.c.restaurant_id, stored.c.restaurant_id),
+            func.coalesce(actual.c.category_id, stored.c.category_id),
+            func.coalesce(actual.c.provider_id, stored.c.provider_id),
+            actual.c.product_count, actual.c.total_value,
+            stored.c.product_count, stored.c.total_value
+        ).select_from(
+            actual.join(
+                stored,
+                and_(
+                    actual.c.restaurant_id == stored.c.restaurant_id,
+                    actual.c.category_id == stored.c.category_id,
+                    actual.c.provider_id == stored.c.provider_id
+                ),
+                full=True
+            )
+        )
+    ).all()
+
+    deltas = {}
+    drift = []
+    for r, c, p, actual_count, actual_value, stored_count, stored_value in rows:
+        key = (r, c, p)
+        actual_count, actual_value = int(actual_count or 0), _decimal(actual_value)
+        stored_count, stored_value = int(stored_count or 0), _decimal(stored_value)
+        # Stored values are rounded to 5 decimals; ignore differences below that
+        value_delta = (actual_value - stored_value).quantize(Decimal("0.00001"))
+        if value_delta == 0 and actual_count == stored_count:
+            continue
+        deltas[key] = [value_delta, actual_count - stored_count]
+        drift.append({
+            "restaurant_id": key[0], "category_id": key[1], "provider_id": key[2],
+            "count_delta": actual_count - stored_count, "value_delta": float(value_delta)
+        })
+
+    apply_valuation_deltas(db, deltas)
+    db.commit()
+    if drift:
+        logger.warning(f"Inventory valuation drift corrected for {len(drift)} key(s)")
+    return drift
@@ -0,0 +1,8 @@
+-- Composite indexes for keyset (cursor) pagination on list endpoints
+-- Índices compuestos para paginación por cursor
+-- Base.metadata.create_all() only creates them for new tables; run this on existing databases.
+
+CREATE INDEX IF NOT EXISTS ix_products_restaurant_name_id ON products (restaurant_id, name, id);
+CREATE INDEX IF NOT EXISTS ix_waste_logs_restaurant_created_id ON waste_logs (restaurant_id, created_at, id);
+CREATE INDEX IF NOT EXISTS ix_invoices_restaurant_created_id ON invoices (restaurant_id, created_at, id);
+CREATE INDEX IF NOT EXISTS ix_physical_counts_restaurant_started_id ON physical_counts (restaurant_id, started_at, id);
@@ -0,0 +1,6 @@
+-- Delta sync: change-tracking indexes on products
+-- Sincronización incremental: índices para cambios en productos
+-- The deleted_records table is created by Base.metadata.create_all().
+
+CREATE INDEX IF NOT EXISTS ix_products_restaurant_updated_at ON products (restaurant_id, updated_at);
+CREATE INDEX IF NOT EXISTS ix_products_restaurant_created_at ON products (restaurant_id, created_at);
@@ -0,0 +1,5 @@
+-- Optimistic concurrency: version counters checked and bumped on every update
+-- Concurrencia optimista: columna version en productos e items de conteo
+
+ALTER TABLE products ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE physical_count_items ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
@@ -0,0 +1,72 @@
+-- Monthly range partitions on created_at for stock_movements and waste_logs
+-- Particiones mensuales por created_at para movimientos de stock y mermas
+--
+-- Each table is rebuilt as a partitioned table with the same columns, one
+-- partition per month that has data (plus the next two months) and a DEFAULT
+-- partition as a safety net. Later months are created at startup by
+-- backend.utils.partitions.ensure_partitions(); closed months are archived and
+-- dropped by `python -m backend.scripts.archive_history`.
+-- The archived_periods table is created by Base.metadata.create_all().
+-- Run in a maintenance window: the tables are locked while rows are copied.
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION pg_temp.partition_monthly(tbl text) RETURNS void AS $$
+DECLARE
+    first_month date;
+    last_month date := (date_trunc('month', now()) + interval '2 months')::date;
+    month date;
+BEGIN
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', tbl, tbl || '_unpartitioned');
+    EXECUTE format('ALTER INDEX %I RENAME TO %I', tbl || '_pkey', tbl || '_unpartitioned_pkey');
+    EXECUTE format('ALTER TABLE %I ALTER COLUMN created_at SET DEFAULT now()', tbl || '_unpartitioned');
+    EXECUTE format('UPDATE %I SET created_at = now() WHERE created_at IS NULL', tbl || '_unpartitioned');
+
+    -- Same columns and defaults (the id default keeps using the existing sequence)
+    EXECUTE format(
+        'CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (created_at)',
+        tbl, tbl || '_unpartitioned'
+    );
+    EXECUTE format('ALTER TABLE %I ALTER COLUMN created_at SET NOT NULL', tbl);
+    -- The partition key must be part of the primary key
+    EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (id, created_at)', tbl);
+    EXECUTE format('ALTER SEQUENCE %I OWNED BY %I.id', tbl || '_id_seq', tbl);
+
+    EXECUTE format('SELECT date_trunc(''month'', min(created_at))::date FROM %I', tbl || '_unpartitioned')
+        INTO first_month;
+    month := coalesce(first_month, date_trunc('month', now())::date);
+    WHILE month <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+            tbl || '_' || to_char(month, 'YYYY_MM'), tbl, month, (month + interval '1 month')::date
+        );
+        month := (month + interval '1 month')::date;
+    END LOOP;
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', tbl || '_default', tbl);
+
+    EXECUTE format('INSERT INTO %I SELECT * FROM %I', tbl, tbl || '_unpartitioned');
+    EXECUTE format('DROP TABLE %I', tbl || '_unpartitioned');
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT pg_temp.partition_monthly('stock_movements');
+SELECT pg_temp.partition_monthly('waste_logs');
+
+-- Indexes on the parent are created on every partition (existing and future)
+CREATE INDEX ix_stock_movements_id ON stock_movements (id);
+CREATE INDEX ix_stock_movements_restaurant_created ON stock_movements (restaurant_id, created_at);
+CREATE INDEX ix_stock_movements_product_created ON stock_movements (product_id, created_at);
+CREATE INDEX ix_waste_logs_id ON waste_logs (id);
+CREATE INDEX ix_waste_logs_restaurant_created_id ON waste_logs (restaurant_id, created_at, id);
+CREATE INDEX ix_waste_logs_product_created ON waste_logs (product_id, created_at);
+
+ALTER TABLE stock_movements
+    ADD FOREIGN KEY (product_id) REFERENCES products (id),
+    ADD FOREIGN KEY (user_id) REFERENCES users (id),
+    ADD FOREIGN KEY (restaurant_id) REFERENCES restaurants (id);
+ALTER TABLE waste_logs
+    ADD FOREIGN KEY (product_id) REFERENCES products (id),
+    ADD FOREIGN KEY (user_id) REFERENCES users (id),
+    ADD FOREIGN KEY (restaurant_id) REFERENCES restaurants (id);
+
+COMMIT;
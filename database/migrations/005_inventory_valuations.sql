@@ -0,0 +1,18 @@
+-- Inventory valuation aggregates per (restaurant, category, provider)
+-- Valorización agregada del inventario por categoría y proveedor
+-- The inventory_valuations table is created by Base.metadata.create_all();
+-- this fills it for existing products. Afterwards it is maintained by the
+-- API and checked by `python -m backend.scripts.reconcile_valuations`.
+
+INSERT INTO inventory_valuations (restaurant_id, category_id, provider_id, product_count, total_value)
+SELECT restaurant_id,
+       coalesce(category_id, 0),
+       coalesce(provider_id, 0),
+       count(*),
+       coalesce(sum(coalesce(current_stock, 0) * coalesce(cost_price, 0)), 0)
+FROM products
+WHERE restaurant_id IS NOT NULL
+GROUP BY restaurant_id, coalesce(category_id, 0), coalesce(provider_id, 0)
+ON CONFLICT (restaurant_id, category_id, provider_id) DO UPDATE
+SET product_count = EXCLUDED.product_count,
+    total_value = EXCLUDED.total_value;